@@ -368,7 +368,7 @@ class JuMEG_Epocher_CTPS(JuMEG_Epocher_Events):
               jfi_bw.verbose = self.verbose
               jfi_bw.apply_filter(ica._data)
 
-              pk_dynamics_key = stst_key +'/pk_dynamics/'+ self.ctps_freq_bands_list[idx_freq]
+              pk_dynamics_key = stst_key +'/pkd'
 
               ica_epochs = mne.Epochs(ica,events=ev,event_id=ev_id,
                                       tmin=self.ctps_hdf_parameter['time_pre'],
@@ -390,13 +390,13 @@ class JuMEG_Epocher_CTPS(JuMEG_Epocher_Events):
              #    is False, None is returned.
 
               if save_phase_angles :
-                 phase_angles_key = stst_key +'/phase_angle/'+ self.ctps_freq_bands_list[idx_freq]
                  _,pk_dynamics_f64,phase_angles_f64 = ctps( ica_epochs.get_data() )
-                 self.HDFobj[ phase_angles_key ]= pd.Panel( (phase_angles_f64 * self.ctps_hdf_parameter['scale_factor'])).astype( np.int16 )
+                 self.ctps_hdf_array_update(stst_key +'/phase_angles',idx_freq,phase_angles_f64)
 
               else :
                  _,pk_dynamics_f64,_ = ctps( ica_epochs.get_data() )
-                 self.HDFobj[pk_dynamics_key] = pd.DataFrame( (pk_dynamics_f64 * self.ctps_hdf_parameter['scale_factor']) ).astype( np.int16 )
+
+              self.ctps_hdf_array_update(pk_dynamics_key,idx_freq,pk_dynamics_f64)
 
               print " ---> done Steady-State Artifact -> "+ pk_dynamics_key
               print "Max : %f" % ( pk_dynamics_f64.max() )
@@ -410,12 +410,279 @@ class JuMEG_Epocher_CTPS(JuMEG_Epocher_Events):
 
           return fhdr
 
+      def ctps_update_condition_hdf(self,condi,artifact_events=None,ctps_parameter=None):
+          """
+          init HDF node /ctps/<condition>: freq bands, events, ctps_hdf_parameter as attribute
+          if the node exists: read events and ctps_hdf_parameter
+
+          :param condi: condition
+          :param artifact_events:
+          :param ctps_parameter:
+          :return: stim dict with mne events
+          """
+          ctps_key = '/ctps/' + condi
+          stim     = dict()
+
+          if not( ctps_key in self.HDFobj.keys() ):
+
+             print"---> NEW HDF key: " + ctps_key
+
+             stim,ep_param,info_param = self.ctps_update_condition_parameter(condi,artifact_events)
+             self.ctps_update_ctps_hdf_parameter_time(ctps_parameter=ctps_parameter,ep_param=ep_param)
+
+             self.HDFobj[ctps_key] = pd.DataFrame( self.ctps_freq_bands ).astype(np.int16)
+
+             Hstorer   = self.HDFobj.get_storer(ctps_key)
+             Hstorer.attrs['ctps_hdf_parameter'] = self.ctps_hdf_parameter
+             self.HDFobj[ctps_key+'/events'] = pd.Series( stim['events'][:,0] ).astype(np.int32)
+
+             self.HDFobj.flush()
+
+             print"--->done update storer: " + ctps_key
+
+          else:
+             ev = self.HDFobj.get(ctps_key+'/events')
+             Hstorer = self.HDFobj.get_storer(ctps_key)
+             self.ctps_hdf_parameter = Hstorer.attrs.ctps_hdf_parameter
+
+             stim['events'] = np.zeros(( ev.size, 3), dtype=np.float64)
+             stim['events'][:,0]= ev
+             stim['events'][:,2]= self.idx_hit
+
+          return stim
+
+      def ctps_calc_epoch_index(self,raw,events,event_id=None,tmin=None,tmax=None,baseline=None):
+          """
+          epoch windows in raw._data like mne.Epochs(raw,events,event_id,tmin,tmax,baseline)
+          events with event id == event_id and window within the data
+
+          :param raw: raw obj
+          :param events: mne events
+          :param event_id: event id
+          :param tmin: start of epoch in sec
+          :param tmax: end of epoch in sec
+          :param baseline: baseline interval in sec (a,b) or None
+          :return: dict: tsl => index of epoch windows [epochs,timeslices], baseline => index range (i0,i1) or None
+                         baseline_picks => channels with baseline correction, data channels like mne (no misc e.g. IC's)
+          """
+          idx,tsl0,start,n = self.events_calc_epoch_index(raw,events,event_id,tmin,tmax)
+          tsl0  = tsl0[idx]
+          times = np.arange(start,start+n) / raw.info['sfreq']
+
+          bc       = None
+          bc_picks = mne.pick_types(raw.info,meg=True,eeg=True,ref_meg=True,eog=True,ecg=True,emg=True,seeg=True,ecog=True,exclude=[])
+          if ( baseline is not None ) and bc_picks.size:
+             bmin = times[0]  if baseline[0] is None else baseline[0]
+             bmax = times[-1] if baseline[1] is None else baseline[1]
+             bc   = ( np.where(times >= bmin)[0][0],np.where(times <= bmax)[0][-1] + 1 )
+
+          return {'tsl': tsl0[:,np.newaxis] + np.arange(n),'baseline':bc,'baseline_picks':bc_picks}
+
+      def ctps_calc_band(self,idx_freq,fbank,spec,dmean,condi_epochs,save_phase_angles=False):
+          """
+          band worker: band-limited IC's data from the filter bank spectrum, epochs and CTPS for all conditions
+          no HDF access => runs in worker threads
+          results are scaled by the condition's <scale_factor> and stored as int16 like in HDF,
+          the float64 CTPS arrays of a condition are freed before the next condition
+
+          :param idx_freq: index of band
+          :param fbank: JuMEG_Filter_Bank obj
+          :param spec: filter bank spectrum of IC's data
+          :param dmean: DC offset of IC's data
+          :param condi_epochs: list of (condition, epoch index dict from <ctps_calc_epoch_index>, scale_factor)
+          :param save_phase_angles:
+          :return: index of band, list of (condition, pk_dynamics int16, phase_angles int16 or None)
+          """
+          data    = fbank.calc_filter_bank_band(spec,dmean,idx_freq)
+          results = []
+
+          for condi,ep,scale_factor in condi_epochs:
+             #--- epochs [epochs,ICs,timeslices]
+              d = data[:,ep['tsl']].transpose(1,0,2)
+              if ep['baseline'] is not None:
+                 i0,i1 = ep['baseline']
+                 d  = d.copy()
+                 bp = ep['baseline_picks']
+                 d[:,bp,:] -= d[:,bp,i0:i1].mean(axis=-1)[:,:,np.newaxis]
+
+              _,pk_dynamics_f64,phase_angles_f64 = ctps( d )
+              del d
+              pk_dynamics = self.ctps_hdf_scale(pk_dynamics_f64,scale_factor)
+              phase_angles= None
+              if save_phase_angles :
+                 phase_angles = self.ctps_hdf_scale(phase_angles_f64,scale_factor)
+              del pk_dynamics_f64,phase_angles_f64
+
+              results.append( (condi,pk_dynamics,phase_angles) )
+
+          if self.verbose:
+             print " ---> done CTPS  Filter Band ==> %d  / %d\n" % (idx_freq+1, self.ctps_freq_bands.shape[0] )
+
+          return idx_freq,results
+
+      def ctps_calc_band_epochs(self,idx_freq,ica_orig,condi_stim,filter_method="bw",remove_dcoffset=False,njobs=None,
+                                proj=False,save_phase_angles=False):
+          """
+          band worker: copy of IC's data filtered within the band, mne.Epochs and CTPS for all conditions
+          no HDF access => runs in worker threads, each worker holds its own copy of IC's data
+          results are scaled by the condition's <scale_factor> and stored as int16 like in HDF
+
+          :param idx_freq: index of band
+          :param ica_orig: IC's raw obj, not changed
+          :param condi_stim: list of (condition, mne events, ctps_hdf_parameter of the condition)
+          :param filter_method:
+          :param remove_dcoffset:
+          :param njobs: filter threads
+          :param proj: apply projections in mne.Epochs
+          :param save_phase_angles:
+          :return: index of band, list of (condition, pk_dynamics int16, phase_angles int16 or None)
+          """
+         #--- bw-bp-filter-obj per band => no shared filter state between worker threads
+          jfi_bw = jumeg_filter(filter_method=filter_method,filter_type='bp',fcut1=None,fcut2=None,remove_dcoffset=remove_dcoffset,njobs=njobs)
+          jfi_bw.sampling_frequency = self.ica_raw.info['sfreq']
+          jfi_bw.fcut1   = self.ctps_freq_bands[idx_freq][0]
+          jfi_bw.fcut2   = self.ctps_freq_bands[idx_freq][1]
+          jfi_bw.verbose = self.verbose
+
+         #--- get fresh IC's data & filter inplace
+          ica = ica_orig.copy()
+          jfi_bw.apply_filter(ica._data)
+
+          results = []
+          for condi,events,param in condi_stim:
+             #--- make epochs
+              ica_epochs = mne.Epochs(ica,events=events,picks=self.ica_picks,
+                                      event_id=param['event_id'],
+                                      tmin=param['time_pre'],
+                                      tmax=param['time_post'],
+                                      baseline=param['baseline'],verbose=self.verbose,proj=proj)
+             #--- compute CTPS
+             #--- pk_dynamics : ndarray, shape (n_sources, n_times)
+             #     The normalized kuiper index for ICA sources and time slices.
+             #--- phase_angles : ndarray, (n_epochs, n_sources, n_times)
+             #     The phase values for epochs, sources and time slices.
+              _,pk_dynamics_f64,phase_angles_f64 = ctps( ica_epochs.get_data() )
+              del ica_epochs
+              pk_dynamics = self.ctps_hdf_scale(pk_dynamics_f64,param['scale_factor'])
+              phase_angles= None
+              if save_phase_angles :
+                 phase_angles = self.ctps_hdf_scale(phase_angles_f64,param['scale_factor'])
+              del pk_dynamics_f64,phase_angles_f64
+
+              results.append( (condi,pk_dynamics,phase_angles) )
+
+          del ica
+          if self.verbose:
+             print " ---> done CTPS  Filter Band ==> %d  / %d\n" % (idx_freq+1, self.ctps_freq_bands.shape[0] )
+
+          return idx_freq,results
+
+      def ctps_brain_responses_bands(self,ica_orig,condition_list,artifact_events=None,ctps_parameter=None,
+                                     filter_bank=False,filter_method="bw",remove_dcoffset=False,njobs=None,
+                                     band_jobs=1,proj=False,save_phase_angles=False):
+          """
+          CTPS for all bands and conditions, bands are processed in <band_jobs> worker threads,
+          results are written to HDF in this thread in band order, see <ctps_iter_bands>
+          => HDF is the same for any number of band_jobs
+           filter_bank False: each band filters a copy of IC's data, mne.Epochs per condition <ctps_calc_band_epochs>
+           filter_bank True : IC's data are transformed once by a shared filter bank <ctps_calc_band>,
+                              check with <events_ck_raw_data> first
+
+          :param ica_orig: IC's raw obj
+          :param condition_list:
+          :param artifact_events:
+          :param ctps_parameter:
+          :param filter_bank: use a shared filter bank
+          :param filter_method: filter method of the per-band filter, filter_bank False
+          :param remove_dcoffset:
+          :param njobs: filter threads
+          :param band_jobs: number of band worker threads
+          :param proj: apply projections in mne.Epochs, filter_bank False
+          :param save_phase_angles:
+          :return:
+          """
+          from jumeg.filter.jumeg_filter_bank import JuMEG_Filter_Bank
+
+         #--- init conditions: HDF nodes, events are the same for all bands
+          condi_stim  = []
+          condi_param = dict()
+          for condi in condition_list:
+              stim = self.ctps_update_condition_hdf(condi,artifact_events=artifact_events,ctps_parameter=ctps_parameter)
+              condi_param[condi] = dict( self.ctps_hdf_parameter )
+              condi_stim.append( (condi,stim['events'],condi_param[condi]) )
+
+          if filter_bank:
+            #--- epoch windows
+             condi_epochs = [ (condi,self.ctps_calc_epoch_index(ica_orig,events,event_id=param['event_id'],
+                                                                tmin=param['time_pre'],tmax=param['time_post'],
+                                                                baseline=param['baseline']),
+                               param['scale_factor']) for condi,events,param in condi_stim ]
+
+            #--- filter bank: IC's spectrum once
+             fbank = JuMEG_Filter_Bank(bands=self.ctps_freq_bands,filter_type='bp',remove_dcoffset=remove_dcoffset,
+                                       sampling_frequency=self.ica_raw.info['sfreq'],n_jobs=njobs or 1)
+             fbank.verbose = self.verbose
+             spec,dmean = fbank.init_filter_bank_spectrum(ica_orig._data,picks=self.ica_picks)
+
+             def calc_band(idx_freq):
+                 return self.ctps_calc_band(idx_freq,fbank,spec,dmean,condi_epochs,save_phase_angles=save_phase_angles)
+          else:
+             def calc_band(idx_freq):
+                 return self.ctps_calc_band_epochs(idx_freq,ica_orig,condi_stim,filter_method=filter_method,
+                                                   remove_dcoffset=remove_dcoffset,njobs=njobs,proj=proj,
+                                                   save_phase_angles=save_phase_angles)
+
+         #--- HDF writer: band order
+          for idx_freq,results in self.ctps_iter_bands(calc_band,band_jobs=band_jobs):
+              print " ---> CTPS  Filter Band ==> %d  / %d\n" % (idx_freq+1, self.ctps_freq_bands.shape[0] )
+              print self.ctps_freq_bands[idx_freq]
+              for condi,pk_dynamics,phase_angles in results:
+                  ctps_key = '/ctps/' + condi
+                  self.ctps_hdf_parameter = condi_param[condi]
+                  if phase_angles is not None:
+                     self.ctps_hdf_array_update(ctps_key +'/phase_angles',idx_freq,phase_angles)
+                  self.ctps_hdf_array_update(ctps_key +'/pkd',idx_freq,pk_dynamics)
+
+              self.HDFobj.flush()
+
+      def ctps_iter_bands(self,calc_band,band_jobs=1):
+          """
+          results of calc_band(idx_freq) for all bands in band order
+          band_jobs > 1 => calc_band runs in <band_jobs> worker threads,
+          at most <band_jobs> bands are computed ahead of the consumer (HDF writer)
+          => memory is bounded by band_jobs, not by the number of bands
+
+          :param calc_band: band worker, function of the band index
+          :param band_jobs: number of band worker threads
+          :return: generator of calc_band results
+          """
+          n_bands   = self.ctps_freq_bands.shape[0]
+          band_jobs = max(1,min(int(band_jobs),n_bands))
+          if band_jobs == 1:
+             for idx_freq in range(n_bands):
+                 yield calc_band(idx_freq)
+             return
+
+          from collections import deque
+          from multiprocessing.pool import ThreadPool
+          pool = ThreadPool(band_jobs)
+          try:
+             pending = deque( pool.apply_async(calc_band,(idx_freq,)) for idx_freq in range(band_jobs) )
+             for idx_freq in range(band_jobs,n_bands + band_jobs):
+                 result = pending.popleft().get()
+                 if idx_freq < n_bands:
+                    pending.append( pool.apply_async(calc_band,(idx_freq,)) )
+                 yield result
+          finally:
+             pool.close()
+             pool.join()
+
 #===============================================================
       def ctps_ica_brain_responses_update(self,fname,raw=None,fname_ica=None,ica_raw=None,template_name=None,condition_list=None,
                                  filter_method="bw",remove_dcoffset=False,njobs=None,
                                  freq_ctps=np.array([]),fmin=4,fmax=32,fstep=8,proj=False,exclude_events=None,
                                  ctps_parameter = {'time_pre':None,'time_post':None,'baseline':None},
-                                 save_phase_angles=False,fif_extention=".fif",fif_postfix="ctps"):
+                                 save_phase_angles=False,fif_extention=".fif",fif_postfix="ctps",filter_bank=False,band_jobs=1):
           """
 
           :param fname:
@@ -437,6 +704,11 @@ class JuMEG_Epocher_CTPS(JuMEG_Epocher_Events):
           :param save_phase_angles:
           :param fif_extention:
           :param fif_postfix:
+          :param filter_bank: filter bands with a shared filter bank (IC's data transformed once) <False>
+                              <bad> annotations or projections to apply (proj) => mne.Epochs per band, no filter bank
+          :param band_jobs: number of worker threads for bands <1>
+                            results are written in band order, HDF is the same as for band_jobs=1 (same filter_bank)
+                            filter_bank False: each worker filters its own copy of IC's data
           :return:
           """
 
@@ -446,11 +718,6 @@ class JuMEG_Epocher_CTPS(JuMEG_Epocher_Events):
 
           artifact_events = self.ctps_update_artifact_time_window(aev=exclude_events)
 
-       #--- init/define bw-bp-filter-obj for ctps  to filter ica_raw data within freq bands
-          jfi_bw = jumeg_filter(filter_method=filter_method,filter_type='bp',fcut1=None,fcut2=None,remove_dcoffset=remove_dcoffset,njobs=njobs)
-          jfi_bw.sampling_frequency = self.ica_raw.info['sfreq']
-
-
           epocher_condition_list = self.ctps_update_hdf_condition_list(condition_list)
 
           for condi in epocher_condition_list:
@@ -460,100 +727,16 @@ class JuMEG_Epocher_CTPS(JuMEG_Epocher_Events):
           print " ---> get ica sources ...\n"
           ica_orig = self.ica_raw.get_sources(self.raw)
 
-       #---for filter bands
-          for idx_freq in range( self.ctps_freq_bands.shape[0] ):
-              print " ---> START CTPS  Filter Band ==> %d  / %d\n" % (idx_freq+1, self.ctps_freq_bands.shape[0]+1 )
-              print self.ctps_freq_bands[idx_freq]
-
-          #--- get fresh IC's data & filter inplace
-              print " ---> copy ica sources ...\n"
-              ica = ica_orig.copy() # self.ica_raw.get_sources(self.raw)
-
-              print " ---> apply filter ...\n"
-              jfi_bw.fcut1 = self.ctps_freq_bands[idx_freq][0]
-              jfi_bw.fcut2 = self.ctps_freq_bands[idx_freq][1]
-              jfi_bw.verbose = self.verbose
-              jfi_bw.apply_filter(ica._data)
-
-
-          #--- for epocher condition
-              for condi in epocher_condition_list:
-
-                  print " ---> START condition : " + condi + " CTPS  Filter Band ==> %d  / %d \n" % (idx_freq+1, self.ctps_freq_bands.shape[0] )
-                  ctps_key = '/ctps/' + condi
-
-                  #stim,ep_param,info_param = self.ctps_update_condition_parameter(condi,artifact_events)
-
-                  #self.ctps_update_ctps_hdf_parameter_time(ctps_parameter=ctps_parameter,ep_param=ep_param)
-
-                  if not( ctps_key in self.HDFobj.keys() ):
-
-                     print"---> NEW HDF key: " + ctps_key
-
-                     stim,ep_param,info_param = self.ctps_update_condition_parameter(condi,artifact_events)
-                     self.ctps_update_ctps_hdf_parameter_time(ctps_parameter=ctps_parameter,ep_param=ep_param)
-
-                     self.HDFobj[ctps_key] = pd.DataFrame( self.ctps_freq_bands ).astype(np.int16)
-
-                     Hstorer   = self.HDFobj.get_storer(ctps_key)
-                     Hstorer.attrs['ctps_hdf_parameter'] = self.ctps_hdf_parameter
-                     self.HDFobj[ctps_key+'/events'] = pd.Series( stim['events'][:,0] ).astype(np.int32)
-
-                      # d=np.zeros( [ len(self.ctps_freq_bands_list ),248,1000 ] ).astype(np.int16)
-
+       #--- shared filter bank => same epochs as mne.Epochs only without <bad> annotations and projections to apply
+          if filter_bank and not self.events_ck_raw_data(ica_orig,projs=not proj):
+             print " ---> <bad> annotations or projections in IC's raw => no filter bank, mne.Epochs per band\n"
+             filter_bank = False
 
-                     self.HDFobj.flush()
-
-                     print"--->done update storer: " + ctps_key
-
-                  else:
-                     ev = self.HDFobj.get(ctps_key+'/events')
-                     Hstorer = self.HDFobj.get_storer(ctps_key)
-                     self.ctps_hdf_parameter = Hstorer.attrs.ctps_hdf_parameter
-
-                     stim['events'] = np.zeros(( ev.size, 3), dtype=np.float64)
-                     stim['events'][:,0]= ev
-                     stim['events'][:,2]= self.idx_hit
-
-                  #pk_dynamics_key = ctps_key +'/pk_dynamics'
-                  pk_dynamics_key = ctps_key +'/pk_dynamics/'+ self.ctps_freq_bands_list[idx_freq]
-
-                 #--- make epochs
-                  # print self.ctps_hdf_parameter
-                  ica_epochs = mne.Epochs(ica,events=stim['events'],picks=self.ica_picks,
-                                          event_id=self.ctps_hdf_parameter['event_id'],
-                                          tmin=self.ctps_hdf_parameter['time_pre'],
-                                          tmax=self.ctps_hdf_parameter['time_post'],
-                                          baseline=self.ctps_hdf_parameter['baseline'],verbose=self.verbose,proj=proj)
-                 #--- compute CTPS
-                 #-------
-                 #--- ks_dynamics : ndarray, shape (n_sources, n_times)
-                 #     The kuiper statistics.
-                 #--- pk_dynamics : ndarray, shape (n_sources, n_times)
-                 #     The normalized kuiper index for ICA sources and
-                 #     time slices.
-                 #--- phase_angles : ndarray, (n_epochs, n_sources, n_times) | None
-                 #     The phase values for epochs, sources and time slices. If ``assume_raw``
-                 #    is False, None is returned.
-
-                  print " ---> apply compute_ctps ...\n"
-
-                  if save_phase_angles :
-                     phase_angles_key = ctps_key +'/phase_angle/'+ self.ctps_freq_bands_list[idx_freq]
-                     _,pk_dynamics_f64,phase_angles_f64 = ctps( ica_epochs.get_data() )
-                     #_,pk_dynamics_f64,phase_angles_f64 = ctps.compute_ctps( ica_epochs.get_data() )
-
-                     self.HDFobj[ phase_angles_key ]= pd.Panel( (phase_angles_f64 * self.ctps_hdf_parameter['scale_factor'])).astype( np.int16 )
-
-                  else :
-                     _,pk_dynamics_f64,_ = ctps( ica_epochs.get_data() )
-                   #_,pk_dynamics_f64,_ = ctps.compute_ctps( ica_epochs.get_data() )
-
-                  self.HDFobj[pk_dynamics_key] = pd.DataFrame( (pk_dynamics_f64 * self.ctps_hdf_parameter['scale_factor']) ).astype( np.int16 )
-
-                  self.HDFobj.flush()
-
-                 # print self.HDFobj[pk_dynamics_key].transpose().max()
+       #--- for filter bands, <band_jobs> worker threads
+          self.ctps_brain_responses_bands(ica_orig,epocher_condition_list,artifact_events=artifact_events,
+                                          ctps_parameter=ctps_parameter,filter_bank=filter_bank,filter_method=filter_method,
+                                          remove_dcoffset=remove_dcoffset,njobs=njobs,band_jobs=band_jobs,proj=proj,
+                                          save_phase_angles=save_phase_angles)
 
           fhdr = self.HDFobj.filename
           self.HDFobj.close()
@@ -609,14 +792,12 @@ class JuMEG_Epocher_CTPS(JuMEG_Epocher_Events):
 
               ics = np.zeros(HST.attrs['ctps_hdf_parameter']['ncomp'], dtype=np.bool)
 
-              for node in self.HDFobj.get_node(ctps_key+'/pk_dynamics'):
-                  df_pkd = self.HDFobj.select(node._v_pathname).copy()
-
-                  df_pkd[ df_pkd < self.ctps_pkd_theshold] = 0
-                  df_pkd[ df_pkd > 0 ] = 1
-                  d1 = np.array( np.where(df_pkd > 0))
+             #--- read only ICs not selected yet
+              for idx_band,ics_idx,pkd in self.ctps_hdf_iter_pk_dynamics(ctps_key,ics=ics):
+                  d1 = np.array( np.where( (pkd >= self.ctps_pkd_theshold) & (pkd > 0) ) )
                   if not d1[1].shape[0]:
                      continue
+                  d1[0] = ics_idx[ d1[0] ]
 
                  #-- ck ics debouncing  -> for more than X tsl in phase
                   for ic in np.unique( d1[0,:] ):
@@ -667,6 +848,140 @@ class JuMEG_Epocher_CTPS(JuMEG_Epocher_Events):
           return fhdf
 
 
+      def ctps_hdf_scale(self,data,scale_factor=None):
+          """
+          scale CTPS data by <scale_factor> and convert to int16 as stored in HDF
+
+          :param data: pk_dynamics or phase_angles
+          :param scale_factor: <None> => ctps_hdf_parameter['scale_factor']
+          :return: int16 array
+          """
+          if scale_factor is None:
+             scale_factor = self.ctps_hdf_parameter['scale_factor']
+          return ( data * scale_factor ).astype( np.int16 )
+
+      def ctps_hdf_array_update(self,key,idx_freq,data):
+          """
+          store data of band idx_freq scaled by <scale_factor> as int16 in the N-D array key [bands x data.shape]
+          int16 data are stored as they are (scaled by <ctps_hdf_scale>)
+          the chunked, compressed array is created for the first band
+
+          :param key: HDF key e.g. /ctps/<condition>/pkd
+          :param idx_freq: index of band
+          :param data: pk_dynamics [ICs,time] or phase_angles [epochs,ICs,time]
+          :return: HDF array node
+          """
+          if ( idx_freq == 0 ) or not self.hdf_obj_array_exists(key):
+             self.hdf_obj_array_create(key,(self.ctps_freq_bands.shape[0],) + data.shape,dtype=np.int16,
+                                       bands=self.ctps_freq_bands_list,scale_factor=self.ctps_hdf_parameter['scale_factor'])
+
+          node = self.HDFobj.get_node(key)
+          node[idx_freq] = data if data.dtype == np.int16 else self.ctps_hdf_scale(data)
+          return node
+
+      def ctps_hdf_band_keys_pandas(self,key,node_name='pk_dynamics'):
+          """
+          keys of the old layout: one pandas node per band <key>/<node_name>/<fcut1-fcut2>, sorted by band
+
+          :param key: HDF key e.g. /ctps/<condition>
+          :param node_name: pk_dynamics or phase_angle
+          :return: list of keys
+          """
+          node = self.HDFobj.get_node(key +'/'+ node_name)
+          if node is None:
+             return []
+          bands = sorted( node._v_groups.keys(),key=lambda b: [ float(f) for f in b.split('-') ] )
+          return [ key +'/'+ node_name +'/'+ b for b in bands ]
+
+      def ctps_hdf_iter_pk_dynamics(self,key,ics=None):
+          """
+          generator: pk dynamics per band [ICs,time] int16, scaled by <scale_factor>
+          N-D array <key>/pkd: partial read of the ICs not selected in ics, band by band
+          old layout: one pandas DataFrame per band <key>/pk_dynamics/<band>
+
+          :param key: HDF key e.g. /ctps/<condition>
+          :param ics: bool array of selected ICs, only ICs not selected are read <None> => all ICs
+          :return: yield index of band, IC index, pk dynamics [IC index,time]
+          """
+          pkd_key = key +'/pkd'
+
+          if self.hdf_obj_array_exists(pkd_key):
+             node = self.HDFobj.get_node(pkd_key)
+             for idx_band in range( node.shape[0] ):
+                 if ics is None:
+                    ics_idx = np.arange( node.shape[1] )
+                    yield idx_band,ics_idx,node[idx_band]
+                    continue
+                 ics_idx = np.where( np.logical_not(ics) )[0]
+                 if not ics_idx.size:
+                    return
+                 if ics_idx.size == node.shape[1]:
+                    yield idx_band,ics_idx,node[idx_band]
+                 else:
+                    yield idx_band,ics_idx,node[idx_band,ics_idx.tolist(),:]
+          else:
+             for idx_band,band_key in enumerate( self.ctps_hdf_band_keys_pandas(key) ):
+                 pkd = self.hdf_obj_read_pandas_node(band_key)
+                 yield idx_band,np.arange( pkd.shape[0] ),pkd
+
+      def ctps_hdf_migrate(self,fhdf=None,fname=None,raw=None,template_name=None,remove_old=False):
+          """
+          migrate CTPS results of old files into N-D arrays
+           <key>/pk_dynamics/<band> DataFrame [ICs,time]         => <key>/pkd          [bands,ICs,time]
+           <key>/phase_angle/<band> Panel [epochs,ICs,time]      => <key>/phase_angles [bands,epochs,ICs,time]
+          for keys /ctps/<condition> and /artifacts/steady-state; Panels are read without pd.Panel
+
+          :param fhdf: hdf5 filename or
+          :param fname: fif-filename or
+          :param raw: raw obj
+          :param template_name:
+          :param remove_old: remove the nodes of the old layout <False>
+          :return: fhdf
+          """
+          if fhdf:
+             self.HDFobj = pd.HDFStore(fhdf)
+          else:
+             if raw:
+                self.raw = raw
+             self.template_name = template_name
+             self.HDFobj = self.hdf_obj_open(fname=fname,raw=self.raw)
+
+          key_list = []
+          if self.HDFobj.get_node('/ctps') is not None:
+             key_list = [ '/ctps/' + condi for condi in self.hdf_obj_list_keys_from_node('/ctps') ]
+          if self.HDFobj.get_node('/artifacts/steady-state') is not None:
+             key_list.append('/artifacts/steady-state')
+
+          for key in key_list:
+              try:
+                 scale_factor = self.HDFobj.get_storer(key).attrs.ctps_hdf_parameter['scale_factor']
+              except:
+                 scale_factor = self.scale_factor
+
+              for node_name,array_name in ( ('pk_dynamics','pkd'),('phase_angle','phase_angles') ):
+                  band_keys = self.ctps_hdf_band_keys_pandas(key,node_name=node_name)
+                  if not band_keys:
+                     continue
+
+                  print "---> CTPS HDF migrate: " + key +'/'+ node_name +" => "+ key +'/'+ array_name
+                  for idx_band,band_key in enumerate( band_keys ):
+                      data = self.hdf_obj_read_pandas_node(band_key)
+                      if idx_band == 0:
+                         node = self.hdf_obj_array_create(key +'/'+ array_name,(len(band_keys),) + data.shape,dtype=np.int16,
+                                                          bands=[ k.rsplit('/',1)[-1] for k in band_keys ],scale_factor=scale_factor)
+                      node[idx_band] = data.astype(np.int16)
+
+                  if remove_old:
+                     self.HDFobj._handle.remove_node(key +'/'+ node_name,recursive=True)
+
+                  self.HDFobj.flush()
+
+          fhdf = self.HDFobj.filename
+          self.HDFobj.close()
+
+          return fhdf
+
+
       def ctps_ica_brain_responses_clean(self,fname,raw=None,fname_ica=None,ica_raw=None,fhdf=None,template_name=None,
                                          condition_list=None, njobs=4,fif_extention=".fif",fif_postfix="ctps",
                                          clean_global={'save_raw':False,'save_epochs':False,'save_evoked':False},
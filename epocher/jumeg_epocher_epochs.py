@@ -10,6 +10,12 @@ baseline correction:
 check in confidence intervall for non artifac intervall e.g. non-eyeblink 
 apply BC foreach epoch independend inside the confident intervall    
 
+Updates:
+ single-pass epoch extraction (epochs_engine="single_pass"):
+ union of the epoch windows of all conditions is read from file once,
+ epochs of each condition are copied from this buffer
+ baseline correction for shared baseline events (baseline_engine="raw"):
+ baseline values of the unique baseline events from raw._data with one gather
 """
 import sys
 import numpy as np
@@ -88,6 +94,15 @@ class JuMEG_Epocher_Epochs(JuMEG_Epocher_Events):
           picks          : channels to process [None: all]
           reject         : mne rejection [None]
           proj           : False
+          
+         epochs_engine   : [single_pass] read the union of all epoch windows of all conditions once from file
+                           "mne": one mne.Epochs per condition
+                           single_pass is used for raw obj not preloaded without <bad> annotations,
+                           preloaded raw obj => mne.Epochs
+         baseline_engine : [raw] baseline correction for baseline events shared by several epochs: 
+                           baseline values per unique baseline event from raw._data, no baseline epochs
+                           "mne": mne.Epochs for the unique baseline events
+                           raw is used for preloaded raw obj without <bad> annotations and projections
          
     """
     def __init__ (self,raw=None,fhdf=None,fname=None,condition_list=None,
@@ -99,7 +114,7 @@ class JuMEG_Epocher_Epochs(JuMEG_Epocher_Events):
                   weights=None,     
                   save_mode={"events":True,"epochs":True,"evoked":True},
                   exclude_events = {"eog_events":None,"ecg_events":None},
-                  verbose=False):
+                  epochs_engine="single_pass",baseline_engine="raw",verbose=False):
 
         super(JuMEG_Epocher_Epochs, self).__init__()
        
@@ -125,6 +140,12 @@ class JuMEG_Epocher_Epochs(JuMEG_Epocher_Events):
         self.proj           = proj                     
         self.verbose        = verbose
         self.type_result    = type_result
+        self.epochs_engine  = epochs_engine
+        self.baseline_engine= baseline_engine
+        
+        self._epochs_buffer     = None
+        self._epochs_buffer_tsl = None
+        self._epochs_buffer_pos = None
         
 #--- 
     def apply_hdf_to_epochs(self,**kwargs):
@@ -214,7 +235,8 @@ class JuMEG_Epocher_Epochs(JuMEG_Epocher_Events):
         if not self.HDFobj:
            print" --> ERROR  in <epocher_run> please call <apply_epocher> first"
            return
-       #----
+       #---- get events for all conditions, read epoch windows of all conditions at once
+        condi_evts = []
         for condi in self.condition_list:
             print"\n"
             self.line()
@@ -226,7 +248,13 @@ class JuMEG_Epocher_Epochs(JuMEG_Epocher_Events):
        
           #---     
             if not evt['events'].size: continue
-         
+            evt['marker'] = self.marker
+            condi_evts.append( (condi,evt) )
+        
+        self._epochs_init_buffer( [ c_evt[1] for c_evt in condi_evts ] )
+        
+        for condi,evt in condi_evts:
+            self.marker = evt['marker']
           #--- avg epochs events 
             evt = self._epochs_get_epochs_and_apply_baseline(self.raw,evt=evt)
       
@@ -236,6 +264,8 @@ class JuMEG_Epocher_Epochs(JuMEG_Epocher_Events):
           #--- save all epochs no weights
             self._epochs_save_events(evt=evt,condition=condi,postfix=self.marker.postfix,postfix_extention=self.fif_postfix,weighted=False,
                                      picks=self.picks,reject=self.reject,proj=self.proj,save_mode=self.save_mode)
+          #--- free epochs, only one condition's epochs in memory
+            evt.pop('epochs',None)
          
           #--- end for condi
      
@@ -251,13 +281,22 @@ class JuMEG_Epocher_Epochs(JuMEG_Epocher_Events):
                   if self.event_id[ condi ]['trials'] <  self.weights['min_counts']: 
                      self.weights['min_counts'] = self.event_id[ condi ]['trials']
            
+              condi_evts = []
               for condi in self.event_id.keys():
                  #---
                   df,evt,ep_param,info_param = self._epochs_get_events(condi,ck_weights_skip_first=False,ck_weights_equalize=True)
     
                  #--- weighted avg epochs events
                   if not evt['events'].size: continue
-                   
+                  evt['marker']   = self.marker
+                  evt['ep_param'] = ep_param
+                  condi_evts.append( (condi,evt) )
+              
+              self._epochs_init_buffer( [ c_evt[1] for c_evt in condi_evts ] )
+               
+              for condi,evt in condi_evts:
+                  self.marker = evt['marker']
+                  ep_param    = evt['ep_param']
                  #--- avg epochs events 
                   evt = self._epochs_get_epochs_and_apply_baseline(self.raw,evt=evt)
           
@@ -265,8 +304,9 @@ class JuMEG_Epocher_Epochs(JuMEG_Epocher_Events):
                  #---
                   self._epochs_save_events(evt=evt,condition=condi,postfix=ep_param['postfix']+'-W',postfix_extention=self.fif_postfix,
                                            weighted=True,picks=self.picks,reject=self.reject,proj=self.proj,save_mode=self.save_mode)
+                  evt.pop('epochs',None)
                      
-      
+        self._epochs_clear_buffer()
         self.HDFobj.close()        
           
   
@@ -649,6 +689,124 @@ class JuMEG_Epocher_Epochs(JuMEG_Epocher_Events):
        
         return artifact_events
           
+#---
+    def _epochs_init_buffer(self,evts):
+        """ single-pass epoch extraction: 
+        union of the epoch windows of all conditions is read from file once, 
+        one read per merged window [start,stop) with raw[:,start:stop],
+        epochs of each condition are copied from this buffer in <_epochs_get_epochs_from_buffer>
+        => reads scale with the unique data, not with the number of conditions
+        used for epochs_engine == "single_pass", raw obj not preloaded and no <bad> annotations
+        
+        Parameters
+        ----------
+         evts: list of event dicts with marker obj evt['marker']
+        
+        Results
+        -------
+         True if buffer is initialized
+        """
+        self._epochs_clear_buffer()
+        
+        if self.epochs_engine != "single_pass" or not evts: return False
+        
+        self.raw,self.fname = jumeg_base.get_raw_obj(self.fname,raw=self.raw)
+        if not self.events_ck_raw_data(self.raw,preload=False): return False
+        
+       #--- epoch windows [tsl0,tsl0+n) of all conditions 
+        tsl0,tsl1 = [],[]
+        for evt in evts:
+            evt['epoch_index'] = self.events_calc_epoch_index(self.raw,evt['events'],evt['event_id'],evt['marker'].time_pre,evt['marker'].time_post)
+            idx,t0,start,n = evt['epoch_index']
+            tsl0.append( t0[idx] )
+            tsl1.append( t0[idx] + n )
+        tsl0 = np.concatenate(tsl0)
+        tsl1 = np.concatenate(tsl1)
+        if not tsl0.size: return False
+        
+       #--- merge overlapping and adjacent windows
+        order = np.argsort(tsl0,kind='mergesort')
+        tsl0  = tsl0[order]
+        tsl1  = np.maximum.accumulate( tsl1[order] )
+        first = np.r_[True,tsl0[1:] > tsl1[:-1]]
+        run0  = tsl0[first]
+        run1  = tsl1[ np.r_[ np.where(first)[0][1:] - 1,tsl1.size - 1 ] ]
+        pos   = np.r_[0,np.cumsum(run1 - run0)]
+        
+        self._epochs_buffer = np.empty( (self.raw.info['nchan'],pos[-1]),dtype=np.float64 )
+        for t0,t1,p in zip(run0,run1,pos):
+            self._epochs_buffer[:,p:p + t1 - t0] = self.raw[:,t0:t1][0]
+        self._epochs_buffer_tsl = run0
+        self._epochs_buffer_pos = pos[:-1]
+        
+        if self.verbose:
+           print" ---> Epocher single-pass epoch extraction"
+           print"   -> conditions       : %d" %( len(evts) )
+           print"   -> windows read     : %d" %( run0.size )
+           print"   -> samples in buffer: %d / %d" %( self._epochs_buffer.shape[-1],self.raw.n_times )
+           self.line()
+        return True
+    
+#---
+    def _epochs_clear_buffer(self):
+        """ clear single-pass buffer """
+        self._epochs_buffer     = None
+        self._epochs_buffer_tsl = None
+        self._epochs_buffer_pos = None
+       
+#---
+    def _epochs_get_epochs_from_buffer(self,evt,picks=None):
+        """ epochs from the single-pass buffer, 
+        same as mne.Epochs(raw,events,event_id,tmin,tmax,baseline=None,picks,reject,proj,preload=True)
+        epoch windows are contiguous in the buffer => one copy per epoch of the picked channels,
+        epochs are baseline-corrected in place and conditions overlap
+        
+        Parameters
+        ----------
+         evt  : event dict
+         picks: channel index <None> => all channels
+        
+        Results
+        -------
+         mne.EpochsArray obj, selection and drop log refer to evt['events'] like mne.Epochs
+        """
+        if evt.get('epoch_index') is None:
+           evt['epoch_index'] = self.events_calc_epoch_index(self.raw,evt['events'],evt['event_id'],self.marker.time_pre,self.marker.time_post)
+        idx,tsl0,start,n = evt['epoch_index']
+        
+       #--- position in buffer: merged window containing the epoch window
+        k   = np.searchsorted(self._epochs_buffer_tsl,tsl0[idx],side='right') - 1
+        pos = self._epochs_buffer_pos[k] + tsl0[idx] - self._epochs_buffer_tsl[k]
+        
+        info = self.raw.info
+        if picks is not None:
+           picks = np.asarray(picks)
+           info  = mne.pick_info(self.raw.info,picks)
+       
+        data = np.zeros( (idx.size,len(info['ch_names']),n),dtype=np.float64 )
+        for i,p in enumerate(pos):
+            if picks is None:
+               data[i] = self._epochs_buffer[:,p:p+n]
+            else:
+               np.take(self._epochs_buffer[:,p:p+n],picks,axis=0,out=data[i])
+        
+        ep = mne.EpochsArray(data,info,events=evt['events'][idx],tmin=start / self.raw.info['sfreq'],event_id=evt['event_id'],
+                             reject=self.reject,baseline=None,proj=self.proj,verbose=False)
+        
+       #--- selection & drop log: index of evt['events'] 
+        drop_log = [ ['IGNORED'] for evt_id in evt['events'][:,2] ]
+        for k in np.where( evt['events'][:,2] == evt['event_id'] )[0]:
+            drop_log[k] = ['NO_DATA'] if tsl0[k] < 0 else ['TOO_SHORT']
+        for i,k in enumerate(idx):
+            drop_log[k] = list( ep.drop_log[i] )
+        ep.selection = idx[ ep.selection ]
+        if isinstance(ep.drop_log,tuple):
+           ep.drop_log = tuple( tuple(d) for d in drop_log )
+        else:
+           ep.drop_log = drop_log
+        
+        return ep
+        
 #---           
     def _epochs_get_epochs_and_apply_baseline(self,raw,evt=None,picks=None):
         """generate epochs from raw and apply baseline correction if baseline is not None
@@ -688,8 +846,11 @@ class JuMEG_Epocher_Epochs(JuMEG_Epocher_Events):
         self.raw,self.fname = jumeg_base.get_raw_obj(self.fname,raw=self.raw)
        
        #--- get epochs no bc correction 
-        ep = mne.Epochs(self.raw,evt['events'],event_id=evt['event_id'],tmin=self.marker.time_pre,tmax=self.marker.time_post,
-                        baseline=None,picks=picks,reject=self.reject,proj=self.proj,preload=True,verbose=False) 
+        if self._epochs_buffer is not None:
+           ep = self._epochs_get_epochs_from_buffer(evt,picks=picks)
+        else:
+           ep = mne.Epochs(self.raw,evt['events'],event_id=evt['event_id'],tmin=self.marker.time_pre,tmax=self.marker.time_post,
+                           baseline=None,picks=picks,reject=self.reject,proj=self.proj,preload=True,verbose=False) 
         ep.drop_bad() #- exclude bad epochs e.g: to short  
         
         if self.verbose: # for later show difference min max with and without bc
@@ -706,7 +867,10 @@ class JuMEG_Epocher_Epochs(JuMEG_Epocher_Events):
               
              #--- ck for unique events and apply bc correction with unique baseline events, e.g. one baseline intervall used for multi stimuli 
               if not ep_bc_corrected:
-                 ep_bc_corrected = self._calc_baseline_correction_for_unique_events(ep,evt['bc']['events'])
+                 if self.baseline_engine == "raw" and self.events_ck_raw_data(self.raw,projs=False):
+                    ep_bc_corrected = self._calc_baseline_correction_from_raw(ep,evt['bc']['events'])
+                 else:
+                    ep_bc_corrected = self._calc_baseline_correction_for_unique_events(ep,evt['bc']['events'])
             
               if ep_bc_corrected:
                  evt['epochs'] = ep_bc_corrected
@@ -890,6 +1054,83 @@ class JuMEG_Epocher_Epochs(JuMEG_Epocher_Events):
         print"  -> baseline intervall :[ %3.3f , %3.3f] " %(tmin,tmax)
         return ep
     
+#---
+    def _calc_baseline_correction_from_raw(self,ep,bc_events,method=None):
+        """calc baseline type correction e.g. calc mean or median baseline value 
+        for epoch events sharing baseline events, e.g. one baseline intervall used for multi stimuli 
+        
+        baseline windows of the unique baseline events are read from raw._data with one gather,
+        mean or median per channel is broadcasted to all epochs referencing the baseline event
+        no mne.Epochs for the baseline events
+        
+        epochs with baseline window not within the data are droped!!!
+        
+        Parameters
+        ----------
+        <mne.epochs.Epochs> obj: output from mne.Epochs, e.g. epochs, bads are droped
+        bc_events: np.array, like mne.Events for baseline epochs
+        method  : string [median,mean], type of baseline value calculation <None>
+        
+        Returns
+        -------
+        baseline corrected <mne.epochs.Epochs> obj
+        
+        default bbaseline correction type is <marker.baseline.method> or mean
+        
+        """
+        
+        print"  -> Epocher baseline correction from raw data"
+        
+        if ( not bc_events[:,0].any() ) or ( not ep.selection.size ): return
+        picks_bc = jumeg_base.picks.exclude_trigger( ep ) # no trigger, response
+            
+        if not picks_bc.any(): return # check e.g. if only trigger channels
+        
+        if not method:
+           method = self.marker.baseline.method
+        
+       #--- unique baseline events, unique_inverse: index of unique event for each baseline event
+        evts_bc_uni,evts_bc_uni_inv = np.unique(bc_events[:,0],return_inverse=True)
+       
+       #--- baseline windows within data 
+        tmin,tmax = self._ck_baseline_range()
+        start,n   = self.events_calc_window(self.raw,tmin,tmax)
+        tsl0      = evts_bc_uni - self.raw.first_samp + start
+        uni_goods = ( tsl0 >= 0 ) & ( tsl0 + n <= self.raw.n_times )
+        if not uni_goods.any(): return
+        
+       #--- ck and exclude epochs with baseline window not within the data
+        drop_ep_idx_not_in_bc = np.where( np.logical_not( uni_goods[ evts_bc_uni_inv[ep.selection] ] ) )[0]
+        if drop_ep_idx_not_in_bc.size :
+           ep.drop( drop_ep_idx_not_in_bc ) 
+           ep.drop_bad()
+        
+       #--- baseline values [unique events,channels]  
+        ch_names = self.raw.info['ch_names']
+        raw_picks= np.array([ ch_names.index( ep.ch_names[i] ) for i in picks_bc ])
+        tsls     = ( tsl0[uni_goods][:,np.newaxis] + np.arange(n) ).flatten()
+        data     = self.raw._data[ np.ix_(raw_picks,tsls) ].reshape(raw_picks.size,-1,n)
+        
+        if method == "median":
+           bc_values = np.median(data,axis=-1).T
+        else: # mean
+           bc_values = np.mean(data,axis=-1).T
+        
+       #--- broadcast baseline values to epochs: epoch -> baseline event -> good unique baseline event 
+        bc_idx = ( np.cumsum(uni_goods) - 1 )[ evts_bc_uni_inv[ep.selection] ]
+        if np.array_equal( picks_bc,np.arange(picks_bc[0],picks_bc[-1]+1) ):
+           ep._data[:,picks_bc[0]:picks_bc[-1]+1,:] -= bc_values[bc_idx][:,:,np.newaxis]
+        else: #--- inplace channel by channel, no copy of epochs data
+           for i,ch in enumerate(picks_bc):
+               ep._data[:,ch,:] -= bc_values[bc_idx,i][:,np.newaxis]
+        
+        if self.verbose:                      
+           self.pp( ep,head=" --> Baseline correction from raw data for unique basline events" ) 
+        
+        print"  -> Done Epocher baseline correction from raw data"
+        print"  -> baseline intervall :[ %3.3f , %3.3f] " %(tmin,tmax)
+        return ep
+    
 #---
     def _ck_baseline_range(self):
         tmin = self.marker.baseline.onset
@@ -1045,6 +1286,10 @@ class JuMEG_Epocher_Epochs(JuMEG_Epocher_Events):
                  self.time = v
             elif k=='weights':
                  self.weights = v
+            elif k=='epochs_engine':
+                 self.epochs_engine = v
+            elif k=='baseline_engine':
+                 self.baseline_engine = v
             elif k=='verbose':
                  self.verbose = v          
 #--- 
@@ -1087,3 +1332,52 @@ class JuMEG_Epocher_Epochs(JuMEG_Epocher_Events):
 jumeg_epocher_epochs = JuMEG_Epocher_Epochs()
 
 
+
+
+def test_baseline_correction(sampling_frequency=100.0,seed=42):
+    """
+    baseline correction for shared baseline events: <_calc_baseline_correction_from_raw> (baseline_engine="raw")
+    vs <_calc_baseline_correction_for_unique_events> (baseline_engine="mne") on seeded synthetic data
+    => same selection, rel. max deviation of epochs data < 1e-12
+
+      several epochs share one baseline event, the baseline window of the first baseline event is
+      not within the data (its epochs are dropped), mean and median, trigger channels interleaved
+      with data channels (baseline picks not contiguous) or behind them (contiguous)
+
+    return dict: (method,channel layout) -> deviation
+    """
+    rng   = np.random.RandomState(seed)
+    param = {"time_pre":-0.2,"time_post":0.5,"marker":{},"baseline":{"method":None,"baseline":[-0.1,0.0]}}
+
+   #--- trial starts => baseline events, 2-4 stimuli per trial => epoch events
+    trials = np.r_[5,200 + 250 * np.arange(10)]
+    stims  = [ np.sort( t + rng.choice(np.arange(30,200,10),rng.randint(2,5),replace=False) ) for t in trials ]
+    events    = np.zeros((sum(s.size for s in stims),3),dtype=np.int64)
+    bc_events = np.zeros_like(events)
+    events[:,0]    = np.concatenate(stims)
+    events[:,2]    = 1
+    bc_events[:,0] = np.repeat(trials,[ s.size for s in stims ])
+    bc_events[:,2] = 2
+
+    layouts = { "interleaved":(['MEG 001','STI 014','MEG 002','MEG 003','STI 013','MEG 004'],['mag','stim','mag','mag','stim','mag']),
+                "contiguous" :(['MEG 001','MEG 002','MEG 003','MEG 004','STI 014','STI 013'],['mag','mag','mag','mag','stim','stim']) }
+    result = {}
+    for layout,(ch_names,ch_types) in layouts.items():
+        raw = mne.io.RawArray(rng.randn(len(ch_names),3000),mne.create_info(ch_names,sampling_frequency,ch_types),verbose=False)
+
+        for method in ("mean","median"):
+            param["baseline"]["method"] = method
+            jep = JuMEG_Epocher_Epochs(raw=raw)
+            jep.marker = JuMEG_Epocher_Marker(label="marker",parameter=param)
+
+            ep  = mne.Epochs(raw,events,event_id=1,tmin=param["time_pre"],tmax=param["time_post"],baseline=None,preload=True,verbose=False)
+            ep_raw = jep._calc_baseline_correction_from_raw(ep.copy(),bc_events)
+            ep_mne = jep._calc_baseline_correction_for_unique_events(ep.copy(),bc_events)
+
+            assert np.array_equal(ep_raw.selection,ep_mne.selection),"baseline correction selection differs: %s %s" % (method,layout)
+            assert ep_raw.selection.size < events.shape[0],"no epochs dropped for the baseline out of range: %s %s" % (method,layout)
+            dev = np.abs(ep_raw.get_data() - ep_mne.get_data()).max() / np.abs(ep_mne.get_data()).max()
+            result[(method,layout)] = dev
+            assert dev <= 1e-12,"baseline correction from raw deviates: %s %s %0.3e" % (method,layout,dev)
+
+    return result
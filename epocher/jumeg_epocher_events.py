@@ -12,6 +12,10 @@ Updates:
 ----------------------------------------------------------------
 update: 19.06.2018          
 complete new, support for IOD and eyetracking events
+update: response matching for all stimuli at once (engine="searchsorted"),
+        stimulus by stimulus with engine="loop"
+update: cache of mne.find_events per raw obj, channel and parameter:
+        each stim/response channel is scanned once per file
 ----------------------------------------------------------------
 Example:
 --------
@@ -418,6 +422,7 @@ class JuMEG_Epocher_ResponseMatching(JuMEG_Epocher_Basic):
         self.resp_type_offset = resp_type_offset 
         self.resp_prefix      = resp_prefix
       #---
+        self.engine     = "searchsorted"
         self.DataFrame  = None
    #---      
     @property
@@ -459,7 +464,7 @@ class JuMEG_Epocher_ResponseMatching(JuMEG_Epocher_Basic):
         
         
     def update(self,raw=None,stim_df=None,stim_param=None,stim_type_input=None,stim_prefix=None,resp_df=None,
-               resp_param=None,resp_type_input=None,resp_type_offset=None,resp_prefix=None,verbose=False):
+               resp_param=None,resp_type_input=None,resp_type_offset=None,resp_prefix=None,engine=None,verbose=False):
         """ update CLS parameter
        
         Parameters
@@ -482,6 +487,8 @@ class JuMEG_Epocher_ResponseMatching(JuMEG_Epocher_Basic):
                            data frame column name to process as response input 
         resp_prefix      : string ["iod"]
                            response column name prefix e.g. to distinguish between different "onset" columns                   
+        engine           : string ["searchsorted"]
+                           matching engine: "searchsorted" all stimuli at once, "loop" stimulus by stimulus
         
         verbose          : bool [False]
                            printing information debug
@@ -495,6 +502,7 @@ class JuMEG_Epocher_ResponseMatching(JuMEG_Epocher_Basic):
         if resp_type_input : self.resp_type_input = resp_type_input
         if resp_type_offset: self.resp_type_offset= resp_type_offset 
         if resp_prefix     : self.resp_prefix     = resp_prefix
+        if engine          : self.engine          = engine
         if verbose         : self.verbose         = verbose
         
         if isinstance(stim_df, pd.DataFrame):
@@ -793,6 +801,9 @@ class JuMEG_Epocher_ResponseMatching(JuMEG_Epocher_Basic):
                             data frame column name to process as response input 
          resp_prefix      : string ["iod"]
                             response column name prefix e.g. to distinguish between different "onset" columns                   
+         engine           : string ["searchsorted"]
+                            "searchsorted": all stimuli at once, binary search in the sorted response onsets
+                            "loop"        : stimulus by stimulus
         
          verbose          : bool [False]
                             printing information debug
@@ -823,6 +834,28 @@ class JuMEG_Epocher_ResponseMatching(JuMEG_Epocher_Basic):
         else:
            early_ids_to_ignore=None 
       
+        if self.engine == "loop":
+           df = self._apply_loop(r_window_tsl_start,r_window_tsl_end,resp_event_id,early_ids_to_ignore)
+        else:
+           df = self._apply_searchsorted(r_window_tsl_start,r_window_tsl_end,resp_event_id,early_ids_to_ignore)
+        
+        self.DataFrame = df
+        return df
+  
+  #---
+    def _apply_loop(self,r_window_tsl_start,r_window_tsl_end,resp_event_id,early_ids_to_ignore):
+        """ response matching stimulus by stimulus
+         Parameter
+         ---------
+          r_window_tsl_start : response window start in tsls
+          r_window_tsl_end   : response window end   in tsls
+          resp_event_id      : response event ids
+          early_ids_to_ignore: ignore this response ids if there are to early pressed
+         
+         Return
+         --------
+          dataframe
+        """
        #--- loop for all stim events
         ridx = 0
        #--- get rt important part of respose df
@@ -889,9 +922,185 @@ class JuMEG_Epocher_ResponseMatching(JuMEG_Epocher_Basic):
                  else:
                    df_idx = self._set_wrong(df,stim_idx=idx,df_idx=df_idx,resp_idx=resp_in_index)  
            
+        return df
+  
+  #---
+    def _calc_toearly(self,tsl1,early_ids_to_ignore=None):
+        """ to early responses for many window ends at once, like <find_toearly(tsl1=tsl1)> for each tsl1
+         responses with  0 <= response onset or offset < tsl1
+         
+        Parameters
+        ----------
+         tsl1               : np.array, end of to early window in tsls for each stimulus
+         early_ids_to_ignore: ignore this ids  <None>
+        
+        Return
+        ------
+         np.array bool: to early for each tsl1, np.array int: number of to early responses
+        """
+        tsl1   = np.asarray(tsl1,dtype=np.float64)
+        counts = np.zeros(tsl1.size,dtype=np.int64)
+        
+        if self.resp_param["early_ids_to_ignore"] == 'all':
+           return np.zeros(tsl1.size,dtype=bool),counts
+       
+       #--- first tsl of a response in the window: onset or offset 
+        resp_key = np.asarray( self.resp_df[ self.resp_type_input ],dtype=np.float64 )
+        resp_key = np.where( resp_key >= 0,resp_key,np.inf )
+        if self.resp_type_input != self.resp_type_offset:
+           key_off  = np.asarray( self.resp_df[ self.resp_type_offset ],dtype=np.float64 )
+           resp_key = np.minimum( resp_key,np.where( key_off >= 0,key_off,np.inf ) )
+        
+        def _count(sel):
+            return np.searchsorted( np.sort( resp_key[sel] ),tsl1,side='left' )
+       
+       #--- any response index in window ( index 0 is not counted, like index.any() )  
+        found = _count( self.resp_df.index.values != 0 ) > 0
+           
+        if self.resp_param['early_ids_to_ignore']:
+           if early_ids_to_ignore.any():
+              counts = _count( ~np.isin( self.resp_df[self.resp_prefix + "_id"].values,early_ids_to_ignore ) )
+              return found & ( counts > 0 ),counts
+           return np.zeros(tsl1.size,dtype=bool),counts
+        
+       #--- onset window only: responses are returned as index not as np.array => no to early response
+        if self.resp_type_input == self.resp_type_offset:
+           return np.zeros(tsl1.size,dtype=bool),counts
+        return found,_count( np.ones(resp_key.size,dtype=bool) )
+       
+  #---
+    def _find_responses_in_windows(self,tsl0,tsl1):
+        """ find responses in windows tsl0 <= response < = tsl1 for all windows at once
+         binary search in the sorted responses, responses per window in dataframe order
+         
+        Parameters
+        ----------
+         tsl0: np.array, window start in tsls
+         tsl1: np.array, window end   in tsls
+        
+        Return
+        ------
+         np.array: number of responses per window
+         np.array: window number of each found response 
+         np.array: response position in response dataframe, sorted by window, dataframe order
+        """
+        resp_tsls = np.asarray( self.resp_df[ self.resp_type_input ] )
+        order     = np.argsort(resp_tsls,kind='mergesort')
+        resp_sort = resp_tsls[order]
+        idx0      = np.searchsorted(resp_sort,tsl0,side='left')
+        idx1      = np.searchsorted(resp_sort,tsl1,side='right')
+        counts    = np.maximum(idx1 - idx0,0)
+        
+        win = np.repeat( np.arange(counts.size),counts )
+        pos = order[ np.repeat( idx0 - np.cumsum(counts) + counts,counts ) + np.arange( counts.sum() ) ]
+        
+       #--- dataframe order within window
+        srt = np.lexsort( (pos,win) )
+        return counts,win[srt],pos[srt]
+  
+  #---
+    def _apply_searchsorted(self,r_window_tsl_start,r_window_tsl_end,resp_event_id,early_ids_to_ignore):
+        """ response matching for all stimuli at once, same dataframe as <_apply_loop>
+         response windows with binary search in the sorted response onsets,
+         HIT/WRONG/MISSED/TOEARLY and counts (all,first,N) as array operations
+         
+         Parameter
+         ---------
+          r_window_tsl_start : response window start in tsls
+          r_window_tsl_end   : response window end   in tsls
+          resp_event_id      : response event ids
+          early_ids_to_ignore: ignore this response ids if there are to early pressed
+         
+         Return
+         --------
+          dataframe
+        """
+        counts_mode = self.resp_param['counts']
+        resp_id     = self.resp_df[self.resp_prefix + "_id"].values
+        resp_label  = self.resp_df.index.values
+        resp_is_id  = np.isin(resp_id,resp_event_id)
+        
+        stim_tsls = np.asarray( self.stim_df[ self.stim_type_input ] )
+        tsl0      = stim_tsls + r_window_tsl_start
+        tsl1      = stim_tsls + r_window_tsl_end
+        stim_pos  = np.where( (tsl0 >= 0) & (tsl1 >= 0) )[0]
+        tsl0      = tsl0[stim_pos]
+        tsl1      = tsl1[stim_pos]
+        
+       #--- to early, window of apply: 0 <= tsl < window start ; window of calc_max_rows: 0 <= tsl < r_window_tsl_start
+        toearly       = np.zeros(stim_pos.size,dtype=bool)
+        toearly_count = np.zeros(stim_pos.size,dtype=np.int64)
+        toearly_rows  = False
+        if r_window_tsl_start > 0:
+           toearly,toearly_count = self._calc_toearly(tsl0,early_ids_to_ignore=early_ids_to_ignore)
+           toearly_rows = self._calc_toearly([r_window_tsl_start],early_ids_to_ignore=early_ids_to_ignore)[0][0]
+        
+        nresp,win,pos = self._find_responses_in_windows(tsl0,tsl1)
+        first   = np.cumsum(nresp) - nresp       # first response of window in win,pos
+        rank    = np.arange(win.size) - first[win] + 1
+        active  = ~toearly[win]                  # responses of windows without to early responses
+        missed  = ~toearly & ( nresp == 0 )
+        
+       #--- max rows => calc_max_rows
+        if toearly_rows:
+           max_rows = stim_pos.size
+        elif counts_mode == 'all':
+           max_rows = ( nresp == 0 ).sum() + resp_is_id[pos].sum()
+        elif counts_mode == 'first':
+           max_rows = stim_pos.size
+        else:
+           max_rows = ( nresp == 0 ).sum() + nresp.sum()
+        
+       #--- rows: stimulus index, rank within stimulus, response position [-1 => none], resp type, counts, resp index
+        rows = [ ( np.where(toearly)[0],np.zeros(toearly.sum(),np.int64),
+                   np.zeros(toearly.sum(),np.int64) + resp_label.tolist().index(0) if toearly.any() else np.zeros(0,np.int64),
+                   self.idx_toearly,toearly_count[toearly],np.zeros(toearly.sum(),np.int64) ),
+                 ( np.where(missed)[0],np.zeros(missed.sum(),np.int64),-np.ones(missed.sum(),np.int64),
+                   self.idx_missed,np.zeros(missed.sum(),np.int64),np.zeros(missed.sum(),np.int64) ) ]
+        
+        if counts_mode == 'all':
+           sel  = active & resp_is_id[pos]
+           hit_rank = np.cumsum(sel) - np.concatenate( ([0],np.cumsum(sel)) )[first][win]
+         #--- index.any(): windows with hits at response index 0 only are skipped   
+           sel &= np.bincount( win[sel & ( resp_label[pos] != 0 )],minlength=nresp.size )[win] > 0
+           rows.append( (win[sel],rank[sel],pos[sel],self.idx_hit,hit_rank[sel],resp_label[pos[sel]]) )
+        
+        elif counts_mode == 'first':
+           sel = active & ( rank == 1 )
+           rows.append( (win[sel],rank[sel],pos[sel],np.where( resp_is_id[pos[sel]],self.idx_hit,self.idx_wrong ),
+                         rank[sel],resp_label[pos[sel]]) )
+        
+        elif counts_mode:
+           all_hits = np.bincount( win[~resp_is_id[pos]],minlength=nresp.size ) == 0
+           is_hit   = ( nresp <= counts_mode ) & all_hits
+           sel = active
+           rows.append( (win[sel],rank[sel],pos[sel],np.where( is_hit[win[sel]],self.idx_hit,self.idx_wrong ),
+                         rank[sel],resp_label[pos[sel]]) )
+        
+        row_stim  = np.concatenate( [ r[0] for r in rows ] )
+        row_rank  = np.concatenate( [ r[1] for r in rows ] )
+        row_resp  = np.concatenate( [ r[2] for r in rows ] )
+        row_type  = np.concatenate( [ np.zeros(r[0].size,np.int64) + r[3] for r in rows ] )
+        row_count = np.concatenate( [ r[4] for r in rows ] )
+        row_index = np.concatenate( [ r[5] for r in rows ] )
+        
+        srt = np.lexsort( (row_rank,row_stim) )[:max_rows]
+        nrows = srt.size
+        
+       #--- fill dataframe: stimulus,response columns, update columns; rows > max_rows are dropped like in <_apply_loop>
+        df = self.reset_dataframe(max_rows)
+        for col in self.stim_df.columns:
+            df.iloc[:nrows,df.columns.get_loc(col)] = self.stim_df[col].values[ stim_pos[ row_stim[srt] ] ]
+        rpos = row_resp[srt]
+        for col in self.resp_df.columns:
+            if self.resp_df[col].size:
+               df.iloc[:nrows,df.columns.get_loc(col)] = np.where( rpos >= 0,self.resp_df[col].values[ np.maximum(rpos,0) ],0 )
+        df.iloc[:nrows,df.columns.get_loc(self.resp_prefix +'_index')]  = row_index[srt]
+        df.iloc[:nrows,df.columns.get_loc(self.resp_prefix +'_type')]   = row_type[srt]
+        df.iloc[:nrows,df.columns.get_loc(self.resp_prefix +'_counts')] = row_count[srt]
+        div = df[ self.resp_type_input ].values[:nrows] - df[ self.stim_type_input ].values[:nrows]
+        df.iloc[:nrows,df.columns.get_loc(self.resp_prefix +'_div')]    = div
         
-        self.DataFrame = df
-       #char = sys.stdin.read(1)
         return df
   
 
@@ -946,6 +1155,10 @@ class JuMEG_Epocher_Events(JuMEG_Epocher_HDF,JuMEG_Epocher_Basic):
                                    }
      
         self.ResponseMatching = JuMEG_Epocher_ResponseMatching()       
+        
+        self.events_cache     = True
+        self._events_cache_raw= None
+        self._events_cache    = dict()
     
 #---    
     @property
@@ -953,6 +1166,105 @@ class JuMEG_Epocher_Events(JuMEG_Epocher_HDF,JuMEG_Epocher_Basic):
     @event_data_stim_channel.setter
     def event_data_stim_channel(self,v): self.event_data_parameter["events"]["stim_channel"]=v             
 
+#---
+    def events_cache_clear(self):
+        """ clear the cache of <mne.find_events> results """
+        self._events_cache_raw = None
+        self._events_cache     = dict()
+        
+#---
+    def events_find_events_cached(self,raw,**events):
+        """ <mne.find_events> with cache per raw obj, channel and find_events parameter
+         each stim/response channel is scanned once per raw obj,
+         the cache is cleared if called with a different raw obj
+         
+        Parameters
+        ----------
+         raw   : raw obj
+         events: parameter for <mne.find_events> e.g. stim_channel,output,consecutive,min_duration,shortest_event,mask
+        
+        Returns
+        -------
+         mne events array, copy of the cached array
+        """
+        if not self.events_cache:
+           return mne.find_events(raw, **events)
+       
+        if self._events_cache_raw is not raw:
+           self.events_cache_clear()
+           self._events_cache_raw = raw
+           
+        key = tuple( sorted( (k,repr(v)) for k,v in events.items() ) )
+        if key not in self._events_cache:
+           self._events_cache[key] = mne.find_events(raw, **events)
+        elif self.verbose:
+           print"  -> events from cache: " + str( events.get("stim_channel") )
+          
+        return self._events_cache[key].copy()
+        
+#---
+    def events_ck_raw_data(self,raw,projs=True,preload=True):
+        """ check if epochs and baselines can be read from raw data directly like mne.Epochs:
+        no <bad> annotations (mne reject_by_annotation)
+        
+        Parameters
+        ----------
+         raw    : raw obj
+         projs  : <True> allow projections; False: no projections in raw.info
+         preload: <True> raw obj preloaded; False: raw obj not preloaded
+        
+        Returns
+        -------
+         True/False
+        """
+        if bool(raw.preload) != preload: return False
+        annot = getattr(raw,'annotations',None)
+        if annot is not None and len(annot):
+           if any( str(d).lower().startswith('bad') for d in annot.description ): return False
+        if not projs and raw.info['projs']: return False
+        return True
+    
+#---
+    def events_calc_window(self,raw,tmin,tmax):
+        """ epoch window in samples like mne.Epochs
+        
+        Parameters
+        ----------
+         raw      : raw obj
+         tmin,tmax: start and end of the window relative to the event in sec
+        
+        Returns
+        -------
+         first sample of the window relative to the event, number of samples 
+        """
+        sfreq = raw.info['sfreq']
+        start = int( round( tmin * sfreq ) )
+        return start,int( round( tmax * sfreq ) ) + 1 - start
+    
+#---
+    def events_calc_epoch_index(self,raw,events,event_id,tmin,tmax):
+        """ epoch windows in raw._data like mne.Epochs
+        
+        Parameters
+        ----------
+         raw      : raw obj
+         events   : mne events
+         event_id : event id
+         tmin,tmax: start and end of the epoch relative to the event in sec
+        
+        Returns
+        -------
+         index of events used by mne.Epochs: event id == event_id and epoch window within the data
+         first sample of the epoch windows in raw._data for all events
+         first sample of the epoch window relative to the event
+         number of samples of the epoch window
+        """
+        start,n = self.events_calc_window(raw,tmin,tmax)
+        
+        tsl0 = events[:,0].astype(np.int64) - raw.first_samp + start
+        idx  = np.where( ( events[:,2] == event_id ) & ( tsl0 >= 0 ) & ( tsl0 + n <= raw.n_times ) )[0]
+        return idx,tsl0,start,n
+        
 #---
     def channel_events_to_dataframe(self):
         """find events from stimulus [STI 014,ET_events] and response channels [STI 013]
@@ -1117,6 +1429,7 @@ class JuMEG_Epocher_Events(JuMEG_Epocher_HDF,JuMEG_Epocher_Basic):
   
         
         self.raw,fname = jumeg_base.get_raw_obj(fname,raw=raw)
+        self.events_cache_clear()
        
        #---  init obj
         self.hdf_obj_init(raw=self.raw,overwrite=overwrite_hdf)
@@ -1307,7 +1620,7 @@ class JuMEG_Epocher_Events(JuMEG_Epocher_HDF,JuMEG_Epocher_Basic):
         events           = param['events'].copy()
         events['output'] = 'step'
        # self.pp( events )
-        ev = mne.find_events(raw, **events) #-- return int64
+        ev = self.events_find_events_cached(raw, **events) #-- return int64
 
        #--- apply and mask e.g. 255 get the first 8 bits in Trigger channel
         if param['and_mask']:
@@ -1377,3 +1690,46 @@ class JuMEG_Epocher_Events(JuMEG_Epocher_HDF,JuMEG_Epocher_Basic):
     
 jumeg_epocher_events = JuMEG_Epocher_Events()
 
+
+def test_response_matching(seed=42,n_trials=4):
+    """
+    response matching engine="searchsorted" vs engine="loop" on seeded synthetic stimulus/response
+    dataframes (sorted and unsorted responses) => same dataframe columns and values
+    for counts all/first/N, response windows starting at/after/before the stimulus,
+    early_ids_to_ignore all/None/ids and response offset column == or != response onset column
+
+    return number of compared cases
+    """
+    import itertools
+    rng = np.random.RandomState(seed)
+    raw = mne.io.RawArray(np.zeros((1,1)),mne.create_info(['STI 014'],100.0,['stim']),verbose=False)
+
+    n_cases = 0
+    for trial in range(n_trials):
+        ns,nr = rng.randint(1,60),rng.randint(1,120)
+        stim_onset = np.sort( rng.randint(0,20000,ns) )
+        resp_onset = rng.randint(0,20000,nr)
+        if trial % 4:
+           resp_onset = np.sort(resp_onset)
+        stim_df = pd.DataFrame({'stim_id':rng.randint(1,5,ns),'stim_onset':stim_onset,'stim_offset':stim_onset + 5,
+                                'bads':0,'selected':0,'weighted_selected':0})
+        resp_df = pd.DataFrame({'resp_id':rng.randint(1,6,nr),'resp_onset':resp_onset,
+                                'resp_offset':resp_onset + rng.randint(1,300,nr)})
+
+        for counts,window,early,offset in itertools.product(['all','first',1,2],[[0.0,1.0],[0.1,0.8],[-0.2,0.5]],
+                                                            ['all',None,'1,2'],['resp_onset','resp_offset']):
+            param = dict(raw=raw,stim_df=stim_df,stim_param={'event_id':1},stim_type_input='stim_onset',stim_prefix='stim',
+                         resp_df=resp_df,resp_param={'window':window,'event_id':'1,2','early_ids_to_ignore':early,'counts':counts},
+                         resp_type_input='resp_onset',resp_type_offset=offset,resp_prefix='resp')
+            df = dict()
+            for engine in ('loop','searchsorted'):
+                df[engine] = JuMEG_Epocher_ResponseMatching().apply(engine=engine,**param)
+
+            info = "trial: %d counts: %s window: %s early_ids_to_ignore: %s offset: %s" % (trial,counts,window,early,offset)
+            assert df['loop'].columns.tolist() == df['searchsorted'].columns.tolist(),"response matching columns differ: " + info
+            assert np.array_equal(df['loop'].values.astype(np.int64),df['searchsorted'].values.astype(np.int64)),\
+                   "response matching searchsorted deviates from loop: " + info
+            n_cases += 1
+
+    return n_cases
+
@@ -9,9 +9,15 @@ Created on Tue Jun  2 13:38:32 2015
   -> properties rt idx
 ---> update 13.04.2018 FB
   -> epocher rebuild new properties
+---> update
+  -> N-D arrays in HDFobj: chunked, compressed, partial reads by index/slice
+     memory-mapped access via npy export
+  -> reader for pandas fixed-format nodes incl. Panel (wide), pd.Panel not needed
 """
 
 import os
+import tempfile
+import numpy as np
 import pandas as pd
 
 from jumeg.jumeg_base import jumeg_base
@@ -46,6 +52,9 @@ class JuMEG_Epocher_HDF(JuMEG_Epocher_Template):
    
         self._raw_postfix            = 'c,rfDC'
         self._raw_extention          = '.fif'
+        
+        self._hdf_array_filters      = {'complevel':4,'complib':'zlib','shuffle':True}
+        self._hdf_array_chunk_last   = (16,1024) # max chunk size of the last two dims e.g.: IC,time
        
   #---
     @property
@@ -106,6 +115,16 @@ class JuMEG_Epocher_HDF(JuMEG_Epocher_Template):
   #--- hdf epocher filename for HDF obj
     @property
     def hdf_filename(self): return self._hdf_filename    
+  #--- compression of N-D arrays  complevel 0 => no compression
+    @property
+    def hdf_array_filters(self): return self._hdf_array_filters
+    @hdf_array_filters.setter
+    def hdf_array_filters(self,v): self._hdf_array_filters=v
+  #--- max chunk size of the last two dims of N-D arrays, all other dims chunk size 1
+    @property
+    def hdf_array_chunk_last(self): return self._hdf_array_chunk_last
+    @hdf_array_chunk_last.setter
+    def hdf_array_chunk_last(self,v): self._hdf_array_chunk_last=v
     
     
   #---
@@ -359,6 +378,178 @@ class JuMEG_Epocher_HDF(JuMEG_Epocher_Template):
        #--- update attributes e.g. save dicts like parameter,info ...
         return self.hdf_obj_store_attributes(key=key,**storer_attrs)
 
+
+#--- N-D arrays
+    def hdf_obj_array_exists(self,key):
+        """ check if N-D array node <key> exists in HDFobj """
+        node = self.HDFobj.get_node(key)
+        return ( node is not None ) and hasattr(node,'chunkshape')
+
+    def hdf_obj_array_chunkshape(self,shape):
+        """ chunkshape for N-D array
+        all leading dims e.g. band,epoch chunk size 1, the last two dims e.g. IC,time <hdf_array_chunk_last>
+        => partial reads by band, IC and time slice read only the chunks of the selection
+        
+        Parameters
+        ----------
+        shape: array shape
+        
+        Returns
+        ----------
+        chunkshape as tuple 
+        """
+        shape = tuple( int(s) for s in shape )
+        if len(shape) < 2:
+           return ( max(1,min(shape[0],self.hdf_array_chunk_last[-1])), )
+        chunk = [1] * ( len(shape) - 2 )
+        chunk.append( max(1,min(shape[-2],self.hdf_array_chunk_last[0])) )
+        chunk.append( max(1,min(shape[-1],self.hdf_array_chunk_last[1])) )
+        return tuple(chunk)
+
+    def hdf_obj_array_create(self,key,shape,dtype=np.int16,chunkshape=None,**attrs):
+        """ create chunked, compressed N-D array in HDFobj, an existing node is removed
+        data are written and read by index/slice e.g.: node[idx_band] = data
+        
+        Parameters
+        ----------
+        key       : full key </node + /key ... + /keyN>
+        shape     : array shape e.g.: band x IC x time
+        dtype     : <np.int16>
+        chunkshape: <None> => hdf_obj_array_chunkshape(shape)
+        attrs     : user attributes stored in node attrs <**kwargs>
+        
+        Returns
+        ----------
+        PyTables CArray node
+        
+        Example
+        ----------
+         pkd = self.hdf_obj_array_create("/ctps/M100/pkd",(nbands,nics,ntsl),bands=bands_list)
+         pkd[idx_band] = pk_dynamics 
+        """
+        import tables
+        
+        if not self.hdf_obj_is_open():
+           return None
+        
+        hdf = self.HDFobj._handle
+        if self.HDFobj.get_node(key) is not None:
+           hdf.remove_node(key,recursive=True)
+        
+        if chunkshape is None:
+           chunkshape = self.hdf_obj_array_chunkshape(shape)
+        
+        where,name = key.rstrip('/').rsplit('/',1)
+        node = hdf.create_carray(where or '/',name,atom=tables.Atom.from_dtype( np.dtype(dtype) ),shape=tuple( int(n) for n in shape ),
+                                 chunkshape=chunkshape,filters=tables.Filters(**self.hdf_array_filters),createparents=True)
+        for k in attrs:
+            node.attrs[k] = attrs[k]
+        
+        if self.verbose:
+           print "---> HDFobj create array: " + key
+           print "  -> shape: " + str(node.shape) +" chunkshape: " + str(node.chunkshape)
+        
+        return node
+
+    def hdf_obj_array_read(self,key,index=None):
+        """ read N-D array or part of it from HDFobj
+        only the chunks of the selection are read and decompressed
+        
+        Parameters
+        ----------
+        key  : full key </node + /key ... + /keyN>
+        index: numpy like index, ints, slices and one list of ints <None> => all 
+        
+        Returns
+        ----------
+        numpy array 
+        
+        Example
+        ----------
+         pkd_band = self.hdf_obj_array_read("/ctps/M100/pkd",index=(idx_band,[1,3,7],slice(100,300)) )
+        """
+        node = self.HDFobj.get_node(key)
+        if index is None:
+           return node.read()
+        return node[index]
+
+    def hdf_obj_array_memmap(self,key,fnpy=None,tmpdir=None,mode='r'):
+        """ memory-mapped access to a N-D array of HDFobj
+        compressed chunks can not be mapped, the array is exported chunk-row by chunk-row
+        into a npy file and mapped with numpy.load(mmap_mode),
+        the location of the npy file has to be given explicitly:
+        
+         fnpy  : npy file kept as cache, reused as long as it is newer than the HDF file,
+                 the caller removes it if no longer needed
+         tmpdir: temporary npy file in tmpdir, removed right after mapping
+                 (POSIX: the mapping stays valid until it is released), exported on each call
+        
+        Parameters
+        ----------
+        key   : full key </node + /key ... + /keyN>
+        fnpy  : npy filename <None>
+        tmpdir: directory for a temporary npy file, used if no fnpy <None>
+        mode  : mmap mode <r>
+        
+        Returns
+        ----------
+        numpy memmap
+        """
+        if not fnpy and not tmpdir:
+           raise ValueError("HDFobj array memmap: no npy file <fnpy> or directory <tmpdir> for: " + key)
+        
+        node   = self.HDFobj.get_node(key)
+        is_tmp = not fnpy
+        if is_tmp:
+           fd,fnpy = tempfile.mkstemp(prefix=os.path.basename( os.path.splitext(self.HDFobj.filename)[0] ) + key.replace('/','_') + '_',
+                                      suffix='.npy',dir=tmpdir)
+           os.close(fd)
+        elif os.path.exists(fnpy) and os.path.getmtime(fnpy) >= os.path.getmtime(self.HDFobj.filename):
+           return np.load(fnpy,mmap_mode=mode)
+        
+        mm   = np.lib.format.open_memmap(fnpy,mode='w+',dtype=node.dtype,shape=tuple( int(n) for n in node.shape ))
+        step = node.chunkshape[0] if node.ndim else 1
+        for i0 in range(0,max(1,node.shape[0]),step):
+            mm[i0:i0+step] = node[i0:i0+step]
+        mm.flush()
+        del mm
+        if self.verbose:
+           print "---> HDFobj export array to npy: " + key + " => " + fnpy
+        
+        data = np.load(fnpy,mmap_mode=mode)
+        if is_tmp:
+           try:
+              os.remove(fnpy)
+           except OSError:
+              print "---> HDFobj could not remove temporary npy file: " + fnpy
+        return data
+
+    def hdf_obj_read_pandas_node(self,key):
+        """ read data of a pandas fixed-format node as numpy array
+        DataFrame and Series via pandas, 
+        Panel (pandas_type wide, removed from pandas) directly from the HDF blocks
+        used to read and migrate old files
+        
+        Parameters
+        ----------
+        key: full key </node + /key ... + /keyN>
+        
+        Returns
+        ----------
+        numpy array: DataFrame => [rows,columns], Panel => [items,major,minor]
+        """
+        node  = self.HDFobj.get_node(key)
+        if getattr(node._v_attrs,'pandas_type',None) != 'wide':
+           return self.HDFobj.get(key).values
+        
+        items = node.axis0.read()
+        data  = np.zeros( ( items.size,node.axis1.shape[0],node.axis2.shape[0] ),dtype=node.block0_values.dtype )
+        item_index = dict( (v,i) for i,v in enumerate(items) )
+        for idx in range( int(node._v_attrs.nblocks) ):
+            bitems = getattr(node,'block%d_items' % idx).read()
+            bidx   = [ item_index[v] for v in bitems ]
+            data[bidx] = getattr(node,'block%d_values' % idx).read()
+        return data
     
     def hdf_get_key_list(self,node=None,key_list=None):
           """get list of keys from HDFobj at <node>
@@ -4,6 +4,8 @@
 #--- License: Simplified BSD
 
 from .jumeg_filter import jumeg_filter
+from .jumeg_filter_base import jumeg_filter_kernel_cache
+from .jumeg_filter_bank import JuMEG_Filter_Bank
 #from . import jumeg_filter_base
 #from . import jumeg_filter_bw
 #from . import jumeg_filter_ws
@@ -99,13 +99,26 @@ filp35Hz
 
 def jumeg_filter(filter_method="bw",filter_type='bp',fcut1=1.0,fcut2=45.0,remove_dcoffset=True,sampling_frequency=1017.25,
                  filter_window='blackmann',notch=np.array([]),notch_width=1.0,order=4,njobs=4,
-                 mne_filter_method='fft',mne_filter_length='10s',trans_bandwith=0.5):
-    
+                 mne_filter_method='fft',mne_filter_length='10s',trans_bandwith=0.5,n_jobs=None):
+    '''
+    filter_method: bw  => fft butterworth
+                   iir => zero-phase butterworth + notches, second-order sections forward-backward
+                   mne => mne filter functions
+    n_jobs: bw,iir => number of worker threads for the multichannel filter, None => 1
+            mne => number of jobs for mne filter functions, None => njobs
+    '''
     if filter_method.lower() == "bw"  :
        from jumeg.filter.jumeg_filter_bw import JuMEG_Filter_Bw
-       return JuMEG_Filter_Bw(filter_type=filter_type,fcut1=fcut1, fcut2=fcut2, remove_dcoffset=remove_dcoffset, sampling_frequency=sampling_frequency,notch=notch, notch_width=notch_width,order=order)   	  
+       return JuMEG_Filter_Bw(filter_type=filter_type,fcut1=fcut1, fcut2=fcut2, remove_dcoffset=remove_dcoffset, sampling_frequency=sampling_frequency,notch=notch, notch_width=notch_width,order=order,
+                              n_jobs=n_jobs or 1)
+    elif filter_method.lower() == "iir"  :
+       from jumeg.filter.jumeg_filter_iir import JuMEG_Filter_IIR
+       return JuMEG_Filter_IIR(filter_type=filter_type,fcut1=fcut1, fcut2=fcut2, remove_dcoffset=remove_dcoffset, sampling_frequency=sampling_frequency,notch=notch, notch_width=notch_width,order=order,
+                               n_jobs=n_jobs or 1)
     else : 
        from jumeg.filter.jumeg_filter_mne import JuMEG_Filter_MNE
+       if n_jobs :
+          njobs = n_jobs
        return JuMEG_Filter_MNE(filter_type=filter_type,njobs=njobs,fcut1=fcut1,fcut2=fcut2,remove_dcoffset=True,sampling_frequency=sampling_frequency,
                                mne_filter_method=mne_filter_method,mne_filter_length=mne_filter_length,trans_bandwith=trans_bandwith,notch=notch,notch_width=notch_width)
     #elif filter_method.lower() == "ws"  :
@@ -113,6 +126,318 @@ def jumeg_filter(filter_method="bw",filter_type='bp',fcut1=1.0,fcut2=45.0,remove
     #   return JuMEG_Filter_Ws(filter_type=filter_type,fcut1=fcut1, fcut2=fcut2, remove_dcoffset=remove_dcoffset, sampling_frequency=sampling_frequency, filter_window=filter_window)
     #   #, notch=notch, notch_width=notch_width)
   
-  
+
+def _test_signal(n_channels,sampling_frequency=1017.25,number_of_samples=50000,seed=42,sines=((50.0,10.0),),noise=1.0):
+    """
+    seeded synthetic signal for the filter checks:
+    noise * white noise + sines (frequency in Hz, amplitude) + DC offset per channel
+
+    return data [channels,timeslices], rms of data without DC offset, random generator
+    """
+    rng   = np.random.RandomState(seed)
+    t     = np.arange(number_of_samples) / sampling_frequency
+    data  = noise * rng.randn(n_channels,number_of_samples)
+    for freq,amp in sines:
+        data += amp * np.sin(2.0 * np.pi * freq * t)
+    data += np.array([1.0,-50.0,300.0,0.0,2.0,-3.0])[:n_channels,np.newaxis]
+    data_rms = np.sqrt( np.mean( (data - data.mean(axis=-1)[:,np.newaxis])**2 ) )
+    return data,data_rms,rng
+
+
+def _check_filter_precision(sampling_frequency,seed):
+    from jumeg.filter.jumeg_filter_bw import JuMEG_Filter_Bw
+    from jumeg.filter.jumeg_filter_ws import JuMEG_Filter_Ws
+
+    data,data_rms,rng = _test_signal(4,sampling_frequency,seed=seed)
+    for filter_class,kwargs in [ (JuMEG_Filter_Bw,dict(filter_type='bp',fcut1=1.0,fcut2=45.0,notch=np.array([50.0]))),
+                                 (JuMEG_Filter_Bw,dict(filter_type='lp',fcut1=45.0)),
+                                 (JuMEG_Filter_Bw,dict(filter_type='hp',fcut1=1.0,remove_dcoffset=False)),
+                                 (JuMEG_Filter_Ws,dict(filter_type='bp',fcut1=1.0,fcut2=45.0)),
+                                 (JuMEG_Filter_Ws,dict(filter_type='lp',fcut1=45.0)) ]:
+        d64 = data.copy()
+        fi  = filter_class(sampling_frequency=sampling_frequency,**kwargs)
+        fi.apply_filter(d64)
+
+        d32 = data.astype(np.float32)
+        fi  = filter_class(sampling_frequency=sampling_frequency,**kwargs)
+        fi.precision = 'float32'
+        fi.apply_filter(d32)
+
+        yield fi.filter_info_short,np.sqrt( np.mean( (d32 - d64)**2 ) ) / data_rms,1e-5
+
+
+def _check_filter_multichannel(sampling_frequency,seed):
+    from jumeg.filter.jumeg_filter_bw import JuMEG_Filter_Bw
+    from jumeg.filter.jumeg_filter_ws import JuMEG_Filter_Ws
+
+    data,data_rms,rng = _test_signal(6,sampling_frequency,seed=seed)
+    picks = np.array([0,1,2,4])
+    for filter_class,kwargs in [ (JuMEG_Filter_Bw,dict(filter_type='bp',fcut1=1.0,fcut2=45.0,notch=np.array([50.0]))),
+                                 (JuMEG_Filter_Bw,dict(filter_type='hp',fcut1=1.0,remove_dcoffset=False)),
+                                 (JuMEG_Filter_Ws,dict(filter_type='bp',fcut1=1.0,fcut2=45.0)),
+                                 (JuMEG_Filter_Ws,dict(filter_type='lp',fcut1=45.0,remove_dcoffset=False)) ]:
+        d1 = data.copy()
+        fi = filter_class(sampling_frequency=sampling_frequency,**kwargs)
+        fi.multichannel = False
+        fi.apply_filter(d1,picks)
+
+        dmc = data.copy()
+        fi  = filter_class(sampling_frequency=sampling_frequency,**kwargs)
+        fi.multichannel_block_size = 3
+        fi.apply_filter(dmc,picks)
+        assert np.array_equal(dmc[[3,5]],data[[3,5]]), "multichannel filter changed channels not in picks"
+
+        dmt = data.copy()
+        fi.multichannel_block_size = 1
+        fi.apply_filter(dmt,picks,n_jobs=3)
+        assert np.array_equal(dmt,dmc), "multichannel filter n_jobs=3 differs from n_jobs=1: %s" % (fi.filter_info_short)
+
+        yield fi.filter_info_short,np.abs(dmc - d1).max() / data_rms,1e-10
+
+
+def _check_filter_real_data_plane(sampling_frequency,seed):
+    from jumeg.filter.jumeg_filter_bw import JuMEG_Filter_Bw
+
+    data,data_rms,rng = _test_signal(1,sampling_frequency,seed=seed,sines=())
+    data = data[0]
+    for kwargs in ( dict(filter_type='bp',fcut1=1.0,fcut2=45.0,notch=np.array([50.0,100.0])),
+                    dict(filter_type='hp',fcut1=1.0,remove_dcoffset=False),
+                    dict(filter_type='lp',fcut1=45.0) ):
+        d  = data.copy()
+        fi = JuMEG_Filter_Bw(sampling_frequency=sampling_frequency,**kwargs)
+        fi.apply_filter(d)
+
+    #--- complex reference on the data plane of the filter
+        idx   = fi.data_plane_index
+        dplane= fi.data_plane.astype(np.complex128)
+        dref  = np.fft.ifft( np.fft.fft(dplane) * fi.filter_kernel_data_cplx_sqrt ).real[ idx['data_in'] ]
+        if not fi.remove_dcoffset :
+           dref += data.mean()
+
+        yield fi.filter_info_short,np.abs(d - dref).max() / d.std(),1e-12
+
+
+def _check_filter_notch_comb(sampling_frequency,seed,number_of_samples=200000):
+    from jumeg.filter.jumeg_filter_bw import JuMEG_Filter_Bw
+
+    for notch in ( np.array([50.0]),np.arange(50.0,401.0,50.0) ):
+        fi = JuMEG_Filter_Bw(filter_type='bp',fcut1=1.0,fcut2=45.0,sampling_frequency=sampling_frequency)
+        fi.filter_kernel_cache = False
+        fi.data = np.zeros(number_of_samples)
+        kref = fi.calc_filter_kernel().copy()
+
+        fi.filter_notch = notch
+        fkd = fi.calc_filter_kernel()
+
+    #--- notches one by one: exp( -(sigma/(f - notch))**2 ), zero at the closest frequency bin
+        nyq_idx = kref.size // 2 + 1
+        f_res   = sampling_frequency / 2.0 / nyq_idx
+        freq    = np.arange(nyq_idx) * f_res
+        sigma   = np.sqrt( np.log(2.0) ) * fi.filter_notch_width / 2.0
+        for omega in fi.filter_notch:
+            min_idx = np.argmin( np.abs(freq - omega) )
+            kref[min_idx] = 0.0
+            k = np.arange(1,nyq_idx)
+            k = k[ k != min_idx ]
+            kref[k] *= np.exp( - ( sigma / (freq[k] - omega) )**2 )
+        kref[nyq_idx:] = kref[nyq_idx-1:1:-1]
+        assert np.array_equal(fkd == 0.0,kref == 0.0), "notch comb zeros differ"
+
+        yield "%d notches" % (notch.size),np.abs(fkd - kref).max(),1e-12
+
+
+def _check_filter_kernel_cache(sampling_frequency,seed):
+    from jumeg.filter.jumeg_filter_base import jumeg_filter_kernel_cache
+    from jumeg.filter.jumeg_filter_bw import JuMEG_Filter_Bw
+    from jumeg.filter.jumeg_filter_ws import JuMEG_Filter_Ws
+
+    data,data_rms,rng = _test_signal(3,sampling_frequency,seed=seed,sines=())
+    try:
+       for filter_class,kwargs in [ (JuMEG_Filter_Bw,dict(filter_type='bp',fcut1=1.0,fcut2=45.0,notch=np.array([50.0]))),
+                                    (JuMEG_Filter_Ws,dict(filter_type='bp',fcut1=1.0,fcut2=45.0)) ]:
+           jumeg_filter_kernel_cache.clear()
+
+           dref = data.copy()
+           fi   = filter_class(sampling_frequency=sampling_frequency,**kwargs)
+           fi.filter_kernel_cache = False
+           fi.apply_filter(dref)
+           assert jumeg_filter_kernel_cache.info()['misses'] == 0
+
+           dev = 0.0
+           for i in range(3):
+               d  = data.copy()
+               fi = filter_class(sampling_frequency=sampling_frequency,**kwargs)
+               fi.apply_filter(d)
+               dev = max(dev,np.abs(d - dref).max())
+           info = jumeg_filter_kernel_cache.info()
+           assert (info['hits'],info['misses'],info['size']) == (2,1,1), info
+           filter_info = fi.filter_info_short
+
+       #--- changed cutoff, padded data length => miss
+           fi.fcut2 = 40.0
+           fi.apply_filter(data.copy())
+           fi.apply_filter(np.hstack((data,data)))
+           info = jumeg_filter_kernel_cache.info()
+           assert (info['hits'],info['misses'],info['size']) == (2,3,3), info
+
+           yield filter_info,dev,0.0
+    finally:
+       jumeg_filter_kernel_cache.clear()
+
+
+def _check_filter_overlap_save(sampling_frequency,seed,number_of_samples=200000):
+    import os,tempfile
+    from jumeg.filter.jumeg_filter_bw import JuMEG_Filter_Bw
+    from jumeg.filter.jumeg_filter_ws import JuMEG_Filter_Ws
+
+    data,data_rms,rng = _test_signal(4,sampling_frequency,number_of_samples,seed=seed)
+    picks = np.array([0,2,3])
+    cuts  = np.sort( rng.randint(0,number_of_samples,30) )
+
+    fd,fname = tempfile.mkstemp(suffix='.dat')
+    os.close(fd)
+    try:
+       for filter_class,kwargs in [ (JuMEG_Filter_Bw,dict(filter_type='bp',fcut1=1.0,fcut2=45.0,notch=np.array([50.0]))),
+                                    (JuMEG_Filter_Bw,dict(filter_type='lp',fcut1=45.0,remove_dcoffset=False)),
+                                    (JuMEG_Filter_Ws,dict(filter_type='bp',fcut1=1.0,fcut2=45.0)) ]:
+           dref = data.copy()
+           fi   = filter_class(sampling_frequency=sampling_frequency,**kwargs)
+           fi.apply_filter(dref,picks)
+
+       #--- memory-mapped array, compared away from the edges (2 x overlap)
+           dmm    = np.memmap(fname,dtype=np.float64,mode='w+',shape=data.shape)
+           dmm[:] = data
+           fi = filter_class(sampling_frequency=sampling_frequency,**kwargs)
+           fi.overlap_save_block_size = 2**14
+           fi.apply_filter_overlap_save(dmm,picks)
+           over = fi.overlap_save['overlap']
+           inner= slice(2 * over,number_of_samples - 2 * over)
+           dev  = np.abs(dmm[:,inner] - dref[:,inner]).max() / data_rms
+           assert np.array_equal(dmm[1],data[1]), "overlap-save filter changed channels not in picks"
+           del dmm
+
+       #--- chunk iterator with random chunk sizes
+           chunks = ( data[picks,i0:i1] for i0,i1 in zip(np.r_[0,cuts],np.r_[cuts,number_of_samples]) )
+           fi = filter_class(sampling_frequency=sampling_frequency,**kwargs)
+           fi.overlap_save_block_size = 2**14
+           fi.data = dref
+           d  = np.concatenate( list( fi.iter_filter_overlap_save(chunks,data_mean=data[picks].mean(axis=-1),
+                                                                  data_length=number_of_samples) ),axis=-1 )
+           assert d.shape == (picks.size,number_of_samples)
+           assert fi.data is dref, "overlap-save filter replaced the data attribute"
+
+           yield fi.filter_info_short,max(dev,np.abs(d[:,inner] - dref[picks,inner]).max() / data_rms),1e-5
+    finally:
+       os.remove(fname)
+
+
+def _check_filter_bank(sampling_frequency,seed):
+    from jumeg.filter.jumeg_filter_bw import JuMEG_Filter_Bw
+    from jumeg.filter.jumeg_filter_bank import JuMEG_Filter_Bank
+
+    data,data_rms,rng = _test_signal(5,sampling_frequency,seed=seed,sines=())
+    dsave = data.copy()
+    picks = np.array([0,1,3,4])
+    bands = [(4.0,8.0),(1.0,4.0),(8.0,12.0),(30.0,45.0)]
+    inner = slice(5000,data.shape[-1]-5000)
+
+    fb  = JuMEG_Filter_Bank(bands=bands,sampling_frequency=sampling_frequency)
+    out = fb.apply_filter_bank(data,picks)
+    outa= np.array( [ d for idx,band,d in fb.iter_filter_bank(data,picks,analytic=True) ] )
+    assert np.array_equal(data,dsave), "filter bank changed data"
+    assert out.shape == (len(bands),picks.size,data.shape[-1])
+
+    for idx,band in enumerate(bands):
+        d  = data.copy()
+        fi = JuMEG_Filter_Bw(filter_type='bp',fcut1=band[0],fcut2=band[1],sampling_frequency=sampling_frequency)
+        fi.apply_filter(d,picks)
+        drms = d[picks].std()
+        assert np.abs(outa[idx].real - out[idx]).max() < 1e-10 * drms, "analytic filter bank output differs"
+
+    #--- lowest band shares the data plane geometry of bw, other bands use its padding
+        yield fi.filter_info_short,np.abs(out[idx] - d[picks])[:,inner].max() / drms,( 1e-10 if band[0] == 1.0 else 1e-6 )
+
+
+def _check_filter_iir(sampling_frequency,seed):
+    import scipy.signal as signal
+
+    data,data_rms,rng = _test_signal(4,sampling_frequency,seed=seed,sines=((10.0,1.0),(50.0,0.5),(100.0,0.5)),noise=0.1)
+    sig   = np.sin(2.0 * np.pi * 10.0 * np.arange(data.shape[-1]) / sampling_frequency)
+    dsave = data.copy()
+    picks = np.array([0,1,3])
+    inner = slice(5000,data.shape[-1]-5000)
+
+    fi = jumeg_filter(filter_method="iir",filter_type='bp',fcut1=1.0,fcut2=45.0,sampling_frequency=sampling_frequency,notch=np.array([50.0]))
+    fb = jumeg_filter(filter_method="bw", filter_type='bp',fcut1=1.0,fcut2=45.0,sampling_frequency=sampling_frequency,notch=np.array([50.0]))
+    assert fi.filter_method == 'iir'
+    assert fi.filter_name_postfix == fb.filter_name_postfix, "postfix differs: %s %s" % (fi.filter_name_postfix,fb.filter_name_postfix)
+
+    fi.apply_filter(data,picks)
+    assert np.array_equal(data[2],dsave[2]), "iir changed unpicked channel"
+    assert fi.filter_info.replace('iir','bw',1) == fb.filter_info, "info differs: %s %s" % (fi.filter_info,fb.filter_info)
+
+    d   = dsave[0] - dsave[0].mean()
+    ref = signal.sosfiltfilt(fi.filter_kernel_data,d,padtype='even',padlen=fi.settling_time_factor_timeslices)
+    yield 'sosfiltfilt',np.abs(data[0] - ref).max(),1e-10
+    #--- 10 Hz sine in the passband kept in phase, 50 Hz notch and 100 Hz stopband suppressed
+    yield '10 Hz sine rms',np.sqrt( np.mean( (data[picks][:,inner] - sig[inner])**2 ) ),0.05
+    yield 'dc offset removed',np.abs(data[picks].mean(axis=-1)).max(),1e-2
+
+#--- retain dc offset, multichannel == per channel
+    fi.remove_dcoffset = False
+    d2 = dsave.copy()
+    fi.apply_filter(d2,picks)
+    yield 'dc offset retained',np.abs(d2[picks].mean(axis=-1) - dsave[picks].mean(axis=-1)).max(),1e-2
+    dev = 0.0
+    for ch in picks:
+        d1 = dsave[ch].copy()
+        fi.apply_filter(d1)
+        dev = max(dev,np.abs(d1 - d2[ch]).max())
+    yield 'multichannel vs single channel',dev,1e-10
+
+
+_filter_checks = [ ('precision',_check_filter_precision),
+                   ('multichannel',_check_filter_multichannel),
+                   ('real_data_plane',_check_filter_real_data_plane),
+                   ('notch_comb',_check_filter_notch_comb),
+                   ('kernel_cache',_check_filter_kernel_cache),
+                   ('overlap_save',_check_filter_overlap_save),
+                   ('bank',_check_filter_bank),
+                   ('iir',_check_filter_iir) ]
+
+
+def test_filter(checks=None,sampling_frequency=1017.25,seed=42):
+    """
+    regression checks of the jumeg filters on seeded synthetic data (_test_signal),
+    each check yields (filter info, deviation, bound) and asserts deviation <= bound
+
+      precision      : float32 vs float64 mode, rel. rms deviation < 1e-5 (see JuMEG_Filter_Base.precision)
+      multichannel   : blocks of channels (n_jobs=1,3) vs single channel, rel. max deviation < 1e-10,
+                       channels not in picks unchanged
+      real_data_plane: bw real-valued data plane vs complex formulation, rel. max deviation < 1e-12
+      notch_comb     : bw notch comb vs notches applied one by one, single notch and
+                       harmonics of 50 Hz up to 400 Hz, max deviation < 1e-12
+      kernel_cache   : kernel from the process-wide cache vs cache disabled => identical (bound 0),
+                       changed cutoffs or padded data length => miss
+      overlap_save   : overlap-save (memory-mapped array, chunk iterator) vs single shot, data attribute kept
+                       away from the edges, rel. max deviation < 1e-5
+      bank           : filter bank vs bw bp per band away from the edges,
+                       rel. max deviation < 1e-10 for the lowest band, < 1e-6 for the others
+      iir            : zero-phase iir vs scipy.signal.sosfiltfilt, 10 Hz sine in the passband,
+                       DC offset removed/retained, multichannel == single channel
+
+    checks: list of check names <None> => all
+    return dict: (check,filter info) -> deviation
+    """
+    result = {}
+    check_funcs = dict(_filter_checks)
+    for name in ( checks or [ c[0] for c in _filter_checks ] ):
+        for info,dev,bound in check_funcs[name](sampling_frequency,seed):
+            result[(name,info)] = dev
+            assert dev <= bound, "filter check %s deviates: %s %0.3e" % (name,info,dev)
+
+    return result
+
+
 if __name__ == "__main__":
    jumeg_filter(**kwargs)
@@ -0,0 +1,237 @@
+import numpy as np
+import time
+
+'''
+----------------------------------------------------------------------
+--- JuMEG Filter_Bank           --------------------------------------
+----------------------------------------------------------------------
+ filter bank of butterworth filters sharing one forward fft
+
+ the data plane of each channel is transformed once (rfft), multiplied
+ with the kernel of each band and transformed back:
+ 1 fft + K inverse ffts instead of K filter runs
+
+ all bands share one data plane geometry: settling time and padding
+ of the lowest fcut1 => per band the same kernel design as JuMEG_Filter_Bw,
+ frequency grid and mirror padding of the bank
+
+ band outputs: real band-limited signals or analytic signals
+ (band-limited signal + i * hilbert transform)
+----------------------------------------------------------------------
+
+ fb = JuMEG_Filter_Bank(bands=[(4,8),(8,12),(12,16)],sampling_frequency=raw.info['sfreq'])
+
+ for idx,band,data_band in fb.iter_filter_bank(raw._data,picks=picks):
+     ...
+
+ data_bands = fb.apply_filter_bank(raw._data,picks=picks,analytic=True) # [bands,picks,timeslices]
+
+----------------------------------------------------------------------
+
+'''
+from jumeg.filter.jumeg_filter_bw import JuMEG_Filter_Bw
+
+class JuMEG_Filter_Bank(JuMEG_Filter_Bw):
+
+     def __init__ (self,bands=[(1.0,4.0)],filter_type='bp',remove_dcoffset=True,sampling_frequency=1017.25,
+                        notch=np.array([]),notch_width=2.0,order=4.0,settling_time_factor=5.0,n_jobs=1):
+         self.__bands               = np.atleast_2d( np.array(bands,dtype=np.float64) )
+         self.__filter_bank_kernels = []
+         super(JuMEG_Filter_Bank, self).__init__(filter_type=filter_type,fcut1=self.__bands[0,0],fcut2=self.__bands[0,1],
+                                                 remove_dcoffset=remove_dcoffset,sampling_frequency=sampling_frequency,
+                                                 notch=notch,notch_width=notch_width,order=order,
+                                                 settling_time_factor=settling_time_factor,n_jobs=n_jobs)
+         self.bands = bands
+
+#--- bands  [number of bands,2] fcut1,fcut2 per band
+     def __set_bands(self,value):
+         self.__bands = np.atleast_2d( np.array(value,dtype=np.float64) )
+         if self.__bands.shape[-1] != 2 :
+            raise ValueError("bands must be a list of (fcut1,fcut2)")
+         self.filter_kernel_isinit = False
+
+     def __get_bands(self):
+         return self.__bands
+
+     bands = property(__get_bands,__set_bands)
+
+#--- number_of_bands
+     def __get_number_of_bands(self):
+         return self.__bands.shape[0]
+
+     number_of_bands = property(__get_number_of_bands)
+
+#--- filter_bank_kernels list of half-spectrum kernels per band
+     def __get_filter_bank_kernels(self):
+         return self.__filter_bank_kernels
+
+     filter_bank_kernels = property(__get_filter_bank_kernels)
+
+#--- settling time factor timeslices of the lowest fcut1 => data plane geometry of all bands
+     def __get_settling_time_factor_timeslices(self):
+         tau = np.min( self.__bands[:,0] ) * 2.0 * np.pi
+         return np.ceil( ( 1.0 / tau ) * self.settling_time_factor * self.sampling_frequency )
+
+     settling_time_factor_timeslices = property(__get_settling_time_factor_timeslices)
+
+#---------------------------------------------------------#
+#---  calc_data_plane_length     -------------------------#
+#---------------------------------------------------------#
+     def calc_data_plane_length(self,M):
+         """
+            return padded length of data plane and filter functions for all bands
+            padding of the lowest fcut1
+
+            input: M => data length
+         """
+         pad = np.ceil( self.sampling_frequency / 2.0 / np.min( self.__bands[:,0] ) )
+         return self.calc_zero_padding( M + pad  + 2 * self.settling_time_factor_timeslices)
+
+#---------------------------------------------------------#
+#--- init_filter_kernel          -------------------------#
+#---------------------------------------------------------#
+     def init_filter_kernel(self):
+         """
+            calculating half-spectrum filter kernels of all bands
+            kernels from/to jumeg_filter_kernel_cache
+         """
+         kernels = []
+         for fcut1,fcut2 in self.__bands:
+             self.fcut1 = fcut1
+             self.fcut2 = fcut2
+             super(JuMEG_Filter_Bank, self).init_filter_kernel()
+             kernels.append( self.filter_kernel_data_half_spectrum )
+
+         self.__filter_bank_kernels = kernels
+         self.filter_kernel_isinit  = True
+
+         return self.filter_kernel_isinit
+
+#---------------------------------------------------------#
+#--- calc_filter_bank_spectrum   -------------------------#
+#---------------------------------------------------------#
+     def calc_filter_bank_spectrum(self,data,picks):
+         """
+            return rfft of the data planes of channels picks and the DC offset
+
+            input: data => 2D array [channels,timeslices], picks => channel index
+            return: spectrum [picks,data plane length/2+1], DC offset [picks]
+         """
+         d     = data[picks,:].astype(self.dtype)
+         dmean = np.mean(d, axis = -1, dtype = np.float64)
+         d    -= dmean[:,np.newaxis]
+         return np.fft.rfft( self.calc_data_plane_block(d),axis=-1 ),dmean
+
+#---------------------------------------------------------#
+#--- calc_filter_bank_band       -------------------------#
+#---------------------------------------------------------#
+     def calc_filter_bank_band(self,spec,dmean,idx_band,analytic=False):
+         """
+            return band-limited signals for band idx_band from the data plane spectrum
+
+            input: spec     => rfft of data planes [channels,data plane length/2+1]
+                   dmean    => DC offset [channels], restored if remove_dcoffset is False (not for analytic)
+                   idx_band => index of band
+                   analytic => True: analytic signal (complex) band-limited signal + i * hilbert transform
+            return: 2D array [channels,timeslices]
+         """
+         idx  = self.data_plane_index
+         nfft = idx['length']
+         bspec = spec * self.__filter_bank_kernels[idx_band]
+
+         if analytic :
+          #--- analytic signal: no negative frequencies, double positive frequencies (nfft even)
+            z = np.zeros( (bspec.shape[0],nfft),np.complex128 )
+            z[:,:nfft//2+1] = bspec
+            z[:,1:nfft//2] *= 2.0
+            return np.fft.ifft(z,axis=-1)[:,idx['data_out']]
+
+         d = np.fft.irfft(bspec,nfft,axis=-1)[:,idx['data_out']]
+         if ( self.remove_dcoffset == False ):
+            d += dmean[:,np.newaxis]
+         return d
+
+#---------------------------------------------------------#
+#--- init_filter_bank_spectrum   -------------------------#
+#---------------------------------------------------------#
+     def init_filter_bank_spectrum(self,data,picks=None):
+         """
+            init filter kernels and data plane for data, return spectrum of channels picks
+            band-limited signals of each band: calc_filter_bank_band(spec,dmean,idx_band)
+            reentrant per band => bands can be calculated in worker threads
+
+            input: data  => 2D array [channels,timeslices]
+                   picks => channel index, None => all channels
+            return: spectrum [picks,data plane length/2+1], DC offset [picks]
+         """
+         data = np.atleast_2d(data)
+         if picks is None :
+            picks = np.arange( data.shape[0] )
+         picks = np.asarray(picks,dtype=np.int64)
+
+         self.data = data
+         if not( self.filter_isinit() ):
+            self.init_filter()
+
+         return self.calc_filter_bank_spectrum(data,picks)
+
+#---------------------------------------------------------#
+#--- iter_filter_bank            -------------------------#
+#---------------------------------------------------------#
+     def iter_filter_bank(self,data,picks=None,analytic=False):
+         """
+            generator: filter channels picks of data in all bands, data are not changed
+            the spectrum of all picks is calculated once and kept in memory
+
+            input: data     => 2D array [channels,timeslices]
+                   picks    => channel index, None => all channels
+                   analytic => True: analytic signals (complex)
+            yield: index of band, band (fcut1,fcut2), band-limited data [picks,timeslices]
+         """
+         spec,dmean = self.init_filter_bank_spectrum(data,picks=picks)
+
+         for idx_band in range( self.number_of_bands ):
+             if self.verbose :
+                print"===> filter bank band %d / %d: %0.3f-%0.3f Hz" %(idx_band+1,self.number_of_bands,self.bands[idx_band,0],self.bands[idx_band,1])
+             yield idx_band,self.bands[idx_band],self.calc_filter_bank_band(spec,dmean,idx_band,analytic=analytic)
+
+#---------------------------------------------------------#
+#--- apply_filter_bank           -------------------------#
+#---------------------------------------------------------#
+     def apply_filter_bank(self,data,picks=None,analytic=False,out=None):
+         """
+            filter channels picks of data in all bands, data are not changed
+            blocks of channels: one rfft per block, one inverse fft per band and block
+
+            input: data     => 2D array [channels,timeslices]
+                   picks    => channel index, None => all channels
+                   analytic => True: analytic signals (complex)
+                   out      => array [bands,picks,timeslices] for the output, None => new array
+            return: band-limited data [bands,picks,timeslices]
+         """
+         data = np.atleast_2d(data)
+         if picks is None :
+            picks = np.arange( data.shape[0] )
+         picks = np.asarray(picks,dtype=np.int64)
+
+         if self.verbose :
+            t0 = time.time()
+            print"===> Start apply filter bank: %d bands" % (self.number_of_bands)
+
+         self.data = data
+         if not( self.filter_isinit() ):
+            self.init_filter()
+
+         if out is None :
+            out = np.zeros( (self.number_of_bands,picks.size,data.shape[-1]),np.complex128 if analytic else self.dtype )
+
+         bsize = self.calc_multichannel_block_size(picks.size)
+         for i0 in range(0,picks.size,bsize):
+             spec,dmean = self.calc_filter_bank_spectrum(data,picks[i0:i0+bsize])
+             for idx_band in range( self.number_of_bands ):
+                 out[idx_band,i0:i0+bsize] = self.calc_filter_bank_band(spec,dmean,idx_band,analytic=analytic)
+
+         if self.verbose :
+            print"===> Done apply filter bank %d" %( time.time() -t0 )
+
+         return out
@@ -1,5 +1,7 @@
 import numpy as np
 import time
+import threading
+from collections import OrderedDict
 '''
 ----------------------------------------------------------------------
 --- JuMEG Filter_Base  Class    --------------------------------------
@@ -9,6 +11,12 @@ import time
  update: 16.12.2014
  update: 21.12.2016
   --> add function calc_lowpass_value
+ update: precision float64 | float32 for data plane and filter kernel
+ update: batched multichannel filtering: blocks of channels in a 2D data plane,
+         real-input fft (rfft/irfft) with half-spectrum filter kernel
+ update: n_jobs worker threads for the multichannel filter
+ update: process-wide LRU filter kernel cache  => jumeg_filter_kernel_cache
+ update: overlap-save filtering in blocks for chunk iterators and memory-mapped data
 
  version    : 0.031415
 ---------------------------------------------------------------------- 
@@ -25,6 +33,124 @@ import time
 
 '''
 
+class JuMEG_Filter_Kernel_Cache(object):
+     """
+      process-wide LRU cache of filter kernels shared by all JuMEG filter objects
+
+      key  : tuple of filter method, filter type, cutoffs, order, notches, sampling frequency,
+             padded data plane length ... => calc_filter_kernel_cache_key of the filter class
+      value: dict of kernel arrays, stored read only
+
+      bounded by number of entries (maxsize) and by memory of all kernels (maxbytes),
+      least recently used entries are removed first
+     """
+     def __init__ (self,maxsize=32,maxbytes=2**28):
+         self.__maxsize  = maxsize
+         self.__maxbytes = maxbytes
+         self.__kernels  = OrderedDict()
+         self.__nbytes   = 0
+         self.__hits     = 0
+         self.__misses   = 0
+         self.__lock     = threading.Lock()
+
+#--- maxsize max number of cached kernels, 0 => cache disabled
+     def __set_maxsize(self,value):
+         self.__maxsize = int(value)
+         self.shrink()
+
+     def __get_maxsize(self):
+         return self.__maxsize
+
+     maxsize = property(__get_maxsize, __set_maxsize)
+
+#--- maxbytes max memory of all cached kernels in bytes
+     def __set_maxbytes(self,value):
+         self.__maxbytes = int(value)
+         self.shrink()
+
+     def __get_maxbytes(self):
+         return self.__maxbytes
+
+     maxbytes = property(__get_maxbytes, __set_maxbytes)
+
+#--- hits
+     def __get_hits(self):
+         return self.__hits
+
+     hits = property(__get_hits)
+
+#--- misses
+     def __get_misses(self):
+         return self.__misses
+
+     misses = property(__get_misses)
+
+     def get(self,key):
+         """
+            return dict of kernel arrays for key or None, counts hits and misses
+         """
+         with self.__lock:
+              kernels = self.__kernels.pop(key,None)
+              if kernels is None:
+                 self.__misses += 1
+                 return None
+              self.__kernels[key] = kernels
+              self.__hits += 1
+              return kernels
+
+     def put(self,key,kernels):
+         """
+            store dict of kernel arrays for key, arrays are set to read only
+
+            return kernels
+         """
+         nbytes = 0
+         for k in kernels.values():
+             k.flags.writeable = False
+             nbytes += k.nbytes
+         if ( not self.maxsize ) or ( nbytes > self.maxbytes ):
+            return kernels
+         with self.__lock:
+              old = self.__kernels.pop(key,None)
+              if old is not None:
+                 self.__nbytes -= sum( k.nbytes for k in old.values() )
+              self.__kernels[key] = kernels
+              self.__nbytes += nbytes
+         self.shrink()
+         return kernels
+
+     def shrink(self):
+         """remove least recently used kernels till maxsize and maxbytes are kept"""
+         with self.__lock:
+              while self.__kernels and ( len(self.__kernels) > self.maxsize or self.__nbytes > self.maxbytes ):
+                    key,old = self.__kernels.popitem(last=False)
+                    self.__nbytes -= sum( k.nbytes for k in old.values() )
+
+     def clear(self):
+         """remove all kernels and reset statistics"""
+         with self.__lock:
+              self.__kernels.clear()
+              self.__nbytes = 0
+              self.__hits   = 0
+              self.__misses = 0
+
+     def info(self):
+         """
+            return dict with cache statistics: hits, misses, hit_ratio, size, maxsize, nbytes, maxbytes
+         """
+         with self.__lock:
+              n = self.__hits + self.__misses
+              return { 'hits'     : self.__hits,
+                       'misses'   : self.__misses,
+                       'hit_ratio': self.__hits / float(n) if n else 0.0,
+                       'size'     : len(self.__kernels),
+                       'maxsize'  : self.maxsize,
+                       'nbytes'   : self.__nbytes,
+                       'maxbytes' : self.maxbytes }
+
+jumeg_filter_kernel_cache = JuMEG_Filter_Kernel_Cache()
+
+
 class JuMEG_Filter_Base(object):
      def __init__ (self):
         self.__jumeg_filter_base_version   = 0.0314
@@ -48,15 +174,30 @@ class JuMEG_Filter_Base(object):
         self.__kaiser_beta                 = 16 #  for kaiser window  
 #---   flags    
         self.__remove_dcoffset             = True
+        self.__precision                   = 'float64' # float64, float32
         self.__filter_kernel_isinit        = False
         self.__verbose                     = False
 #---         
         
 #---   data      
         self.__data                        = np.array([])
+        self.__data_length                 = None # None => data.shape[-1]
         self.__data_mean                   = 0.0
         self.__data_plane_isinit           = False
         self.__data_plane_data_in          = np.array([])
+        self.__data_plane_index            = None
+#---   multichannel
+        self.__multichannel                = True
+        self.__multichannel_block_size     = None # None => auto, ~ multichannel_memory
+        self.__multichannel_memory         = 2**28 # bytes working memory of all blocks in progress
+        self.__n_jobs                      = 1
+        self.__filter_kernel_cache         = True # use jumeg_filter_kernel_cache
+#---   overlap-save
+        self.__overlap_save                = {}
+        self.__overlap_save_block_size     = 2**16
+        self.__overlap_save_tolerance      = 1e-7
+        self.__overlap_save_kernel_length  = 2**20 # data length for the filter kernel, chunk iterators
+        self.__filter_kernel_data_half_spectrum = None
 
         self._lp_for_srate = {'678': 200.0, '1017': 400.0}
 
@@ -99,9 +240,137 @@ class JuMEG_Filter_Base(object):
          return self.__filter_method
      filter_method = property(__get_filter_method)
      
+#--- precision float64 | float32 of data plane and filter kernel
+#    float32: half the memory (traffic) for the data plane, DC offset still
+#    calculated in float64; for N padded samples the filtered data deviate
+#    from float64 by ~ eps32 * log2(N) * rms(data), asserted < 1e-5 * rms(data)
+#    in jumeg.filter.jumeg_filter.test_filter(checks=['precision'])
+     def __set_precision(self,value):
+         if value not in ('float64','float32'):
+            raise ValueError("precision must be 'float64' or 'float32'")
+         self.__precision          = value
+         self.filter_kernel_isinit = False
+         self.data_plane_isinit    = False
+
+     def __get_precision(self):
+         return self.__precision
+
+     precision = property(__get_precision, __set_precision)
+
+#--- dtype real data type for precision
+     def __get_dtype(self):
+         if self.__precision == 'float32':
+            return np.float32
+         return np.float64
+
+     dtype = property(__get_dtype)
+
+#--- dtype_cplx complex data type for precision
+     def __get_dtype_cplx(self):
+         if self.__precision == 'float32':
+            return np.complex64
+         return np.complex128
+
+     dtype_cplx = property(__get_dtype_cplx)
+
+#--- multichannel flag: filter blocks of channels in a 2D data plane (True) or channel by channel (False)
+     def __set_multichannel(self,value):
+         self.__multichannel = value
+
+     def __get_multichannel(self):
+         return self.__multichannel
+
+     multichannel = property(__get_multichannel, __set_multichannel)
+
+#--- multichannel_block_size number of channels per block, None => auto
+     def __set_multichannel_block_size(self,value):
+         self.__multichannel_block_size = value
+
+     def __get_multichannel_block_size(self):
+         return self.__multichannel_block_size
+
+     multichannel_block_size = property(__get_multichannel_block_size, __set_multichannel_block_size)
+
+#--- overlap_save_block_size min number of output timeslices per block for overlap-save filtering
+     def __set_overlap_save_block_size(self,value):
+         self.__overlap_save_block_size = value
+         self.overlap_save = {}
+
+     def __get_overlap_save_block_size(self):
+         return self.__overlap_save_block_size
+
+     overlap_save_block_size = property(__get_overlap_save_block_size, __set_overlap_save_block_size)
+
+#--- overlap_save_tolerance max part of the impulse response cut off for overlap-save filtering
+     def __set_overlap_save_tolerance(self,value):
+         self.__overlap_save_tolerance = value
+         self.overlap_save = {}
+
+     def __get_overlap_save_tolerance(self):
+         return self.__overlap_save_tolerance
+
+     overlap_save_tolerance = property(__get_overlap_save_tolerance, __set_overlap_save_tolerance)
+
+#--- overlap_save_kernel_length data length used to calculate the filter kernel for chunk iterators
+     def __set_overlap_save_kernel_length(self,value):
+         self.__overlap_save_kernel_length = value
+         self.overlap_save = {}
+
+     def __get_overlap_save_kernel_length(self):
+         return self.__overlap_save_kernel_length
+
+     overlap_save_kernel_length = property(__get_overlap_save_kernel_length, __set_overlap_save_kernel_length)
+
+#--- overlap_save dict kernel,overlap,fft_length,block_size => init_filter_overlap_save
+     def __set_overlap_save(self,value):
+         self.__overlap_save = value
+
+     def __get_overlap_save(self):
+         return self.__overlap_save
+
+     overlap_save = property(__get_overlap_save, __set_overlap_save)
+
+#--- filter_kernel_cache flag: look up / store filter kernels in the process-wide jumeg_filter_kernel_cache
+     def __set_filter_kernel_cache(self,value):
+         self.__filter_kernel_cache = value
+
+     def __get_filter_kernel_cache(self):
+         return self.__filter_kernel_cache
+
+     filter_kernel_cache = property(__get_filter_kernel_cache, __set_filter_kernel_cache)
+
+#--- n_jobs number of worker threads for the multichannel filter
+     def __set_n_jobs(self,value):
+         self.__n_jobs = max(1,int(value))
+
+     def __get_n_jobs(self):
+         return self.__n_jobs
+
+     n_jobs = property(__get_n_jobs, __set_n_jobs)
+
+#--- multichannel_memory working memory of all blocks in progress in bytes, used for auto block size
+     def __set_multichannel_memory(self,value):
+         self.__multichannel_memory = value
+
+     def __get_multichannel_memory(self):
+         return self.__multichannel_memory
+
+     multichannel_memory = property(__get_multichannel_memory, __set_multichannel_memory)
+
+#--- filter_kernel_data_half_spectrum kernel for real-input fft (rfft), None => no multichannel support
+     def __set_filter_kernel_data_half_spectrum(self,value):
+         self.__filter_kernel_data_half_spectrum = value
+
+     def __get_filter_kernel_data_half_spectrum(self):
+         return self.__filter_kernel_data_half_spectrum
+
+     filter_kernel_data_half_spectrum = property(__get_filter_kernel_data_half_spectrum, __set_filter_kernel_data_half_spectrum)
+
 #--- filter_kernel_isinit check for call init fct.
      def __set_filter_kernel_isinit(self,value):
         self.__filter_kernel_isinit = value
+        if not value :
+           self.__overlap_save = {}
          
      def __get_filter_kernel_isinit(self):
         return self.__filter_kernel_isinit
@@ -307,6 +576,15 @@ class JuMEG_Filter_Base(object):
          
      data_plane_data_in_length = property(__get_data_plane_data_in_lenght)
     
+#--- data_plane_index slices of pre,data_in,post,data_out parts and length of the data plane
+     def __set_data_plane_index(self,value):
+         self.__data_plane_index = value
+
+     def __get_data_plane_index(self):
+         return self.__data_plane_index
+
+     data_plane_index = property(__get_data_plane_index, __set_data_plane_index)
+
 #--- data_plane_out dummy data container to filter data
      def __set_data_plane_data_out(self,value):
          self.__data_plane_data_out = value
@@ -338,6 +616,7 @@ class JuMEG_Filter_Base(object):
      def __set_data(self,value):
          self.filter_kernel_isinit = False
          self.data_plane_isinit    = False
+         self.__data_length        = None
          self.__data = value
 
      def __get_data(self):
@@ -345,11 +624,18 @@ class JuMEG_Filter_Base(object):
          
      data = property(__get_data,__set_data)
          
-#--- data_length
+#--- data_length: number of samples of data or set explicitly to init filter kernel and data plane without data
+     def __set_data_length(self,value):
+         self.filter_kernel_isinit = False
+         self.data_plane_isinit    = False
+         self.__data_length        = int(value)
+
      def __get_data_length(self):
+         if self.__data_length is not None :
+            return self.__data_length
          return self.data.shape[-1]
          
-     data_length = property(__get_data_length)
+     data_length = property(__get_data_length,__set_data_length)
  
 #--- data_plane_cplx 
      def __get_data_plane_cplx(self):
@@ -480,7 +766,7 @@ class JuMEG_Filter_Base(object):
              input nr => e.g. 10 out=>16
          """
          
-         return 2 ** ( np.ceil( np.log(nr) / np.log(2) ) )  
+         return int( 2 ** ( np.ceil( np.log(nr) / np.log(2) ) ) )
 
 #---------------------------------------------------------# 
 #---- calc_data_mean_std         -------------------------#
@@ -509,7 +795,8 @@ class JuMEG_Filter_Base(object):
             input: data => signal of one channel
          """  
          
-         self.data_mean = np.mean(data, axis = -1)
+         # accumulate in float64 for float32 data, too
+         self.data_mean = np.mean(data, axis = -1, dtype = np.float64)
          #self.data_mean = np.mean(data)
         
          return (self.data_mean)  
@@ -566,15 +853,157 @@ class JuMEG_Filter_Base(object):
                         
          return ( self.filter_kernel_isinit and self.data_plane_isinit and (self.data_length == self.data_plane_data_in_length )) 
 
+#---------------------------------------------------------# 
+#--- calc_filter_kernel_half_spectrum --------------------#
+#---------------------------------------------------------# 
+     def calc_filter_kernel_half_spectrum(self):
+         """
+            return filter kernel for the real-input fft (rfft) of the data plane
+            None => filter method supports the single channel path only
+         """
+         self.filter_kernel_data_half_spectrum = None
+         return self.filter_kernel_data_half_spectrum
+
+#---------------------------------------------------------# 
+#--- calc_data_plane_index       -------------------------#
+#---------------------------------------------------------# 
+     def calc_data_plane_index(self,length,idx_pre,idx_in,idx_post,idx_out):
+         """
+            return dict with slices of the data plane parts and the plane length
+            sizes are taken from the data plane views pre,data_in,post,data_out
+
+            input: length => data plane length, start index of pre,data_in,post,data_out
+         """
+         idx_pre  = int(idx_pre)
+         idx_in   = int(idx_in)
+         idx_post = int(idx_post)
+         idx_out  = int(idx_out)
+         self.data_plane_index = { 'length'  : int(length),
+                                   'pre'     : slice(idx_pre, idx_pre  + self.data_plane_data_pre.size),
+                                   'data_in' : slice(idx_in,  idx_in   + self.data_plane_data_in.size),
+                                   'post'    : slice(idx_post,idx_post + self.data_plane_data_post.size),
+                                   'data_out': slice(idx_out, idx_out  + self.data_plane_data_in.size) }
+         return self.data_plane_index
+
+#---------------------------------------------------------# 
+#--- calc_multichannel_block_size -------------------------#
+#---------------------------------------------------------# 
+     def calc_multichannel_block_size(self,number_of_channels=None,n_jobs=1):
+         """
+            return number of channels filtered at once in the 2D data plane
+            auto: data plane + spectrum + ifft output of all workers within multichannel_memory,
+                  at least one block per worker
+         """
+         if self.multichannel_block_size:
+            return int(self.multichannel_block_size)
+         nbytes = 24 * self.data_plane_index['length'] * max(1,n_jobs)
+         bsize  = int( max(1, self.multichannel_memory // nbytes) )
+         if number_of_channels and n_jobs > 1:
+            bsize = min(bsize, int( np.ceil( number_of_channels / float(n_jobs) ) ) )
+         return bsize
+
+#---------------------------------------------------------# 
+#--- calc_data_plane_block       -------------------------#
+#---------------------------------------------------------# 
+     def calc_data_plane_block(self,d):
+         """
+            return 2D data plane [channels,data plane length] for a block of channels
+            same mirror padding as do_apply_filter for each channel
+
+            input: d => 2D array [channels,timeslices] without DC offset
+         """
+         idx   = self.data_plane_index
+         dpre  = self.data_plane_data_pre.size
+         dpost = self.data_plane_data_post.size
+         n     = d.shape[-1]
+
+         plane = np.zeros( (d.shape[0],idx['length']),self.dtype )
+    #--- mirror data at pre and post in data plane array to reduce transient oscillation filter artefact
+         plane[:,idx['pre']]     = d[:,dpre :0:-1 ]
+         plane[:,idx['post']]    = d[:,n -2: n -2 - dpost :-1]
+    #--- copy data at right place in data plane array
+         plane[:,idx['data_in']] = d
+         return plane
+
+#---------------------------------------------------------# 
+#--- do_apply_filter_block       -------------------------#
+#---------------------------------------------------------# 
+     def do_apply_filter_block(self,data,chans):
+         """
+            filter channels chans of data inplace in a 2D data plane of its own
+            reentrant: no shared data plane, no shared data mean => safe to run in worker threads
+
+            input: data => 2D array [channels,timeslices], chans => channel index of the block
+         """
+         idx   = self.data_plane_index
+
+         d     = data[chans,:]
+    #--- data substract dc offset, mean accumulated in float64
+         dmean = np.mean(d, axis = -1, dtype = np.float64)
+         d    -= dmean[:,np.newaxis]
+
+    #--- filter : apply rfft along time axis; fft-convolution with filter kernel; irfft back into time domain
+         spec   = np.fft.rfft(self.calc_data_plane_block(d),axis=-1)
+         spec  *= self.filter_kernel_data_half_spectrum
+         d[:]   = np.fft.irfft(spec,idx['length'],axis=-1)[:,idx['data_out']]
+         spec   = None
+    #--- retain dc offset
+         if ( self.remove_dcoffset == False ):
+            d += dmean[:,np.newaxis]
+         data[chans,:] = d
+
+         if self.verbose :
+            print"===> ch %d - %d" %(chans[0],chans[-1])
+
+         return chans
+
+#---------------------------------------------------------# 
+#--- do_apply_filter_multichannel -------------------------#
+#---------------------------------------------------------# 
+     def do_apply_filter_multichannel(self,data,picks,n_jobs=1):
+         """
+            filter channels picks of data inplace, blocks of channels in a 2D data plane
+            same mirror padding as do_apply_filter for each channel,
+            real-input fft along time axis with filter_kernel_data_half_spectrum
+
+            n_jobs > 1: blocks are distributed over a thread pool, each worker
+            filters into its own data plane and writes its channels back into data
+            (numpy fft releases the GIL)
+
+            input: data => 2D array [channels,timeslices], picks => channel index
+                   n_jobs => number of worker threads
+         """
+         bsize  = self.calc_multichannel_block_size(len(picks),n_jobs)
+         blocks = [ picks[i0:i0+bsize] for i0 in range(0,len(picks),bsize) ]
+
+         if n_jobs > 1 and len(blocks) > 1 :
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool( min(n_jobs,len(blocks)) )
+            try:
+               pool.map(lambda chans: self.do_apply_filter_block(data,chans),blocks)
+            finally:
+               pool.close()
+               pool.join()
+         else:
+            for chans in blocks:
+                self.do_apply_filter_block(data,chans)
+
+         return data
+
 #---------------------------------------------------------# 
 #--- apply_filter                -------------------------#
 #---------------------------------------------------------# 
-     def apply_filter(self,data, picks=None):
-       """apply filter """
+     def apply_filter(self,data, picks=None, n_jobs=None):
+       """apply filter
+          2D data: blocks of channels in a 2D data plane (multichannel),
+          channel by channel if multichannel is False or not supported by the filter method
+
+          n_jobs: number of worker threads for the multichannel filter, None => obj.n_jobs
+       """
        
        self.data = data 
-
-      # from joblib import Parallel, delayed
+       if n_jobs is None :
+          n_jobs = self.n_jobs
 
        if self.verbose :
            t0 = time.time()
@@ -586,10 +1015,15 @@ class JuMEG_Filter_Base(object):
        if data.ndim > 1 :
            if picks is None :
               picks = np.arange( self.data.shape[0] )
-           for ichan in picks:
-               self.do_apply_filter( self.data[ichan,:] )
-               if self.verbose :
-                  print"===> ch %d" %(ichan)
+           picks = np.asarray(picks,dtype=np.int64)
+
+           if self.multichannel and ( self.filter_kernel_data_half_spectrum is not None ) and picks.size > 1 :
+              self.do_apply_filter_multichannel(self.data,picks,n_jobs=n_jobs)
+           else:
+              for ichan in picks:
+                  self.do_apply_filter( self.data[ichan,:] )
+                  if self.verbose :
+                     print"===> ch %d" %(ichan)
 
        else:
             self.do_apply_filter( data )  
@@ -597,6 +1031,194 @@ class JuMEG_Filter_Base(object):
        if self.verbose :
             print"===> Done apply filter %d" %( time.time() -t0 )
 
+#---------------------------------------------------------# 
+#--- init_filter_overlap_save    -------------------------#
+#---------------------------------------------------------# 
+     def init_filter_overlap_save(self,block_size=None,data_length=None):
+         """
+            setting up the filter kernel for overlap-save filtering in blocks
+
+            the zero-phase impulse response of the filter (irfft of the half-spectrum
+            kernel, shifted by the data_out offset of the data plane) is truncated to
+            +/- overlap samples, the tail beyond keeps less than overlap_save_tolerance
+            of the absolute sum of the impulse response;
+            fft length: block_size + 2*overlap padded to a power of 2
+
+            the filter kernel is calculated as for single-shot filtering of data_length samples:
+            the frequency grid of the bw kernel depends on the padded data length,
+            data_length of the recording => same kernel as apply_filter
+
+            input: block_size  => min number of output samples per block, None => obj.overlap_save_block_size
+                   data_length => number of samples of the recording, None => max(block_size,overlap_save_kernel_length)
+            return dict => obj.overlap_save: kernel,overlap,fft_length,block_size
+         """
+         if block_size is None :
+            block_size = self.overlap_save_block_size
+         block_size = int(block_size)
+         if data_length is None :
+            data_length = max(block_size,self.overlap_save_kernel_length)
+
+       #--- filter kernel and data plane geometry for data_length samples, kernel from/to jumeg_filter_kernel_cache
+         self.data_length = data_length
+         self.init_filter()
+         if self.filter_kernel_data_half_spectrum is None :
+            raise ValueError("filter method %s does not support overlap-save filtering" % (self.filter_method))
+
+         idx   = self.data_plane_index
+         shift = idx['data_out'].start - idx['data_in'].start
+         h     = np.roll( np.fft.irfft( self.filter_kernel_data_half_spectrum,idx['length'] ),-shift )
+
+       #--- overlap: smallest lag keeping the tail below tolerance, lag k => h[k] and h[-k]
+         nhalf = idx['length'] // 2
+         habs  = np.abs(h[:nhalf]) 
+         habs[1:] += np.abs(h[:-nhalf:-1])
+         tail  = np.cumsum( habs[::-1] )[::-1]
+         over  = np.flatnonzero( tail > self.overlap_save_tolerance * tail[0] )
+         over  = int( over[-1] ) if over.size else 0
+
+         nfft  = self.calc_zero_padding( block_size + 2 * over )
+         hos   = np.zeros(nfft,np.float64)
+         hos[:over+1] = h[:over+1]
+         if over :
+            hos[-over:] = h[-over:]
+
+         self.overlap_save = { 'kernel'    : np.fft.rfft(hos),
+                               'overlap'   : over,
+                               'fft_length': nfft,
+                               'block_size': nfft - 2 * over }
+         return self.overlap_save
+
+#---------------------------------------------------------# 
+#--- iter_filter_overlap_save    -------------------------#
+#---------------------------------------------------------# 
+     def iter_filter_overlap_save(self,chunks,data_mean=None,data_length=None):
+         """
+            generator: overlap-save filtering of a stream of data chunks with bounded memory
+
+            same mirror padding at the begin and end of the stream as do_apply_filter,
+            the output matches the single-shot filter (apply_filter) within the
+            truncation of the impulse response (overlap_save_tolerance),
+            if the data length of the recording is given
+
+            DC offset: data_mean is substracted before filtering, restored if remove_dcoffset is False;
+                       None => mean of the first chunk, for lp/notch filters with remove_dcoffset the
+                       output then keeps the difference to the mean of the whole recording
+
+            input: chunks    => iterable of 2D arrays [channels,timeslices], any number of timeslices
+                   data_mean => mean of each channel over the whole recording or None
+                   data_length => number of samples of the recording if known => kernel as apply_filter
+            yield: filtered 2D arrays [channels,timeslices] in consecutive blocks of
+                   overlap_save['block_size'] timeslices (last block shorter)
+         """
+         if data_length or not self.overlap_save :
+            self.init_filter_overlap_save(data_length=data_length)
+         over  = self.overlap_save['overlap']
+         nfft  = self.overlap_save['fft_length']
+         nblk  = self.overlap_save['block_size']
+         kern  = self.overlap_save['kernel']
+
+         def filter_segment(seg,nout):
+             if seg.shape[-1] < nfft :
+                seg = np.concatenate( (seg,np.zeros( (seg.shape[0],nfft - seg.shape[-1]),seg.dtype ) ),axis=-1 )
+             y = np.fft.irfft( np.fft.rfft(seg,axis=-1) * kern,nfft,axis=-1 )[:,over:over+nout]
+             if ( self.remove_dcoffset == False ):
+                y += dmean[:,np.newaxis]
+             return y
+
+         dmean = None
+         if data_mean is not None :
+            dmean = np.asarray(data_mean,dtype=np.float64).reshape(-1)
+         buf   = None   # input from sample pos - overlap on
+         tail  = None   # last overlap+1 input samples for mirroring at the end
+         start = True
+         for chunk in chunks:
+             chunk = np.atleast_2d(chunk)
+             if not chunk.shape[-1] :
+                continue
+             if dmean is None :
+                dmean = np.mean(chunk,axis=-1,dtype=np.float64)
+             x = chunk.astype(self.dtype)
+             x -= dmean[:,np.newaxis]
+
+             buf  = x if buf is None else np.concatenate( (buf,x),axis=-1 )
+             tail = buf[:,-(over+1):].copy() if buf.shape[-1] > over else buf.copy()
+             if start :
+             #--- mirror data at the begin, needs overlap+1 samples
+                if buf.shape[-1] <= over :
+                   continue
+                buf   = np.concatenate( (buf[:,over:0:-1],buf),axis=-1 )
+                start = False
+
+             while buf.shape[-1] >= nfft :
+                   yield filter_segment(buf[:,:nfft],nblk)
+                   buf = buf[:,nblk:]
+
+         if buf is None :
+            return
+
+       #--- mirror data at the end; short stream: mirror at begin and end
+         if start :
+            buf = np.pad(buf,((0,0),(over,over)),mode='reflect')
+         else :
+            buf = np.concatenate( (buf,tail[:,-2::-1][:,:over]),axis=-1 )
+
+         while buf.shape[-1] > 2 * over :
+               nout = min(nblk,buf.shape[-1] - 2 * over)
+               yield filter_segment(buf[:,:nout + 2 * over],nout)
+               buf = buf[:,nout:]
+
+#---------------------------------------------------------# 
+#--- apply_filter_overlap_save   -------------------------#
+#---------------------------------------------------------# 
+     def apply_filter_overlap_save(self,data,picks=None,out=None,block_size=None):
+         """
+            overlap-save filtering of a 2D array in blocks of timeslices with bounded memory
+            e.g. a memory-mapped recording (np.memmap, raw preloaded into a memmap file)
+
+            the DC offset of each channel is calculated in a first pass over the blocks,
+            the filtered data are written inplace or into out block by block;
+            memory: blocks of all picks + filter kernel for the recording length (one channel)
+
+            input: data       => 2D array [channels,timeslices]
+                   picks      => channel index, None => all channels
+                   out        => 2D array for the filtered data [len(picks),timeslices], None => inplace in data
+                   block_size => min number of timeslices per block, None => obj.overlap_save_block_size
+            return: out or data
+         """
+         if picks is None :
+            picks = np.arange( data.shape[0] )
+         picks = np.asarray(picks,dtype=np.int64)
+
+         n    = data.shape[-1]
+         self.init_filter_overlap_save(block_size,data_length=n)
+         nblk = self.overlap_save['block_size']
+
+         if self.verbose :
+            t0 = time.time()
+            print"===> Start apply filter overlap-save: block size %d overlap %d" % (nblk,self.overlap_save['overlap'])
+
+       #--- DC offset
+         dsum = np.zeros(picks.size,np.float64)
+         for i0 in range(0,n,nblk):
+             dsum += np.sum( data[picks,i0:i0+nblk],axis=-1,dtype=np.float64 )
+         dmean = dsum / n
+
+         chunks = ( data[picks,i0:i0+nblk] for i0 in range(0,n,nblk) )
+         i0 = 0
+         for y in self.iter_filter_overlap_save(chunks,data_mean=dmean):
+             if out is None :
+                data[picks,i0:i0+y.shape[-1]] = y
+             else :
+                out[:,i0:i0+y.shape[-1]] = y
+             i0 += y.shape[-1]
+
+         if self.verbose :
+            print"===> Done apply filter overlap-save %d" %( time.time() -t0 )
+
+         if out is None :
+            return data
+         return out
+
 #---------------------------------------------------------# 
 #--- reset                       -------------------------#
 #---------------------------------------------------------# 
@@ -611,10 +1233,13 @@ class JuMEG_Filter_Base(object):
          self.__data_plane_post              = None
          self.__data_plane_cplx              = None
          self.__data                         = None
+         self.__data_length                  = None
          
          self.__filter_kernel_data_cplx      = None
          self.__filter_kernel_data_cplx_sqrt = None
          self.__filter_kernel_data           = None
+         self.__filter_kernel_data_half_spectrum = None
+         self.__data_plane_index             = None
          return 1
         
 #---------------------------------------------------------# 
@@ -631,6 +1256,7 @@ class JuMEG_Filter_Base(object):
          self.__data_plane_post              = None
          self.__data_plane_cplx              = None
          self.__data                         = None
+         self.__data_length                  = None
          
          self.__filter_kernel_data_cplx      = None
          self.__filter_kernel_data_cplx_sqrt = None
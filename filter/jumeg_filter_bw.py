@@ -1,5 +1,4 @@
 import numpy as np
-import scipy.fftpack as scipack # import fft,ifft
 
 '''
 ----------------------------------------------------------------------
@@ -13,6 +12,11 @@ import scipy.fftpack as scipack # import fft,ifft
   --> change float index to np.int64
    -> VisibleDeprecationWarning: using a non-integer number instead of an integer will result in an error in the future
 
+ update: half-spectrum filter kernel for the batched multichannel filter in JuMEG_Filter_Base
+ update: filter kernels from/to jumeg_filter_kernel_cache
+ update: real-valued data plane, real-input fft (rfft/irfft) with half-spectrum filter kernel
+ update: notch comb of all notches in one pass over the frequency axis
+
  version    : 0.03142
 ---------------------------------------------------------------------- 
  Butterworth filter design from  KD,JD
@@ -20,12 +24,12 @@ import scipy.fftpack as scipack # import fft,ifft
 ----------------------------------------------------------------------
 
 '''
-from jumeg.filter.jumeg_filter_base import JuMEG_Filter_Base
+from jumeg.filter.jumeg_filter_base import JuMEG_Filter_Base,jumeg_filter_kernel_cache
 
 class JuMEG_Filter_Bw(JuMEG_Filter_Base):
      
      def __init__ (self,filter_type='bp',fcut1=1.0,fcut2=200.0,remove_dcoffset=True,sampling_frequency=1017.25,
-                        notch=np.array([]),notch_width=2.0,order=4.0,settling_time_factor=5.0):
+                        notch=np.array([]),notch_width=2.0,order=4.0,settling_time_factor=5.0,n_jobs=1):
          super(JuMEG_Filter_Bw, self).__init__()
          self._jumeg_filter_bw_version     = 0.03142
          self.__filter_method              = 'bw'
@@ -44,6 +48,7 @@ class JuMEG_Filter_Bw(JuMEG_Filter_Base):
          self.__settling_time_factor_timeslices = 10000
         
          self.remove_dcoffset                 = remove_dcoffset
+         self.n_jobs                          = n_jobs
 
 #--- filter method bw,ws,mne
      def __get_filter_method(self):
@@ -86,6 +91,37 @@ class JuMEG_Filter_Bw(JuMEG_Filter_Base):
 
      settling_time_factor_timeslices = property(__get_settling_time_factor_timeslices)
     
+#---------------------------------------------------------# 
+#---  calc_data_plane_length     -------------------------#
+#---------------------------------------------------------#         
+     def calc_data_plane_length(self,M):
+         """
+            return padded length of data plane and filter function
+
+            input: M => data length
+         """
+         pad = np.ceil( self.sampling_frequency / 2.0 / self.fcut1 )
+         return self.calc_zero_padding( M + pad  + 2 * self.settling_time_factor_timeslices)
+
+#---------------------------------------------------------# 
+#---  calc_filter_kernel_cache_key  ----------------------#
+#---------------------------------------------------------#         
+     def calc_filter_kernel_cache_key(self):
+         """
+            return key for jumeg_filter_kernel_cache
+            filter method,type,cutoffs,order,notches,notch width,sampling frequency,padded length,precision
+            set fcut1,fcut2 as calc_filter_kernel does: fcut1 None => fcut2; bp => fcut1 < fcut2
+         """
+         if self.fcut1 is None :
+             self.fcut1 = self.fcut2
+             print "WARNING JuMEG_Filter_Bw.calc_filter_kernel value for fcut1 is not defined using fcut2 => %f" %(self.fcut2)
+         if ( self.filter_type == 'bp' ) and ( self.fcut1 > self.fcut2 ):
+             self.fcut1,self.fcut2 = self.fcut2,self.fcut1
+
+         return ( self.filter_method,self.filter_type,self.fcut1,self.fcut2,self.filter_order,
+                  tuple( np.asarray(self.filter_notch).ravel() ),self.filter_notch_width,
+                  self.sampling_frequency,self.calc_data_plane_length( self.data_length ),self.precision )
+
 #---------------------------------------------------------# 
 #---  calc_filter_kernel         -------------------------#
 #---------------------------------------------------------#         
@@ -109,8 +145,7 @@ class JuMEG_Filter_Bw(JuMEG_Filter_Base):
          fcut2 = self.fcut2
          order = self.filter_order
 #----------         
-         pad = np.ceil( self.sampling_frequency / 2.0 / self.fcut1 )
-         len = self.calc_zero_padding( M + pad  + 2 * self.settling_time_factor_timeslices)
+         len = self.calc_data_plane_length( M )
 #-----------      
          nyq    = len / 2.0 + 1.0
          f_n    = self.sampling_frequency / 2.0
@@ -148,23 +183,8 @@ class JuMEG_Filter_Bw(JuMEG_Filter_Base):
 
 #--- add notches
          if self.filter_notch.size :
-            n_fac = np.sqrt( np.log(2.0) )
-            for idx in range( self.filter_notch.shape[0] ):     
-            
-                 omega = self.filter_notch[idx]
-                 
-                 # print "NOTCH %d  %f" %(idx,omega) 
-                 
-                 sigma = n_fac * self.filter_notch_width / 2.0
-                 freq  = np.arange(nyq,dtype=np.float64) * f_res - omega 
-                 min_idx  = np.int64( np.argmin( np.abs( freq ) ) )
-                 self.filter_kernel_data[min_idx] = 0.0
-                 if ( min_idx > 1 ):
-                      self.filter_kernel_data[1:min_idx] *= np.exp( - ( sigma / freq[1:min_idx] )**2 )
-                 else : 
-                      self.filter_kernel_data[1] *= np.exp( - ( sigma / freq[1] )**2 )
-                 
-                 self.filter_kernel_data[min_idx+1:nyq_idx] = self.filter_kernel_data[min_idx+1:nyq_idx] * np.exp( - ( sigma/freq[min_idx+1:] )**2.0 )
+            fkd_part1 *= self.calc_filter_kernel_notch_comb(f_res,nyq_idx)
+            self.filter_kernel_data[ self.calc_filter_kernel_notch_index(f_res,nyq_idx) ] = 0.0
    
 #--- construct the negative frequencies in filter kernel data
          self.filter_kernel_data[nyq_idx :] = fkd_part1[-1:0:-1]
@@ -178,6 +198,58 @@ class JuMEG_Filter_Bw(JuMEG_Filter_Base):
         
          return self.filter_kernel_data
 
+#---------------------------------------------------------# 
+#---  calc_filter_kernel_notch_index ---------------------#
+#---------------------------------------------------------# 
+     def calc_filter_kernel_notch_index(self,f_res,nyq_idx):
+         """
+            return index of the frequency bin closest to each notch
+            lower bin on ties, like argmin over the frequency axis
+
+            input: f_res => frequency resolution, nyq_idx => number of bins 0..nyquist
+         """
+         freq = np.arange(nyq_idx,dtype=np.float64) * f_res
+         idx  = np.clip( np.atleast_1d( np.floor( self.filter_notch / f_res ) ).astype(np.int64),0,nyq_idx -1 )
+         idx1 = np.minimum( idx + 1,nyq_idx -1 )
+         upper= np.abs( freq[idx1] - self.filter_notch ) < np.abs( freq[idx] - self.filter_notch )
+         idx[upper] = idx1[upper]
+         return idx
+
+#---------------------------------------------------------# 
+#---  calc_filter_kernel_notch_comb ----------------------#
+#---------------------------------------------------------# 
+     def calc_filter_kernel_notch_comb(self,f_res,nyq_idx,block_size=2**13):
+         """
+            return attenuation of all notches for frequency bins 1 .. nyq_idx-1
+              prod_n exp( -( sigma / (f - notch_n) )**2 ) = exp( -sigma**2 * sum_n 1/(f - notch_n)**2 )
+            one pass over the frequency axis in cache-sized blocks of bins, one exp per bin;
+            bins at the notches are set to zero by the caller (calc_filter_kernel_notch_index)
+
+            input: f_res => frequency resolution, nyq_idx => number of bins 0..nyquist
+         """
+         notch = np.asarray(self.filter_notch,dtype=np.float64).ravel()
+         sigma = np.sqrt( np.log(2.0) ) * self.filter_notch_width / 2.0
+         comb  = np.zeros(nyq_idx -1,dtype=np.float64)
+         tmp   = np.empty(block_size,dtype=np.float64)
+
+         with np.errstate(divide='ignore'):
+              for k0 in range(1,nyq_idx,block_size):
+                  freq = np.arange(k0,min(k0 + block_size,nyq_idx),dtype=np.float64) * f_res
+                  c    = comb[k0-1:k0-1 + freq.size]
+                  t    = tmp[:freq.size]
+                  for omega in notch:
+                      np.subtract(freq,omega,out=t)
+                      np.multiply(t,t,out=t)
+                      np.divide(1.0,t,out=t)
+                      c += t
+
+       #--- notch in bin 0: bin 1 is attenuated twice
+         notch0 = notch[ self.calc_filter_kernel_notch_index(f_res,nyq_idx) == 0 ]
+         if notch0.size and nyq_idx > 1 :
+            comb[0] += np.sum( 1.0 / ( f_res - notch0 )**2 )
+
+         return np.exp( - sigma**2 * comb )
+
 #---------------------------------------------------------# 
 #---  calc_filter_kernel_cplx_sqrt  ----------------------#
 #---------------------------------------------------------# 
@@ -185,10 +257,29 @@ class JuMEG_Filter_Bw(JuMEG_Filter_Base):
          """
             return sqrt of complex filter function/kernel!!!
          """ 
-         self.filter_kernel_data_cplx_sqrt = np.sqrt( self.filter_kernel_data.astype( np.complex64 ) )
+         self.filter_kernel_data_cplx_sqrt = np.sqrt( self.filter_kernel_data.astype( self.dtype_cplx ) )
          
          return self.filter_kernel_data_cplx_sqrt
 
+#---------------------------------------------------------# 
+#---  calc_filter_kernel_half_spectrum  ------------------#
+#---------------------------------------------------------# 
+     def calc_filter_kernel_half_spectrum(self):
+         """
+            return filter kernel for real-input fft (rfft) of the data plane
+
+            only the real part of the complex data plane is used:
+            Re( ifft( X * K ) ) = irfft( X * ( K[m] + conj( K[-m] ) ) / 2 ) for real data
+         """
+         k   = self.filter_kernel_data_cplx_sqrt
+         idx = np.arange( k.size // 2 + 1 )
+         khs = 0.5 * ( k[idx] + np.conj( k[ -idx % k.size ] ) )
+         if not np.any( khs.imag ):
+            khs = khs.real.astype( self.dtype )
+         self.filter_kernel_data_half_spectrum = khs
+
+         return self.filter_kernel_data_half_spectrum
+
 #---------------------------------------------------------# 
 #--- init_filter_kernel          -------------------------#
 #---------------------------------------------------------# 
@@ -201,8 +292,24 @@ class JuMEG_Filter_Bw(JuMEG_Filter_Base):
          self.data_plane_isinit    = False     
          self.filter_kernel_isinit = False 
          
+         if self.filter_kernel_cache :
+            key     = self.calc_filter_kernel_cache_key()
+            kernels = jumeg_filter_kernel_cache.get(key)
+            if kernels :
+               self.filter_kernel_data               = kernels['filter_kernel_data']
+               self.filter_kernel_data_cplx_sqrt     = kernels['filter_kernel_data_cplx_sqrt']
+               self.filter_kernel_data_half_spectrum = kernels['filter_kernel_data_half_spectrum']
+               self.filter_kernel_isinit = True
+               return self.filter_kernel_isinit
+
          self.calc_filter_kernel()         
          self.calc_filter_kernel_cplx_sqrt()
+         self.calc_filter_kernel_half_spectrum()
+
+         if self.filter_kernel_cache :
+            jumeg_filter_kernel_cache.put(key,{ 'filter_kernel_data'              : self.filter_kernel_data,
+                                                'filter_kernel_data_cplx_sqrt'    : self.filter_kernel_data_cplx_sqrt,
+                                                'filter_kernel_data_half_spectrum': self.filter_kernel_data_half_spectrum })
          
          self.filter_kernel_isinit = True
       
@@ -225,27 +332,31 @@ class JuMEG_Filter_Bw(JuMEG_Filter_Base):
        #--- init data array for filter
          number_of_input_samples = self.data_length
          data_length             = self.filter_kernel_data.size
-         self.data_plane_cplx    = np.zeros( data_length ,np.complex64 )
+         self.data_plane         = np.zeros( data_length ,self.dtype )
                   
        #--- init part of data array for input data => pointer to part of data_plane        
          data_tsl_start_in        = np.int64( self.settling_time_factor_timeslices )
-         self.data_plane_data_in  = self.data_plane_cplx[data_tsl_start_in:data_tsl_start_in + number_of_input_samples].real    
+         self.data_plane_data_in  = self.data_plane[data_tsl_start_in:data_tsl_start_in + number_of_input_samples]    
      
        #--- init pre part of data array, till data onset 
          idx0 = 0 
          idx1 = data_tsl_start_in
          
          if ( self.data_length < self.settling_time_factor_timeslices ) :
-              idx0 = self.settling_time_factor_timeslices - number_of_input_samples +1
+              idx0 = np.int64( self.settling_time_factor_timeslices - number_of_input_samples +1 )
                        
-         self.data_plane_data_pre = self.data_plane_cplx[idx0:idx1].real    
+         self.data_plane_data_pre = self.data_plane[idx0:idx1]    
+         idx_pre = idx0
          #print "pre idx0: %d idx1: %d  size: %d" %(idx0, idx1, self.data_plane_data_pre.size )
          
        #--- init post part of data array, start at data offset  
          idx0 = data_tsl_start_in + number_of_input_samples
          idx1 = idx0 + self.data_plane_data_pre.size -1
-         self.data_plane_data_post = self.data_plane_cplx[idx0:idx1].real    
+         self.data_plane_data_post = self.data_plane[idx0:idx1]    
          
+       #--- index of the data plane parts for the multichannel filter
+         self.calc_data_plane_index(data_length,idx_pre,data_tsl_start_in,idx0,data_tsl_start_in)
+
          #print "size data %d pre %d post %d" % (number_of_samples, self.data_plane_data_pre.size, self.data_plane_data_post.size)
          
          self.data_plane_isinit = True
@@ -259,8 +370,6 @@ class JuMEG_Filter_Bw(JuMEG_Filter_Base):
            
          dmean = self.calc_remove_dcoffset(data) 
   
-         self.data_plane_cplx.fill(0.0) 
-         
     #--- mirror data at pre and post in data plane array to reduce transient oscillation filter artefact
          self.data_plane_data_pre[:] = data[self.data_plane_data_pre.size :0:-1 ]    
          self.data_plane_data_post[:]= data[data.size -2: data.size -2 - self.data_plane_data_post.size :-1]
@@ -268,11 +377,10 @@ class JuMEG_Filter_Bw(JuMEG_Filter_Base):
     #--- copy data at right place in data plane array       
          self.data_plane_data_in[:] = data
     
-    #--- filter : apply fft to complex data_plane; fft-convolution with filter kernel; ifft to transform back into time domain     
-         self.data_plane_cplx[:]    = scipack.ifft( scipack.fft( self.data_plane_cplx ) * self.filter_kernel_data_cplx_sqrt )
-         
-    #--- copy filtered real part data back 
-         data[:] = self.data_plane_data_in
+    #--- filter : apply real-fft to data_plane; fft-convolution with half-spectrum filter kernel; irfft to transform back into time domain
+    #    data plane is not overwritten => zero padding stays zero for the next channel
+         idx     = self.data_plane_index
+         data[:] = np.fft.irfft( np.fft.rfft( self.data_plane ) * self.filter_kernel_data_half_spectrum,idx['length'] )[ idx['data_out'] ]
 
     #--- retain dc offset       
          if (self.remove_dcoffset == False ): 
@@ -0,0 +1,242 @@
+import numpy as np
+import scipy.signal as signal
+'''
+----------------------------------------------------------------------
+--- JuMEG Filter_IIR            --------------------------------------
+----------------------------------------------------------------------
+ zero-phase IIR filter: butterworth + notches as second-order sections,
+ applied forward and backward (scipy.signal.sosfiltfilt)
+
+ linear time, memory of the data only => no zero-padded fft data plane
+ the forward-backward filter squares the magnitude response:
+ attenuation of a butterworth filter of twice the order, -6 dB at fcut
+
+ mirror padding (even extension) at begin and end of the data,
+ padding length: settling time factor * time constant of the lowest cutoff
+----------------------------------------------------------------------
+ Butterworth filter design: scipy.signal.butter
+ Notch filter design      : scipy.signal.iirnotch, Q = notch / notch width
+----------------------------------------------------------------------
+
+'''
+from jumeg.filter.jumeg_filter_base import JuMEG_Filter_Base
+
+class JuMEG_Filter_IIR(JuMEG_Filter_Base):
+
+     def __init__ (self,filter_type='bp',fcut1=1.0,fcut2=200.0,remove_dcoffset=True,sampling_frequency=1017.25,
+                        notch=np.array([]),notch_width=1.0,order=4,settling_time_factor=5.0,n_jobs=1):
+         super(JuMEG_Filter_IIR, self).__init__()
+         self.__jumeg_filter_iir_version = 0.0001
+         self.__filter_method            = 'iir'
+
+         self.sampling_frequency         = sampling_frequency
+         self.filter_type                = filter_type #lp, hp, bp, br, notch
+         self.fcut1                      = fcut1
+         self.fcut2                      = fcut2
+         self.filter_notch               = notch
+         self.filter_notch_width         = notch_width
+         self.settling_time_factor       = settling_time_factor
+
+         self.__filter_order             = order
+
+         self.remove_dcoffset            = remove_dcoffset
+         self.n_jobs                     = n_jobs
+
+#--- filter method bw,ws,mne,iir
+     def __get_filter_method(self):
+         return self.__filter_method
+     filter_method = property(__get_filter_method)
+
+#--- version
+     def __get_version(self):
+         return self.__jumeg_filter_iir_version
+
+     version = property(__get_version)
+
+#--- filter_order butterworth order of the design
+     def __set_filter_order(self, value):
+         self.__filter_order = value
+         self.filter_kernel_isinit = False
+
+     def __get_filter_order(self):
+         return self.__filter_order
+
+     filter_order = property(__get_filter_order, __set_filter_order)
+
+#--- settling time factor timeslices => padding length
+     def __get_settling_time_factor_timeslices(self):
+         fmin = self.fcut1
+         if self.filter_notch.size :
+            fmin = min(fmin,self.filter_notch_width)
+         tau = fmin * 2.0 * np.pi
+         return np.int64( np.ceil( ( 1.0 / tau ) * self.settling_time_factor * self.sampling_frequency ) )
+
+     settling_time_factor_timeslices = property(__get_settling_time_factor_timeslices)
+
+#---------------------------------------------------------#
+#---  calc_filter_kernel         -------------------------#
+#---------------------------------------------------------#
+     def calc_filter_kernel(self):
+         """
+            return second-order sections [sections,6] of butterworth filter and notches
+
+            using global/default parameter: filter_type,fcut1,fcut2,order,notches,sampling_frequency
+         """
+         if self.fcut1 is None :
+             self.fcut1 = self.fcut2
+             print "WARNING JuMEG_Filter_IIR.calc_filter_kernel value for fcut1 is not defined using fcut2 => %f" %(self.fcut2)
+
+         if ( self.filter_type in ('bp','br','bs') ) and ( self.fcut1 > self.fcut2 ) :
+             self.fcut1,self.fcut2 = self.fcut2,self.fcut1
+
+         f_n   = self.sampling_frequency / 2.0
+         order = int(self.filter_order)
+         sos   = []
+
+         if   self.filter_type == 'lp' :
+                   sos.append( signal.butter(order,self.fcut1 / f_n,btype='lowpass',output='sos') )
+         elif self.filter_type == 'hp' :
+                   sos.append( signal.butter(order,self.fcut1 / f_n,btype='highpass',output='sos') )
+         elif self.filter_type == 'bp' :
+                   sos.append( signal.butter(order,[self.fcut1 / f_n,self.fcut2 / f_n],btype='bandpass',output='sos') )
+         elif self.filter_type in ('br','bs') :
+                   sos.append( signal.butter(order,[self.fcut1 / f_n,self.fcut2 / f_n],btype='bandstop',output='sos') )
+         # else: flat only notches
+
+#--- add notches
+         for omega in self.filter_notch :
+             if 0.0 < omega < f_n :
+                b,a = signal.iirnotch(omega / f_n,omega / self.filter_notch_width)
+                sos.append( signal.tf2sos(b,a) )
+
+         if sos :
+            self.filter_kernel_data = np.vstack(sos)
+         else :
+            self.filter_kernel_data = np.array([[1.0,0.0,0.0,1.0,0.0,0.0]])
+
+         return self.filter_kernel_data
+
+#---------------------------------------------------------#
+#--- init_filter_kernel          -------------------------#
+#---------------------------------------------------------#
+     def init_filter_kernel(self):
+         """
+            calculating second-order sections of the filter
+         """
+         self.filter_kernel_isinit = False
+         self.calc_filter_kernel()
+         self.filter_kernel_isinit = True
+
+         return self.filter_kernel_isinit
+
+#---------------------------------------------------------#
+#--- init_filter_data_plane      -------------------------#
+#---------------------------------------------------------#
+     def init_filter_data_plane(self):
+         """
+            no data plane for IIR filtering
+         """
+         self.data_plane_isinit  = True
+
+         return self.data_plane_isinit
+
+#---------------------------------------------------------#
+#--- filter_isinit               -------------------------#
+#---------------------------------------------------------#
+     def filter_isinit(self):
+         """check if filter parameter is initialize"""
+         return self.filter_kernel_isinit
+
+#---------------------------------------------------------#
+#--- calc_multichannel_block_size -------------------------#
+#---------------------------------------------------------#
+     def calc_multichannel_block_size(self,number_of_channels=None,n_jobs=1):
+         """
+            return number of channels filtered at once
+            auto: data + padding + forward/backward copies of all workers within multichannel_memory
+         """
+         if self.multichannel_block_size:
+            return int(self.multichannel_block_size)
+         nbytes = 32 * ( self.data_length + 2 * self.settling_time_factor_timeslices ) * max(1,n_jobs)
+         bsize  = int( max(1, self.multichannel_memory // nbytes) )
+         if number_of_channels and n_jobs > 1:
+            bsize = min(bsize, int( np.ceil( number_of_channels / float(n_jobs) ) ) )
+         return bsize
+
+#---------------------------------------------------------#
+#--- do_apply_filter_block       -------------------------#
+#---------------------------------------------------------#
+     def do_apply_filter_block(self,data,chans):
+         """
+            filter channels chans of data inplace, forward and backward
+            reentrant => safe to run in worker threads
+
+            input: data => 2D array [channels,timeslices], chans => channel index of the block
+         """
+         d = data[chans,:]
+         data[chans,:] = self.do_apply_filter(d)
+
+         if self.verbose :
+            print"===> ch %d - %d" %(chans[0],chans[-1])
+
+         return chans
+
+#---------------------------------------------------------#
+#--- do_apply_filter             -------------------------#
+#---------------------------------------------------------#
+     def do_apply_filter(self,data):
+         """
+            filter data inplace along the last axis, forward and backward with mirror padding
+
+            input: data => 1D or 2D array [channels,timeslices]
+         """
+    #--- data substract dc offset, mean accumulated in float64
+         dmean = np.mean(data, axis = -1, dtype = np.float64)
+         data -= dmean[...,np.newaxis]
+
+         padlen = int( min( data.shape[-1] - 1,self.settling_time_factor_timeslices ) )
+         sos    = self.filter_kernel_data.astype(self.dtype)
+         data[...] = signal.sosfiltfilt(sos,data.astype(self.dtype),axis=-1,padtype='even',padlen=padlen)
+
+    #--- retain dc offset
+         if ( self.remove_dcoffset == False ):
+            data += dmean[...,np.newaxis]
+
+         return data
+
+#---------------------------------------------------------#
+#--- apply_filter                -------------------------#
+#---------------------------------------------------------#
+     def apply_filter(self,data,picks=None,n_jobs=None):
+         """apply filter
+            2D data: blocks of channels, n_jobs worker threads; channel by channel if multichannel is False
+            n_jobs: number of worker threads, None => obj.n_jobs
+         """
+         self.data = data
+         if n_jobs is None :
+            n_jobs = self.n_jobs
+
+         if self.verbose :
+            import time
+            t0 = time.time()
+            print"===> Start apply filter iir"
+
+         if not( self.filter_isinit() ):
+            self.init_filter()
+
+         if data.ndim > 1 :
+            if picks is None :
+               picks = np.arange( self.data.shape[0] )
+            picks = np.asarray(picks,dtype=np.int64)
+            if self.multichannel and picks.size > 1 :
+               self.do_apply_filter_multichannel(self.data,picks,n_jobs=n_jobs)
+            else:
+               for ichan in picks:
+                   self.do_apply_filter( self.data[ichan,:] )
+         else:
+            self.do_apply_filter( data )
+
+         if self.verbose :
+            print"===> Done apply filter iir %d" %( time.time() -t0 )
+
+         return data
@@ -96,8 +96,10 @@ class JuMEG_Filter_MNE(JuMEG_Filter_Base):
 #---------------------------------------------------------# 
 #--- apply_filter MNE           -------------------------#
 #---------------------------------------------------------# 
-     def apply_filter(self,data,picks=None):
-       """apply mne filter """
+     def apply_filter(self,data,picks=None,n_jobs=None):
+       """apply mne filter
+          n_jobs: number of jobs for mne filter functions, None => obj.mne_njobs
+       """
        
        if picks is None:
           picks = np.arange(data.shape[0])
@@ -106,6 +108,8 @@ class JuMEG_Filter_MNE(JuMEG_Filter_Base):
        dmean  = self.calc_remove_dcoffset(data[picks, :])
        Fs     = self.sampling_frequency
        njobs  = self.mne_njobs        
+       if n_jobs :
+          njobs = n_jobs
        fcut1  = self.fcut1
        fcut2  = self.fcut2
        fl     = self.mne_filter_length
@@ -6,6 +6,7 @@ import numpy as np
  autor      : Frank Boers 
  email      : f.boers@fz-juelich.de
  last update: 11.12.2014
+ update: filter kernels from/to jumeg_filter_kernel_cache
  version    : 0.03141
 ---------------------------------------------------------------------- 
  Taken from:
@@ -19,11 +20,11 @@ import numpy as np
 ----------------------------------------------------------------------
 
 '''
-from jumeg.filter.jumeg_filter_base import JuMEG_Filter_Base
+from jumeg.filter.jumeg_filter_base import JuMEG_Filter_Base,jumeg_filter_kernel_cache
 
 class JuMEG_Filter_Ws(JuMEG_Filter_Base):
      def __init__ (self,filter_type='bp',fcut1=1.0,fcut2=200.0,remove_dcoffset=True,sampling_frequency=1017.25,filter_window='blackmann',
-                   kernel_length_factor=16.0,settling_time_factor=5.0): #, notch=np.array([]),notch_width=1.0):
+                   kernel_length_factor=16.0,settling_time_factor=5.0,n_jobs=1): #, notch=np.array([]),notch_width=1.0):
          super(JuMEG_Filter_Ws, self).__init__()
          
          self.__jumeg_filter_ws_version   = 0.0314
@@ -40,6 +41,7 @@ class JuMEG_Filter_Ws(JuMEG_Filter_Base):
          self.settling_time_factor        = settling_time_factor
 #--               
          self.remove_dcoffset             = remove_dcoffset
+         self.n_jobs                      = n_jobs
 
 #--- filter method bw,ws,mne
      def __get_filter_method(self):
@@ -121,6 +123,26 @@ class JuMEG_Filter_Ws(JuMEG_Filter_Base):
             d[int(M/2)] = 2.0 * np.pi *fc
          return d/d.sum()
          
+#---------------------------------------------------------# 
+#---  calc_filter_kernel_cache_key  ----------------------#
+#---------------------------------------------------------#         
+     def calc_filter_kernel_cache_key(self):
+         """
+            return key for jumeg_filter_kernel_cache
+            filter method,type,cutoffs,window,kaiser beta,kernel length,attenuation,sampling frequency,padded length
+            set fcut1,fcut2 as calc_filter_kernel does: fcut1 None => fcut2; bp,notch => fcut1 < fcut2
+         """
+         if self.fcut1 is None:
+             self.fcut1 = self.fcut2
+             print "WARNING JuMEG_Filter_WS.calc_filter_kernel value for fcut1 is not defined using fcut2 => %f" %(self.fcut2)
+         if ( self.filter_type in ('bp','notch') ) and ( self.fcut1 > self.fcut2 ):
+             self.fcut1,self.fcut2 = self.fcut2,self.fcut1
+
+         M = int( self.filter_kernel_length )
+         return ( self.filter_method,self.filter_type,self.fcut1,self.fcut2,self.filter_window,self.kaiser_beta,
+                  M,self.filter_attenuation_factor,float(self.sampling_frequency),
+                  self.calc_zero_padding( self.data_length + (M + 1) * self.settling_time_factor * 2 + 1 ) )
+
 #---------------------------------------------------------# 
 #---  calc_filter_kernel         -------------------------#
 #---------------------------------------------------------# 
@@ -214,6 +236,18 @@ class JuMEG_Filter_Ws(JuMEG_Filter_Base):
          return self.filter_kernel_data_rfft
  
          
+#---------------------------------------------------------# 
+#---  calc_filter_kernel_half_spectrum  ------------------#
+#---------------------------------------------------------# 
+     def calc_filter_kernel_half_spectrum(self):
+         """
+            return filter kernel for real-input fft (rfft) of the data plane
+            => filter_kernel_data_rfft
+         """
+         self.filter_kernel_data_half_spectrum = self.filter_kernel_data_rfft
+
+         return self.filter_kernel_data_half_spectrum
+
 #---------------------------------------------------------# 
 #--- init_filter_kernel          -------------------------#
 #---------------------------------------------------------# 
@@ -226,8 +260,24 @@ class JuMEG_Filter_Ws(JuMEG_Filter_Base):
          self.data_plane_isinit    = False
          self.filter_kernel_isinit = False
          
+         if self.filter_kernel_cache :
+            key     = self.calc_filter_kernel_cache_key()
+            kernels = jumeg_filter_kernel_cache.get(key)
+            if kernels :
+               self.filter_kernel_data        = kernels['filter_kernel_data']
+               self.__filter_kernel_data_rfft = kernels['filter_kernel_data_rfft']
+               self.calc_filter_data_length( self.data_length )
+               self.calc_filter_kernel_half_spectrum()
+               self.filter_kernel_isinit = True
+               return self.filter_kernel_isinit
+
          self.calc_filter_kernel()
          self.calc_filter_kernel_rfft()
+         self.calc_filter_kernel_half_spectrum()
+
+         if self.filter_kernel_cache :
+            jumeg_filter_kernel_cache.put(key,{ 'filter_kernel_data'     : self.filter_kernel_data,
+                                                'filter_kernel_data_rfft': self.filter_kernel_data_rfft })
          
          self.filter_kernel_isinit = True
          
@@ -248,7 +298,7 @@ class JuMEG_Filter_Ws(JuMEG_Filter_Base):
        #--- init data array for filter
          number_of_input_samples = self.data_length
          data_length             = self.calc_filter_data_length( number_of_input_samples )
-         self.data_plane         = np.zeros( data_length,np.float64 )
+         self.data_plane         = np.zeros( data_length,self.dtype )
          
        #--- init part of data array for input data => pointer to part of data_plane        
          data_tsl_start_in       = int( self.filter_kernel_data.size * self.settling_time_factor ) 
@@ -268,12 +318,16 @@ class JuMEG_Filter_Ws(JuMEG_Filter_Base):
          if ( number_of_input_samples < data_tsl_start_in ) :
              idx0 = idx1 - number_of_input_samples + 2 # !!! for post range 
          self.data_plane_data_pre = self.data_plane[idx0:idx1]    
+         idx_pre = idx0
         
        #--- init post part of data array, start at offset  
          idx0 = data_tsl_start_in + number_of_input_samples
          idx1 = idx0 + self.data_plane_data_pre.size
          self.data_plane_data_post = self.data_plane[idx0:idx1]    
       
+       #--- index of the data plane parts for the multichannel filter
+         self.calc_data_plane_index(data_length,idx_pre,data_tsl_start_in,idx0,data_tsl_start_out)
+
          self.data_plane_isinit = True
                   
          #return self.filter_data_plane_isinit
@@ -295,10 +349,10 @@ class JuMEG_Filter_Ws(JuMEG_Filter_Base):
          self.data_plane_data_in[:] = data
     
     #--- filter : apply real-fft to data_plane; fft-convolution with filter kernel; irfft to transform back into time domain
-         self.data_plane[:] = np.fft.irfft( np.fft.rfft( self.data_plane ) * self.filter_kernel_data_rfft )
-                     
+    #    data plane is not overwritten => zero padding stays zero for the next channel
     #--- copy filtered data back at right place in data array !!! M-1 kernel shift !!!
-         data[:] = self.data_plane_data_out
+         idx     = self.data_plane_index
+         data[:] = np.fft.irfft( np.fft.rfft( self.data_plane ) * self.filter_kernel_data_rfft,idx['length'] )[ idx['data_out'] ]
 
     #--- retain dc offset       
          if ( self.remove_dcoffset == False) : 
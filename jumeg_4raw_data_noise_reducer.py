@@ -64,6 +64,8 @@ from mne.epochs import _is_good
 from mne.io.pick import channel_indices_by_type
 from .jumeg_utils import get_files_from_list
 from .jumeg_base import jumeg_base
+from .jumeg_noise_reducer import (JuMEG_NoiseReducer_Engine, _detrend_channels,
+                                  channel_indices_from_list)
 
 TINY = 1.e-38
 SVD_RELCUTOFF = 1.e-08
@@ -252,72 +254,18 @@ def plot_denoising_4raw_data(fname_raw, fmin=0, fmax=300, tmin=0.0, tmax=60.0,
 ##################################################
 def perform_detrending(fname_raw,raw=None,save=True):
 
-    from mne.io import Raw
-    from numpy import poly1d, polyfit
-
-    raw = jumeg_base.get_raw_obj(fname_raw,raw=raw)
-  # get channels
-    picks = jumeg_base.pick_meg_and_ref_nobads()
-
-    xval  = np.arange(raw._data.shape[1])
-  # loop over all channels
-    for ipick in picks:
-        coeff = polyfit(xval, raw._data[ipick, :], deg=1)
-        trend = poly1d(coeff)
-        raw._data[ipick, :] -= trend(xval)
+    raw,fname_raw = jumeg_base.get_raw_obj(fname_raw,raw=raw)
+  # subtract linear trend from meg and ref channels
+    _detrend_channels(raw)
 
     # save detrended data
     if save:
        fname_out = jumeg_base.get_fif_name(raw=raw,postfix='dt')
-       jume_base.apply_save_mne_data(raw,fname=fname_out,overwrite=True)
+       jumeg_base.apply_save_mne_data(raw,fname=fname_out,overwrite=True)
 
     return raw
 
 
-##################################################
-#
-# Get indices of matching channel names from list
-#
-##################################################
-def channel_indices_from_list(fulllist, findlist, excllist=None):
-    """Get indices of matching channel names from list
-
-    Parameters
-    ----------
-    fulllist: list of channel names
-    findlist: list of (regexp) names to find
-              regexp are resolved using mne.pick_channels_regexp()
-    excllist: list of channel names to exclude,
-              e.g., raw.info.get('bads')
-
-    Returns
-    -------
-    chnpick: array with indices
-    """
-    chnpick = []
-    for ir in xrange(len(findlist)):
-        if findlist[ir].translate(None, ' ').isalnum():
-            try:
-                chnpicktmp = ([fulllist.index(findlist[ir])])
-                chnpick = np.array(np.concatenate((chnpick, chnpicktmp)), dtype=int)
-            except:
-                print ">>>>> Channel '%s' not found." % findlist[ir]
-        else:
-            chnpicktmp = (mne.pick_channels_regexp(fulllist, findlist[ir]))
-            if len(chnpicktmp) == 0:
-                print ">>>>> '%s' does not match any channel name." % findlist[ir]
-            else:
-                chnpick = np.array(np.concatenate((chnpick, chnpicktmp)), dtype=int)
-    if len(chnpick) > 1:
-        # Remove duplicates:
-        chnpick = np.sort(np.array(list(set(np.sort(chnpick)))))
-
-    if excllist is not None and len(excllist) > 0:
-        exclinds = [fulllist.index(excllist[ie]) for ie in xrange(len(excllist))]
-        chnpick = list(np.setdiff1d(chnpick, exclinds))
-    return chnpick
-
-
 ##################################################
 #
 # Apply noise reduction to signal channels
@@ -430,7 +378,7 @@ def noise_reducer_4raw_data(fname_raw,raw=None,signals=[],noiseref=[],detrending
               (raw.index_as_time(itmin)[0], raw.index_as_time(itmax)[0])
 
     if signals is None or len(signals) == 0:
-        sigpick = jumeg_base.pick_meg_nobads(raw)
+        sigpick = jumeg_base.picks.meg_nobads(raw)
     else:
         sigpick = channel_indices_from_list(raw.info['ch_names'][:], signals,
                                             raw.info.get('bads'))
@@ -445,7 +393,7 @@ def noise_reducer_4raw_data(fname_raw,raw=None,signals=[],noiseref=[],detrending
             print ">>> Using all refchans."
 
         refexclude = "bads"
-        refpick = jumeg_base.pick_ref_nobads(raw)
+        refpick = jumeg_base.picks.ref_nobads(raw)
     else:
         refpick = channel_indices_from_list(raw.info['ch_names'][:], noiseref,
                                             raw.info.get('bads'))
@@ -456,258 +404,30 @@ def noise_reducer_4raw_data(fname_raw,raw=None,signals=[],noiseref=[],detrending
     if verbose:
         print ">>> sigpick: %3d chans, refpick: %3d chans" % (nsig, nref)
 
-    if reflp is None and refhp is None and refnotch is None:
-        use_reffilter = False
-        use_refantinotch = False
-    else:
-        use_reffilter = True
-        if verbose:
-            print "########## Filter reference channels:"
-
-        use_refantinotch = False
-        if refnotch is not None:
-            if reflp is None and reflp is None:
-                use_refantinotch = True
-                freqlast = np.min([5.01 * refnotch, 0.5 * raw.info['sfreq']])
-                if verbose:
-                    print ">>> notches at freq %.1f and harmonics below %.1f" % (refnotch, freqlast)
-            else:
-                raise ValueError("Cannot specify notch- and high-/low-pass"
-                                 "reference filter together")
-        else:
-            if verbose:
-                if reflp is not None:
-                    print ">>>  low-pass with cutoff-freq %.1f" % reflp
-                if refhp is not None:
-                    print ">>> high-pass with cutoff-freq %.1f" % refhp
-
-        # Adapt followg drop-chans cmd to use 'all-but-refpick'
-        droplist = [raw.info['ch_names'][k] for k in xrange(raw.info['nchan']) if not k in refpick]
-        tct = time.clock()
-        twt = time.time()
-        fltref = raw.drop_channels(droplist, copy=True)
-        if use_refantinotch:
-            rawref = raw.drop_channels(droplist, copy=True)
+    # This variant notches the base frequency refnotch and its harmonics
+    # below 5.01*refnotch and filters the reference channels with IIR filters.
+    if refnotch is not None:
+        if reflp is None and refhp is None:
             freqlast = np.min([5.01 * refnotch, 0.5 * raw.info['sfreq']])
-            fltref.notch_filter(np.arange(refnotch, freqlast, refnotch),
-                                picks=np.array(xrange(nref)), method='iir')
-            fltref._data = (rawref._data - fltref._data)
-        else:
-            fltref.filter(refhp, reflp, picks=np.array(xrange(nref)), method='iir')
-        tc1 = time.clock()
-        tw1 = time.time()
-        if verbose:
-            print ">>> filtering ref-chans  took %.1f ms (%.2f s walltime)" % (1000. * (tc1 - tct), (tw1 - twt))
-
-    if verbose:
-        print "########## Calculating sig-ref/ref-ref-channel covariances:"
-    # Calculate sig-ref/ref-ref-channel covariance:
-    # (there is no need to calc inter-signal-chan cov,
-    #  but there seems to be no appropriat fct available)
-    # Here we copy the idea from compute_raw_data_covariance()
-    # and truncate it as appropriate.
-    tct = time.clock()
-    twt = time.time()
-    # The following reject and infosig entries are only
-    # used in _is_good-calls.
-    # _is_good() from mne-0.9.git-py2.7.egg/mne/epochs.py seems to
-    # ignore ref-channels (not covered by dict) and checks individual
-    # data segments - artifacts across a buffer boundary are not found.
-
-    #--- !!! FB put to kwargs
-
-    #reject = dict(grad=4000e-13, # T / m (gradiometers)
-    #              mag=4e-12,     # T (magnetometers)
-    #              eeg=40e-6,     # uV (EEG channels)
-    #              eog=250e-6)    # uV (EOG channels)
-
-    infosig = copy.copy(raw.info)
-    infosig['chs'] = [raw.info['chs'][k] for k in sigpick]
-    infosig['ch_names'] = [raw.info['ch_names'][k] for k in sigpick]
-    infosig['nchan'] = len(sigpick)
-    idx_by_typesig = channel_indices_by_type(infosig)
-
-    # Read data in chunks:
-    tstep = 0.2
-    itstep = int(ceil(tstep * raw.info['sfreq']))
-    sigmean = 0
-    refmean = 0
-    sscovdata = 0
-    srcovdata = 0
-    rrcovdata = 0
-    n_samples = 0
-
-    for first in range(itmin, itmax, itstep):
-        last = first + itstep
-        if last >= itmax:
-            last = itmax
-        raw_segmentsig, times = raw[sigpick, first:last]
-        if use_reffilter:
-            raw_segmentref, times = fltref[:, first:last]
-        else:
-            raw_segmentref, times = raw[refpick, first:last]
-
-        if not exclude_artifacts or \
-           _is_good(raw_segmentsig, infosig['ch_names'], idx_by_typesig, reject, flat=None,
-                    ignore_chs=raw.info['bads']):
-            sigmean += raw_segmentsig.sum(axis=1)
-            refmean += raw_segmentref.sum(axis=1)
-            sscovdata += (raw_segmentsig * raw_segmentsig).sum(axis=1)
-            srcovdata += np.dot(raw_segmentsig, raw_segmentref.T)
-            rrcovdata += np.dot(raw_segmentref, raw_segmentref.T)
-            n_samples += raw_segmentsig.shape[1]
-        else:
-            logger.info("Artefact detected in [%d, %d]" % (first, last))
-    if n_samples <= 1:
-        raise ValueError('Too few samples to calculate weights')
-    sigmean /= n_samples
-    refmean /= n_samples
-    sscovdata -= n_samples * sigmean[:] * sigmean[:]
-    sscovdata /= (n_samples - 1)
-    srcovdata -= n_samples * sigmean[:, None] * refmean[None, :]
-    srcovdata /= (n_samples - 1)
-    rrcovdata -= n_samples * refmean[:, None] * refmean[None, :]
-    rrcovdata /= (n_samples - 1)
-    sscovinit = np.copy(sscovdata)
-    if verbose:
-        print ">>> Normalize srcov..."
-
-    rrslope = copy.copy(rrcovdata)
-    for iref in xrange(nref):
-        dtmp = rrcovdata[iref, iref]
-        if dtmp > TINY:
-            srcovdata[:, iref] /= dtmp
-            rrslope[:, iref] /= dtmp
-        else:
-            srcovdata[:, iref] = 0.
-            rrslope[:, iref] = 0.
-
-    if verbose:
-        print ">>> Number of samples used : %d" % n_samples
-        tc1 = time.clock()
-        tw1 = time.time()
-        print ">>> sigrefchn covar-calc took %.1f ms (%.2f s walltime)" % (1000. * (tc1 - tct), (tw1 - twt))
-
-    if checkresults:
-        if verbose:
-            print "########## Calculated initial signal channel covariance:"
-            # Calculate initial signal channel covariance:
-            # (only used as quality measure)
-            print ">>> initl rt(avg sig pwr) = %12.5e" % np.sqrt(np.mean(sscovdata))
-            for i in xrange(5):
-                print ">>> initl signal-rms[%3d] = %12.5e" % (i, np.sqrt(sscovdata.flatten()[i]))
-            print ">>>"
-
-    U, s, V = np.linalg.svd(rrslope, full_matrices=True)
-    if verbose:
-        print ">>> singular values:"
-        print s
-        print ">>> Applying cutoff for smallest SVs:"
-
-    dtmp = s.max() * SVD_RELCUTOFF
-    s *= (abs(s) >= dtmp)
-    sinv = [1. / s[k] if s[k] != 0. else 0. for k in xrange(nref)]
-    if verbose:
-        print ">>> singular values (after cutoff):"
-        print s
-
-    stat = np.allclose(rrslope, np.dot(U, np.dot(np.diag(s), V)))
-    if verbose:
-        print ">>> Testing svd-result: %s" % stat
-        if not stat:
-            print "    (Maybe due to SV-cutoff?)"
-
-    # Solve for inverse coefficients:
-    # Set RRinv.tr=U diag(sinv) V
-    RRinv = np.transpose(np.dot(U, np.dot(np.diag(sinv), V)))
-    if checkresults:
-        stat = np.allclose(np.identity(nref), np.dot(RRinv, rrslope))
-        if stat:
             if verbose:
-                print ">>> Testing RRinv-result (should be unit-matrix): ok"
-        else:
-            print ">>> Testing RRinv-result (should be unit-matrix): failed"
-            print np.transpose(np.dot(RRinv, rrslope))
-            print ">>>"
-
-    if verbose:
-        print "########## Calc weight matrix..."
-
-    # weights-matrix will be somewhat larger than necessary,
-    # (to simplify indexing in compensation loop):
-    weights = np.zeros((raw._data.shape[0], nref))
-    for isig in xrange(nsig):
-        for iref in xrange(nref):
-            weights[sigpick[isig],iref] = np.dot(srcovdata[isig,:], RRinv[:,iref])
-
-    if verbose:
-        print "########## Compensating signal channels:"
-        if complementary_signal:
-            print ">>> Caveat: REPLACING signal by compensation signal"
-
-    tct = time.clock()
-    twt = time.time()
-
-    # Work on entire data stream:
-    for isl in xrange(raw._data.shape[1]):
-        slice = np.take(raw._data, [isl], axis=1)
-        if use_reffilter:
-            refslice = np.take(fltref._data, [isl], axis=1)
-            refarr = refslice[:].flatten() - refmean
-            # refarr = fltres[:,isl]-refmean
-        else:
-            refarr = slice[refpick].flatten() - refmean
-        subrefarr = np.dot(weights[:], refarr)
-
-        if not complementary_signal:
-            raw._data[:, isl] -= subrefarr
+                print ">>> notches at freq %.1f and harmonics below %.1f" % (refnotch, freqlast)
+            refnotch = list(np.arange(refnotch, freqlast, refnotch))
         else:
-            raw._data[:, isl] = subrefarr
-
-        if (isl % 10000 == 0) and verbose:
-            print "\rProcessed slice %6d" % isl
-
-    if verbose:
-        print "\nDone."
-        tc1 = time.clock()
-        tw1 = time.time()
-        print ">>> compensation loop took %.1f ms (%.2f s walltime)" % (1000. * (tc1 - tct), (tw1 - twt))
-
+            raise ValueError("Cannot specify notch- and high-/low-pass"
+                             "reference filter together")
+
+    engine = JuMEG_NoiseReducer_Engine(reject=reject, refflt_method='iir',
+                                       exclude_artifacts=exclude_artifacts,
+                                       checkresults=checkresults,
+                                       verbose=verbose)
+    refdata = engine.filter_references(raw, refpick, reflp=reflp, refhp=refhp,
+                                       refnotch=refnotch)
+    weights, refmean, sscovinit = engine.calc_weights(raw, sigpick, refpick,
+                                                      itmin, itmax, refdata=refdata)
+    engine.apply_weights(raw, weights, refmean, refpick, refdata=refdata,
+                         complementary_signal=complementary_signal)
     if checkresults:
-        if verbose:
-            print "########## Calculating final signal channel covariance:"
-        # Calculate final signal channel covariance:
-        # (only used as quality measure)
-        tct = time.clock()
-        twt = time.time()
-        sigmean = 0
-        sscovdata = 0
-        n_samples = 0
-        for first in range(itmin, itmax, itstep):
-            last = first + itstep
-            if last >= itmax:
-                last = itmax
-            raw_segmentsig, times = raw[sigpick, first:last]
-            # Artifacts found here will probably differ from pre-noisered artifacts!
-            if not exclude_artifacts or \
-               _is_good(raw_segmentsig, infosig['ch_names'], idx_by_typesig, reject,
-                        flat=None, ignore_chs=raw.info['bads']):
-                sigmean += raw_segmentsig.sum(axis=1)
-                sscovdata += (raw_segmentsig * raw_segmentsig).sum(axis=1)
-                n_samples += raw_segmentsig.shape[1]
-        sigmean /= n_samples
-        sscovdata -= n_samples * sigmean[:] * sigmean[:]
-        sscovdata /= (n_samples - 1)
-
-        if verbose:
-            print ">>> no channel got worse: ", np.all(np.less_equal(sscovdata, sscovinit))
-            print ">>> final rt(avg sig pwr) = %12.5e" % np.sqrt(np.mean(sscovdata))
-            for i in xrange(5):
-                print ">>> final signal-rms[%3d] = %12.5e" % (i, np.sqrt(sscovdata.flatten()[i]))
-            tc1 = time.clock()
-            tw1 = time.time()
-            print ">>> signal covar-calc took %.1f ms (%.2f s walltime)" % (1000. * (tc1 - tct), (tw1 - twt))
-            print ">>>"
+        engine.check_results(raw, sigpick, itmin, itmax, sscovinit)
 
    #--- fb update 21.07.2015
     fname_out = jumeg_base.get_fif_name(raw=raw,postfix=fif_postfix,extention=fif_extention)
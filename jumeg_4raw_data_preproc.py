@@ -182,6 +182,7 @@ def apply_filter_data(fname,raw=None,filter_method="mne",filter_type='bp',fcut1=
     filter_method : mne => fft mne-filter
                     bw  => fft butterwoth
                     ws  => fft - windowed sinc
+                    iir => zero-phase butterworth, second-order sections forward-backward
     '''
 
     from jumeg.filter import jumeg_filter
@@ -50,7 +50,13 @@ import os
 import numpy as np
 import time
 import copy
+import json
+import hashlib
+import tempfile
 import warnings
+import traceback
+import multiprocessing
+from collections import deque
 from math import floor, ceil
 
 import mne
@@ -243,7 +249,6 @@ def plot_denoising(fname_raw, fmin=0, fmax=300, tmin=0.0, tmax=60.0,
 def perform_detrending(fname_raw, save=True):
 
     from mne.io import Raw
-    from numpy import poly1d, polyfit
 
     fnraw = get_files_from_list(fname_raw)
 
@@ -253,17 +258,8 @@ def perform_detrending(fname_raw, save=True):
         # read data in
         raw = Raw(fname, preload=True)
 
-        # get channels
-        picks = mne.pick_types(raw.info, meg='mag', ref_meg=True,
-                               eeg=False, stim=False,
-                               eog=False, exclude='bads')
-        xval = np.arange(raw._data.shape[1])
-
-        # loop over all channels
-        for ipick in picks:
-            coeff = polyfit(xval, raw._data[ipick, :], deg=1)
-            trend = poly1d(coeff)
-            raw._data[ipick, :] -= trend(xval)
+        # detrend magnetic signal and reference channels
+        _detrend_channels(raw)
 
     # save detrended data
     if save:
@@ -273,6 +269,24 @@ def perform_detrending(fname_raw, save=True):
     return raw
 
 
+def _detrend_channels(raw):
+    """Subtract the linear trend from all magnetic signal and reference
+    channels of a preloaded raw object (in place, channel by channel)."""
+
+    from numpy import poly1d, polyfit
+
+    picks = mne.pick_types(raw.info, meg='mag', ref_meg=True,
+                           eeg=False, stim=False,
+                           eog=False, exclude='bads')
+    xval = np.arange(raw._data.shape[1])
+
+    # loop over all channels
+    for ipick in picks:
+        coeff = polyfit(xval, raw._data[ipick, :], deg=1)
+        trend = poly1d(coeff)
+        raw._data[ipick, :] -= trend(xval)
+
+
 ##################################################
 #
 # Get indices of matching channel names from list
@@ -317,6 +331,959 @@ def channel_indices_from_list(fulllist, findlist, excllist=None):
     return chnpick
 
 
+##################################################
+#
+# Helpers for the streaming (memory-mapped) mode
+#
+##################################################
+def _memmap_tmpfile(tmpdir=None):
+    """Reserve a temporary file name for memory-mapped data."""
+    fd, fname = tempfile.mkstemp(prefix='jumeg_nr_', suffix='.dat', dir=tmpdir)
+    os.close(fd)
+    return fname
+
+
+def _unlink_tmpfile(fname):
+    """Remove a temporary file right after it has been mapped.
+
+    On POSIX systems the mapping stays valid until it is released,
+    so no data files are left behind, whatever happens to the caller.
+    """
+    try:
+        os.remove(fname)
+    except OSError:
+        warnings.warn("Could not remove temporary file '%s'" % fname)
+
+
+def _load_raw_streaming(fname=None, raw=None, tmpdir=None):
+    """Read raw data into a memory-mapped buffer instead of RAM."""
+    fnmmap = _memmap_tmpfile(tmpdir)
+    if raw is None:
+        raw = mne.io.Raw(fname, preload=fnmmap)
+    else:
+        raw._preload_data(fnmmap)
+    _unlink_tmpfile(fnmmap)
+    return raw
+
+
+def _load_raw_dtype(fname=None, raw=None, dtype=np.float32, streaming=False,
+                    tmpdir=None):
+    """Read raw data into a buffer of type dtype (float32 mode).
+
+    mne reads the file buffer by buffer into the given array, no float64
+    copy of the recording is made. In streaming mode the buffer is a
+    memory-mapped array.
+    """
+    if raw is None:
+        raw = mne.io.Raw(fname, preload=False)
+    shape = (raw.info['nchan'], raw.n_times)
+    if streaming:
+        fnmmap = _memmap_tmpfile(tmpdir)
+        buf = np.memmap(fnmmap, dtype=dtype, mode='w+', shape=shape)
+        _unlink_tmpfile(fnmmap)
+    else:
+        buf = np.empty(shape, dtype=dtype)
+    raw._preload_data(buf)
+    return raw
+
+
+##################################################
+#
+# Vectorized, artifact-screened accumulation of
+# sig/ref covariance sums
+#
+##################################################
+def _segments_are_good(segs, idx_by_type, reject, checkable):
+    """Peak-to-peak reject test for many data segments at once.
+
+    Vectorized equivalent of mne.epochs._is_good(..., flat=None)
+    applied to every segment.
+
+    Parameters
+    ----------
+    segs: array (nseg, nchan, nsamp)
+    idx_by_type: dict of channel indices by type (channel_indices_by_type())
+    reject: dict of peak-to-peak thresholds by channel type
+    checkable: boolean array (nchan), False for channels to ignore
+
+    Returns
+    -------
+    good: boolean array (nseg)
+    """
+    good = np.ones(segs.shape[0], dtype=bool)
+    for key, thresh in reject.items():
+        idx = [k for k in idx_by_type.get(key, []) if checkable[k]]
+        if len(idx) == 0:
+            continue
+        segtype = segs[:, idx, :]
+        deltas = segtype.max(axis=2) - segtype.min(axis=2)
+        good &= ~np.any(deltas > thresh, axis=1)
+    return good
+
+
+def _iter_segment_sums(data, sigpick, itmin, itmax, itstep, refpick=None,
+                       refdata=None, reject=None, idx_by_type=None,
+                       checkable=None, nblock=50, dtype=None):
+    """Yield the sig/ref sums of [itmin, itmax) segment by segment.
+
+    The window is cut into segments of itstep samples (the last one may be
+    shorter). Blocks of nblock segments are read at once and reshaped to
+    (segments x channels x samples), the reject test is run for all
+    segments of a block and the products are computed by batched GEMMs.
+
+    Parameters
+    ----------
+    data: raw._data (may be memory-mapped)
+    refpick: indices of the reference channels in data
+    refdata: filtered reference channels (nref, n_times), used instead
+             of data[refpick] if given. If both are None only the signal
+             sums are calculated.
+    reject: dict of peak-to-peak thresholds (None: no artifact rejection)
+    idx_by_type, checkable: see _segments_are_good()
+    dtype: data type of the segment sums and products [None: as data]
+
+    Yields
+    ------
+    None for a rejected segment, otherwise
+    (nsamp, sigsum, sssum, refsum, srsum, rrsum) of the segment
+    (ref-sums are 0 without refs)
+    """
+    with_refs = refpick is not None or refdata is not None
+    first = itmin
+    while first < itmax:
+        nseg = min(nblock, (itmax - first) // itstep)
+        if nseg > 0:
+            nsamp = itstep
+        else:
+            # trailing short segment
+            nseg, nsamp = 1, itmax - first
+        last = first + nseg * nsamp
+        sigsegs = np.array(data[sigpick, first:last], dtype=dtype)
+        sigsegs = sigsegs.reshape(len(sigpick), nseg, nsamp).transpose(1, 0, 2)
+        if with_refs:
+            if refdata is not None:
+                refsegs = np.array(refdata[:, first:last], dtype=dtype)
+            else:
+                refsegs = np.array(data[refpick, first:last], dtype=dtype)
+            refsegs = refsegs.reshape(refsegs.shape[0], nseg, nsamp).transpose(1, 0, 2)
+
+        good = np.ones(nseg, dtype=bool)
+        if reject is not None:
+            good = _segments_are_good(sigsegs, idx_by_type, reject, checkable)
+            for iseg in np.where(~good)[0]:
+                logger.info("Artefact detected in [%d, %d]" %
+                            (first + iseg * nsamp, first + (iseg + 1) * nsamp))
+            if not good.all():
+                sigsegs = sigsegs[good]
+                if with_refs:
+                    refsegs = refsegs[good]
+
+        if sigsegs.shape[0] > 0:
+            sigsum = sigsegs.sum(axis=2)
+            sssum = (sigsegs * sigsegs).sum(axis=2)
+            if with_refs:
+                refsum = refsegs.sum(axis=2)
+                srsum = np.matmul(sigsegs, refsegs.transpose(0, 2, 1))
+                rrsum = np.matmul(refsegs, refsegs.transpose(0, 2, 1))
+        igood = 0
+        for isgood in good:
+            if not isgood:
+                yield None
+                continue
+            if with_refs:
+                yield (nsamp, sigsum[igood], sssum[igood], refsum[igood],
+                       srsum[igood], rrsum[igood])
+            else:
+                yield (nsamp, sigsum[igood], sssum[igood], 0, 0, 0)
+            igood += 1
+        first = last
+
+
+def _calc_sigref_sums(data, sigpick, itmin, itmax, itstep, refpick=None,
+                      refdata=None, reject=None, idx_by_type=None,
+                      checkable=None, nblock=50, dtype=None):
+    """Accumulate sig/ref sums over artifact-free segments of [itmin, itmax).
+
+    The segment sums of _iter_segment_sums() are added in order, the
+    results are identical to a loop over single segments. The sums are
+    accumulated in float64, also if the segments are float32 (dtype).
+
+    Returns
+    -------
+    n_samples, sigsum, sssum, refsum, srsum, rrsum
+    (the sums are 0 if no segment was accepted, ref-sums 0 without refs)
+    """
+    n_samples = 0
+    sums = [0, 0, 0, 0, 0]
+    for segsums in _iter_segment_sums(data, sigpick, itmin, itmax, itstep,
+                                      refpick=refpick, refdata=refdata,
+                                      reject=reject, idx_by_type=idx_by_type,
+                                      checkable=checkable, nblock=nblock,
+                                      dtype=dtype):
+        if segsums is None:
+            continue
+        if n_samples == 0:
+            # the segment sums are views into the block results
+            sums = [np.array(x, dtype=np.float64) if isinstance(x, np.ndarray) else x
+                    for x in segsums[1:]]
+        else:
+            for isum in xrange(5):
+                sums[isum] += segsums[isum + 1]
+        n_samples += segsums[0]
+    sigsum, sssum, refsum, srsum, rrsum = sums
+    return n_samples, sigsum, sssum, refsum, srsum, rrsum
+
+
+def _covariances_from_sums(n_samples, sigsum, sssum, refsum, srsum, rrsum):
+    """Turn the sums of _calc_sigref_sums() into means and covariances.
+
+    The sum arrays are overwritten.
+
+    Returns
+    -------
+    sigmean, refmean, sscovdata, srcovdata, rrcovdata
+    """
+    sigmean = sigsum
+    refmean = refsum
+    sscovdata = sssum
+    srcovdata = srsum
+    rrcovdata = rrsum
+    sigmean /= n_samples
+    refmean /= n_samples
+    sscovdata -= n_samples * sigmean[:] * sigmean[:]
+    sscovdata /= (n_samples - 1)
+    srcovdata -= n_samples * sigmean[:, None] * refmean[None, :]
+    srcovdata /= (n_samples - 1)
+    rrcovdata -= n_samples * refmean[:, None] * refmean[None, :]
+    rrcovdata /= (n_samples - 1)
+    return sigmean, refmean, sscovdata, srcovdata, rrcovdata
+
+
+##################################################
+#
+# Checks of the reference-filter settings
+#
+##################################################
+def _check_refnotch(refnotch, sfreq):
+    """Return the list of valid notch frequencies (< nyquist)."""
+    nyquist = (0.5 * sfreq)
+    if isinstance(refnotch, list):
+        notchfrqs = refnotch
+    else:
+        notchfrqs = [refnotch]
+    notchfrqscln = []
+    for nfrq in notchfrqs:
+        if not isinstance(nfrq, float) and not isinstance(nfrq, int):
+            raise ValueError("Illegal entry for notch-frequency (", nfrq, ")")
+        if nfrq >= nyquist:
+            warnings.warn('Ignoring notch frequency > 0.5*sample_rate=%.1fHz' % nyquist)
+        else:
+            notchfrqscln.append(nfrq)
+    if len(notchfrqscln) == 0:
+        raise ValueError("Notch frequency list is (now) empty")
+    return notchfrqscln
+
+
+def _check_refstages(refstages, reflp=None, refhp=None, refnotch=None):
+    """Return the reference-filter stages as list of (reflp, refhp, refnotch)."""
+    if refstages is None:
+        return [(reflp, refhp, refnotch)]
+    if reflp is not None or refhp is not None or refnotch is not None:
+        raise ValueError("Cannot specify refstages together with "
+                         "reflp, refhp or refnotch")
+    if len(refstages) == 0:
+        raise ValueError("List of reference-filter stages is empty")
+    stages = []
+    for stage in refstages:
+        unknown = set(stage.keys()) - set(['reflp', 'refhp', 'refnotch'])
+        if len(unknown) > 0:
+            raise ValueError("Illegal key(s) in reference-filter stage: %s" %
+                             ', '.join(sorted(unknown)))
+        stages.append((stage.get('reflp'), stage.get('refhp'), stage.get('refnotch')))
+    return stages
+
+
+##################################################
+#
+# Persistent storage of regression weights
+#
+##################################################
+WEIGHTS_FORMAT_VERSION = 2
+
+
+def _file_identity(fname):
+    """Return (absolute path, size, mtime) of a file."""
+    fstat = os.stat(fname)
+    return [os.path.abspath(fname), fstat.st_size, int(fstat.st_mtime)]
+
+
+def _refflt_settings(refflt_method, refflt_params):
+    """Return the reference-filter method and sorted parameters as stored."""
+    return [refflt_method, json.loads(json.dumps(sorted(refflt_params.items())))]
+
+
+def _weights_cache_name(cachedir, identity, itmin, itmax, sig_names,
+                        ref_names, stages, refflt, precision, exclude_artifacts,
+                        detrending):
+    """Return the cache file name for a set of weight-calc parameters."""
+    key = json.dumps([WEIGHTS_FORMAT_VERSION, identity, itmin, itmax,
+                      list(sig_names), list(ref_names), stages, refflt, precision,
+                      bool(exclude_artifacts), bool(detrending)])
+    return os.path.join(cachedir, 'nrweights-%s.npz' % hashlib.sha1(key).hexdigest())
+
+
+def _write_weights(fname, identity, itmin, itmax, sig_names, ref_names,
+                   stages, refflt, precision, stageweights, sscovinit):
+    """Store the regression weights of all stages in a .npz file.
+
+    refflt: [refflt_method, refflt_params] as returned by _refflt_settings()
+    precision: 'float64' or 'float32', precision the weights were computed in
+    stageweights: list of (weights, refmean), one per stage, with weights
+                  of shape (nsig, nref) in the order of sig_names, ref_names
+    """
+    arrays = dict(version=WEIGHTS_FORMAT_VERSION,
+                  identity=json.dumps(identity),
+                  itmin=itmin, itmax=itmax,
+                  sig_names=np.array(sig_names), ref_names=np.array(ref_names),
+                  stages=json.dumps(stages), refflt=json.dumps(refflt),
+                  precision=precision, sscovinit=sscovinit)
+    for istage, (weights, refmean) in enumerate(stageweights):
+        arrays['weights_%d' % istage] = weights
+        arrays['refmean_%d' % istage] = refmean
+    # write to a temporary file first, concurrent readers never see partial files
+    fntmp = fname + '.tmp%d.npz' % os.getpid()
+    np.savez(fntmp, **arrays)
+    os.rename(fntmp, fname)
+
+
+def _read_weights(fname):
+    """Read regression weights stored by _write_weights()."""
+    npz = np.load(fname)
+    if int(npz['version']) != WEIGHTS_FORMAT_VERSION:
+        raise ValueError("Unsupported format of weights file '%s'" % fname)
+    stages = [tuple(stage) for stage in json.loads(str(npz['stages']))]
+    stored = dict(identity=json.loads(str(npz['identity'])),
+                  itmin=int(npz['itmin']), itmax=int(npz['itmax']),
+                  sig_names=[str(name) for name in npz['sig_names']],
+                  ref_names=[str(name) for name in npz['ref_names']],
+                  stages=stages, refflt=json.loads(str(npz['refflt'])),
+                  precision=str(npz['precision']),
+                  sscovinit=npz['sscovinit'],
+                  stageweights=[(npz['weights_%d' % istage], npz['refmean_%d' % istage])
+                                for istage in xrange(len(stages))])
+    npz.close()
+    return stored
+
+
+def _picks_from_stored(ch_names, stored, sigpick):
+    """Map the channels of stored weights to a raw object.
+
+    Returns
+    -------
+    sigpick: indices of the stored signal channels present in ch_names
+    sigrows: corresponding rows of the stored weights
+    refpick: indices of the stored reference channels
+    """
+    missing = [name for name in stored['ref_names'] if name not in ch_names]
+    if len(missing) > 0:
+        raise ValueError("Reference channel(s) of stored weights not found: %s" %
+                         ', '.join(missing))
+    refpick = np.array([ch_names.index(name) for name in stored['ref_names']], dtype=int)
+    sigrows = [irow for irow, name in enumerate(stored['sig_names']) if name in ch_names]
+    if len(sigrows) == 0:
+        raise ValueError("No signal channel of stored weights found")
+    if len(sigrows) < len(stored['sig_names']):
+        warnings.warn('%d signal channel(s) of stored weights not found' %
+                      (len(stored['sig_names']) - len(sigrows)))
+    storedpick = np.array([ch_names.index(stored['sig_names'][irow]) for irow in sigrows], dtype=int)
+    nocomp = np.setdiff1d(sigpick, storedpick)
+    if len(nocomp) > 0:
+        warnings.warn('%d signal channel(s) not covered by stored weights '
+                      'remain uncompensated' % len(nocomp))
+    return storedpick, np.array(sigrows, dtype=int), refpick
+
+
+##################################################
+#
+# Noise-reduction engine shared by all variants
+# (jumeg_noise_reducer, jumeg_noise_reducer_hcp,
+#  jumeg_4raw_data_noise_reducer)
+#
+##################################################
+class JuMEG_NoiseReducer_Engine(object):
+    """Noise-reduction engine: reference filtering, weight calculation,
+    chunkwise compensation and the checkresults pass.
+
+    The variants of the noise reducer only differ in the configuration
+    of the engine (reference-filter method, reject thresholds) and in
+    their file handling.
+
+    Parameters
+    ----------
+    reject : dict of peak-to-peak thresholds for the artifact screening
+             of the signal channels [None: grad=4000e-13, mag=4e-12,
+             eeg=40e-6, eog=250e-6]
+    refflt_method : filter method for the reference channels, passed to
+                    mne's filter()/notch_filter() ['fft']
+    refflt_params : dict of further arguments for these filter calls,
+                    e.g. dict(fir_design='firwin', fir_window='hann') [None]
+    exclude_artifacts : screen the signal channels for artifacts [True]
+    checkresults : internal checks and final signal variance [True]
+    chunk_duration : length (s) of the chunks the data are processed in [10.]
+    streaming : filter the reference channels one at a time into a
+                memory-mapped array (see noise_reducer()) [False]
+    tmpdir : directory for memory-mapped arrays [None: system default]
+    precision : 'float64' or 'float32' ['float64']
+                With 'float32' the segment products and the compensation
+                are computed in single precision, the covariance sums are
+                accumulated in float64 (see noise_reducer()).
+    verbose : [False]
+    """
+
+    # length (s) of the segments used in the artifact screening
+    tstep = 0.2
+
+    def __init__(self, reject=None, refflt_method='fft', refflt_params=None,
+                 exclude_artifacts=True, checkresults=True, chunk_duration=10.,
+                 streaming=False, tmpdir=None, precision='float64', verbose=False):
+        if precision not in ('float64', 'float32'):
+            raise ValueError("precision must be 'float64' or 'float32'")
+        if reject is None:
+            reject = dict(grad=4000e-13, # T / m (gradiometers)
+                          mag=4e-12,     # T (magnetometers)
+                          eeg=40e-6,     # uV (EEG channels)
+                          eog=250e-6)    # uV (EOG channels)
+        self.reject = reject
+        self.refflt_method = refflt_method
+        self.refflt_params = refflt_params if refflt_params is not None else dict()
+        self.exclude_artifacts = exclude_artifacts
+        self.checkresults = checkresults
+        self.chunk_duration = chunk_duration
+        self.streaming = streaming
+        self.tmpdir = tmpdir
+        self.dtype = np.dtype(precision).type
+        self.verbose = verbose
+
+    def _chunk_length(self, sfreq):
+        """Number of samples per chunk."""
+        return max(int(ceil(self.chunk_duration * sfreq)), 1)
+
+    def _segment_lengths(self, sfreq):
+        """Return itstep (artifact-screening segment) and nblock (segments/chunk)."""
+        itstep = int(ceil(self.tstep * sfreq))
+        nblock = max(self._chunk_length(sfreq) // itstep, 1)
+        return itstep, nblock
+
+    def _setup_artifact_screening(self, raw, sigpick):
+        """Return reject, idx_by_type and checkable for _calc_sigref_sums()."""
+        # The reject and infosig entries are only used in the artifact
+        # screening (_segments_are_good()). Like _is_good() from
+        # mne/epochs.py it ignores ref-channels (not covered by dict)
+        # and checks individual data segments - artifacts across a
+        # buffer boundary are not found.
+        infosig = copy.copy(raw.info)
+        infosig['chs'] = [raw.info['chs'][k] for k in sigpick]
+        # the below fields are updated automatically when 'chs' is updated
+        # infosig['ch_names'] = [raw.info['ch_names'][k] for k in sigpick]
+        # infosig['nchan'] = len(sigpick)
+        idx_by_typesig = channel_indices_by_type(infosig)
+        checkable = np.array([ch not in raw.info['bads'] for ch in infosig['ch_names']])
+        reject = self.reject if self.exclude_artifacts else None
+        return reject, idx_by_typesig, checkable
+
+    ##################################################
+    # reference filtering
+    ##################################################
+    def _filter_refs_chunked(self, raw, refpick, refhp=None, reflp=None,
+                             notchfrqs=None):
+        """Filter reference channels into a memory-mapped array.
+
+        The reference channels are filtered one at a time, such that only
+        a single channel trace is held in memory. If notchfrqs is given,
+        raw(ref)-notched(ref) is returned as for the refnotch-option of
+        noise_reducer(), otherwise the band-pass (refhp, reflp) result.
+
+        Returns
+        -------
+        refdata: array (nref, n_times), memory-mapped
+        """
+        fnmmap = _memmap_tmpfile(self.tmpdir)
+        refdata = np.memmap(fnmmap, dtype=np.float64, mode='w+',
+                            shape=(len(refpick), raw._data.shape[1]))
+        _unlink_tmpfile(fnmmap)
+        sfreq = raw.info['sfreq']
+        for iref, ipick in enumerate(refpick):
+            chndata = np.array(raw._data[ipick:ipick + 1, :], dtype=np.float64)
+            if notchfrqs is not None:
+                notched = mne.filter.notch_filter(chndata, sfreq, notchfrqs,
+                                                  method=self.refflt_method, copy=True,
+                                                  **self.refflt_params)
+                refdata[iref, :] = chndata[0] - notched[0]
+            else:
+                refdata[iref, :] = mne.filter.filter_data(chndata, sfreq, refhp, reflp,
+                                                          method=self.refflt_method, copy=False,
+                                                          **self.refflt_params)[0]
+        return refdata
+
+    def filter_references(self, raw, refpick, reflp=None, refhp=None, refnotch=None):
+        """Filter the reference channels.
+
+        Returns
+        -------
+        refdata: filtered reference channels (nref, n_times) or
+                 None if no reference filter is requested
+        """
+        if reflp is None and refhp is None and refnotch is None:
+            return None
+
+        if self.verbose:
+            print "########## Filter reference channels:"
+
+        notchfrqscln = None
+        if refnotch is not None:
+            if reflp is not None or refhp is not None:
+                raise ValueError("Cannot specify notch- and high-/low-pass"
+                                 "reference filter together")
+            notchfrqscln = _check_refnotch(refnotch, raw.info['sfreq'])
+            if self.verbose:
+                print ">>> notches at freq ", notchfrqscln
+        else:
+            if self.verbose:
+                if reflp is not None:
+                    print ">>>  low-pass with cutoff-freq %.1f" % reflp
+                if refhp is not None:
+                    print ">>> high-pass with cutoff-freq %.1f" % refhp
+
+        tct = time.clock()
+        twt = time.time()
+        if self.streaming:
+            refdata = self._filter_refs_chunked(raw, refpick, refhp=refhp, reflp=reflp,
+                                                notchfrqs=notchfrqscln)
+        else:
+            # Only the reference channels are copied (into one contiguous
+            # array) and filtered in place - no copy of the full raw object.
+            sfreq = raw.info['sfreq']
+            # mne's filters work in float64 only
+            refdata = np.array(raw._data[refpick, :], dtype=np.float64)
+            if notchfrqscln is not None:
+                refdata = mne.filter.notch_filter(refdata, sfreq, notchfrqscln,
+                                                  method=self.refflt_method, copy=False,
+                                                  **self.refflt_params)
+                # raw(ref)-notched(ref), channel by channel
+                for iref, ipick in enumerate(refpick):
+                    np.subtract(raw._data[ipick], refdata[iref], out=refdata[iref])
+            else:
+                refdata = mne.filter.filter_data(refdata, sfreq, refhp, reflp,
+                                                 method=self.refflt_method, copy=False,
+                                                 **self.refflt_params)
+        tc1 = time.clock()
+        tw1 = time.time()
+        if self.verbose:
+            print ">>> filtering ref-chans  took %.1f ms (%.2f s walltime)" % (1000. * (tc1 - tct), (tw1 - twt))
+        return refdata
+
+    ##################################################
+    # step 1: weights
+    ##################################################
+    def calc_weights(self, raw, sigpick, refpick, itmin, itmax, refdata=None):
+        """Calculate the sig-ref regression weights for [itmin, itmax).
+
+        Parameters
+        ----------
+        refdata: filtered reference channels (see filter_references()),
+                 if None the reference channels refpick of raw are used
+
+        Returns
+        -------
+        weights: array (nchan, nref), zero for non-signal channels
+        refmean: mean of the (filtered) reference channels
+        sscovinit: variance of the signal channels before compensation
+        """
+        nsig = len(sigpick)
+        nref = len(refpick)
+        if self.verbose:
+            print "########## Calculating sig-ref/ref-ref-channel covariances:"
+        # Calculate sig-ref/ref-ref-channel covariance:
+        # (there is no need to calc inter-signal-chan cov,
+        #  but there seems to be no appropriat fct available)
+        # Here we copy the idea from compute_raw_data_covariance()
+        # and truncate it as appropriate.
+        tct = time.clock()
+        twt = time.time()
+        reject, idx_by_typesig, checkable = self._setup_artifact_screening(raw, sigpick)
+
+        # Read data in chunks of nblock segments with tstep each:
+        itstep, nblock = self._segment_lengths(raw.info['sfreq'])
+        if refdata is not None:
+            n_samples, sigmean, sscovdata, refmean, srcovdata, rrcovdata = \
+                _calc_sigref_sums(raw._data, sigpick, itmin, itmax, itstep,
+                                  refdata=refdata, reject=reject,
+                                  idx_by_type=idx_by_typesig,
+                                  checkable=checkable, nblock=nblock,
+                                  dtype=self.dtype)
+        else:
+            n_samples, sigmean, sscovdata, refmean, srcovdata, rrcovdata = \
+                _calc_sigref_sums(raw._data, sigpick, itmin, itmax, itstep,
+                                  refpick=refpick, reject=reject,
+                                  idx_by_type=idx_by_typesig,
+                                  checkable=checkable, nblock=nblock,
+                                  dtype=self.dtype)
+        if n_samples <= 1:
+            raise ValueError('Too few samples to calculate weights')
+        sigmean, refmean, sscovdata, srcovdata, rrcovdata = \
+            _covariances_from_sums(n_samples, sigmean, sscovdata, refmean,
+                                   srcovdata, rrcovdata)
+        sscovinit = np.copy(sscovdata)
+
+        if self.verbose:
+            print ">>> Number of samples used : %d" % n_samples
+            tc1 = time.clock()
+            tw1 = time.time()
+            print ">>> sigrefchn covar-calc took %.1f ms (%.2f s walltime)" % (1000. * (tc1 - tct), (tw1 - twt))
+
+        if self.checkresults:
+            if self.verbose:
+                print "########## Calculated initial signal channel covariance:"
+                # Calculate initial signal channel covariance:
+                # (only used as quality measure)
+                print ">>> initl rt(avg sig pwr) = %12.5e" % np.sqrt(np.mean(sscovdata))
+                for i in xrange(min(5,nsig)):
+                    print ">>> initl signal-rms[%3d] = %12.5e" % (i, np.sqrt(sscovdata.flatten()[i]))
+                print ">>>"
+
+        # weights-matrix will be somewhat larger than necessary,
+        # (to simplify indexing in compensation loop):
+        weights = np.zeros((raw._data.shape[0], nref))
+        weights[sigpick] = self._solve_weights(srcovdata, rrcovdata)
+
+        return weights, refmean, sscovinit
+
+    def _solve_weights(self, srcovdata, rrcovdata, report=True):
+        """Solve for the regression weights (nsig, nref) from the sig-ref
+        and ref-ref covariances. srcovdata is overwritten.
+
+        report=False suppresses the diagnostic output (sliding windows).
+        """
+        nsig, nref = srcovdata.shape
+        verbose = report and self.verbose
+        if verbose:
+            print ">>> Normalize srcov..."
+
+        rrslope = copy.copy(rrcovdata)
+        for iref in xrange(nref):
+            dtmp = rrcovdata[iref, iref]
+            if dtmp > TINY:
+                srcovdata[:, iref] /= dtmp
+                rrslope[:, iref] /= dtmp
+            else:
+                srcovdata[:, iref] = 0.
+                rrslope[:, iref] = 0.
+
+        U, s, V = np.linalg.svd(rrslope, full_matrices=True)
+        if verbose:
+            print ">>> singular values:"
+            print s
+            print ">>> Applying cutoff for smallest SVs:"
+
+        dtmp = s.max() * SVD_RELCUTOFF
+        s *= (abs(s) >= dtmp)
+        sinv = [1. / s[k] if s[k] != 0. else 0. for k in xrange(nref)]
+        if verbose:
+            print ">>> singular values (after cutoff):"
+            print s
+
+            stat = np.allclose(rrslope, np.dot(U, np.dot(np.diag(s), V)))
+            print ">>> Testing svd-result: %s" % stat
+            if not stat:
+                print "    (Maybe due to SV-cutoff?)"
+
+        # Solve for inverse coefficients:
+        # Set RRinv.tr=U diag(sinv) V
+        RRinv = np.transpose(np.dot(U, np.dot(np.diag(sinv), V)))
+        if self.checkresults and report:
+            stat = np.allclose(np.identity(nref), np.dot(RRinv, rrslope))
+            if stat:
+                if verbose:
+                    print ">>> Testing RRinv-result (should be unit-matrix): ok"
+            else:
+                print ">>> Testing RRinv-result (should be unit-matrix): failed"
+                print np.transpose(np.dot(RRinv, rrslope))
+                print ">>>"
+
+        if verbose:
+            print "########## Calc weight matrix..."
+
+        weights = np.zeros((nsig, nref))
+        for isig in xrange(nsig):
+            for iref in xrange(nref):
+                weights[isig, iref] = np.dot(srcovdata[isig,:], RRinv[:,iref])
+        return weights
+
+    def calc_ref_mean(self, raw, refpick, itmin, itmax, refdata=None):
+        """Mean of the (filtered) reference channels in [itmin, itmax)."""
+        ichunk = self._chunk_length(raw.info['sfreq'])
+        refsum = 0
+        for first in xrange(itmin, itmax, ichunk):
+            last = min(first + ichunk, itmax)
+            if refdata is not None:
+                refsum += refdata[:, first:last].sum(axis=1)
+            else:
+                refsum += raw._data[refpick, first:last].sum(axis=1)
+        return refsum / float(itmax - itmin)
+
+    ##################################################
+    # step 2: compensation
+    ##################################################
+    def apply_weights(self, raw, weights, refmean, refpick, refdata=None,
+                      complementary_signal=False):
+        """Subtract the weighted references from the data, chunk by chunk."""
+        if self.verbose:
+            print "########## Compensating signal channels:"
+            if complementary_signal:
+                print ">>> Caveat: REPLACING signal by compensation signal"
+
+        tct = time.clock()
+        twt = time.time()
+
+        # Work on entire data stream, chunk by chunk:
+        n_times = raw._data.shape[1]
+        ichunk = self._chunk_length(raw.info['sfreq'])
+        weights = np.asarray(weights, dtype=self.dtype)
+        for first in xrange(0, n_times, ichunk):
+            last = min(first + ichunk, n_times)
+            if refdata is not None:
+                refarr = refdata[:, first:last] - refmean[:, None]
+            else:
+                refarr = raw._data[refpick, first:last] - refmean[:, None]
+            subrefarr = np.dot(weights, refarr.astype(self.dtype))
+
+            if not complementary_signal:
+                raw._data[:, first:last] -= subrefarr
+            else:
+                raw._data[:, first:last] = subrefarr
+
+            if self.verbose:
+                print "\rProcessed slice %6d" % first
+
+        if self.verbose:
+            print "\nDone."
+            tc1 = time.clock()
+            tw1 = time.time()
+            print ">>> compensation loop took %.1f ms (%.2f s walltime)" % (1000. * (tc1 - tct), (tw1 - twt))
+
+    ##################################################
+    # steps 1+2 for time-varying weights: sliding windows
+    ##################################################
+    def calc_adaptive_weights(self, raw, sigpick, refpick, itmin, itmax,
+                              window, overlap=0.5, refdata=None):
+        """Calculate regression weights for sliding windows over [itmin, itmax).
+
+        Windows are window seconds long and overlap by the fraction
+        overlap of their length (0 <= overlap <= 0.5). Both are rounded
+        to the tstep-segments of the artifact screening; the last window
+        ends at itmax and takes up the remainder, so no window is shorter
+        than window seconds (unless [itmin, itmax) is). The sig/ref sums of each segment are computed once
+        and kept in a queue: going from one window to the next adds the
+        incoming and subtracts the outgoing segments, so the cost stays
+        linear in the length of the recording.
+
+        Returns
+        -------
+        windows: list of (first, last, weights, refmean) with
+                 weights (nsig, nref) for the samples [first, last)
+        """
+        if not 0. <= overlap <= 0.5:
+            raise ValueError("Window overlap must be within [0, 0.5]")
+        nsig = len(sigpick)
+        nref = len(refpick)
+        if self.verbose:
+            print "########## Calculating sliding-window weights:"
+        tct = time.clock()
+        twt = time.time()
+        reject, idx_by_typesig, checkable = self._setup_artifact_screening(raw, sigpick)
+        itstep, nblock = self._segment_lengths(raw.info['sfreq'])
+        wseg = max(int(round(window * raw.info['sfreq'] / itstep)), 1)
+        oseg = int(floor(overlap * wseg))
+        hseg = wseg - oseg
+        nsegtot = int(ceil(float(itmax - itmin) / itstep))
+        # the last window starts at (nwin - 1) * hseg and spans at least wseg segments
+        nwin = max((nsegtot - oseg) // hseg, 1)
+        if self.verbose:
+            print ">>> %d windows of %.1f s, overlap %.1f s" % \
+                  (nwin, wseg * itstep / raw.info['sfreq'], oseg * itstep / raw.info['sfreq'])
+
+        if refdata is not None:
+            segsums = _iter_segment_sums(raw._data, sigpick, itmin, itmax, itstep,
+                                         refdata=refdata, reject=reject,
+                                         idx_by_type=idx_by_typesig,
+                                         checkable=checkable, nblock=nblock,
+                                         dtype=self.dtype)
+        else:
+            segsums = _iter_segment_sums(raw._data, sigpick, itmin, itmax, itstep,
+                                         refpick=refpick, reject=reject,
+                                         idx_by_type=idx_by_typesig,
+                                         checkable=checkable, nblock=nblock,
+                                         dtype=self.dtype)
+        queue = deque()
+        qfirst = 0  # index of the first segment in queue
+        n_samples = 0
+        totals = [np.zeros(nsig), np.zeros(nsig), np.zeros(nref),
+                  np.zeros((nsig, nref)), np.zeros((nref, nref))]
+        windows = []
+        for iwin in xrange(nwin):
+            segfirst = iwin * hseg
+            seglast = nsegtot if iwin == nwin - 1 else segfirst + wseg
+            # add the incoming segments
+            while qfirst + len(queue) < seglast:
+                seg = next(segsums)
+                queue.append(seg)
+                if seg is not None:
+                    n_samples += seg[0]
+                    for isum in xrange(5):
+                        totals[isum] += seg[isum + 1]
+            # subtract the outgoing segments
+            while qfirst < segfirst:
+                seg = queue.popleft()
+                qfirst += 1
+                if seg is not None:
+                    n_samples -= seg[0]
+                    for isum in xrange(5):
+                        totals[isum] -= seg[isum + 1]
+            first = itmin + segfirst * itstep
+            last = min(itmin + seglast * itstep, itmax)
+            if n_samples <= 1:
+                raise ValueError('Too few samples to calculate weights in [%d, %d]'
+                                 % (first, last))
+            sigmean, refmean, sscovdata, srcovdata, rrcovdata = \
+                _covariances_from_sums(n_samples, *[np.copy(x) for x in totals])
+            weights = self._solve_weights(srcovdata, rrcovdata, report=False)
+            windows.append((first, last, weights, refmean))
+
+        if self.verbose:
+            tc1 = time.clock()
+            tw1 = time.time()
+            print ">>> sliding-window weight-calc took %.1f ms (%.2f s walltime)" % (1000. * (tc1 - tct), (tw1 - twt))
+        return windows
+
+    def apply_adaptive_weights(self, raw, windows, sigpick, refpick, refdata=None,
+                               complementary_signal=False):
+        """Subtract the weighted references with time-varying weights.
+
+        windows is the result of calc_adaptive_weights(). Each window's
+        weights are used alone outside the overlaps with its neighbours;
+        within an overlap the two compensation signals are cross-faded
+        linearly. The first (last) window's weights are also used before
+        (after) the windows.
+        """
+        if self.verbose:
+            print "########## Compensating signal channels (sliding windows):"
+            if complementary_signal:
+                print ">>> Caveat: REPLACING signal by compensation signal"
+
+        tct = time.clock()
+        twt = time.time()
+
+        # cut the trace into pieces with one window (iwin, None)
+        # or a cross-fade from iwin to iwin + 1 (iwin, iwin + 1)
+        n_times = raw._data.shape[1]
+        nwin = len(windows)
+        pieces = []
+        for iwin in xrange(nwin):
+            first = 0 if iwin == 0 else max(windows[iwin - 1][1], windows[iwin][0])
+            if iwin == nwin - 1:
+                pieces.append((first, n_times, iwin, None))
+            else:
+                nextfirst = windows[iwin + 1][0]
+                pieces.append((first, min(nextfirst, windows[iwin][1]), iwin, None))
+                if nextfirst < windows[iwin][1]:
+                    pieces.append((nextfirst, windows[iwin][1], iwin, iwin + 1))
+
+        ichunk = self._chunk_length(raw.info['sfreq'])
+        for pfirst, plast, iwin, inext in pieces:
+            for first in xrange(pfirst, plast, ichunk):
+                last = min(first + ichunk, plast)
+                if refdata is not None:
+                    refarr = np.array(refdata[:, first:last])
+                else:
+                    refarr = raw._data[refpick, first:last]
+                weights, refmean = windows[iwin][2:]
+                subrefarr = np.dot(weights.astype(self.dtype),
+                                   (refarr - refmean[:, None]).astype(self.dtype))
+                if inext is not None:
+                    weights, refmean = windows[inext][2:]
+                    fade = ((np.arange(first, last) - pfirst + 0.5) /
+                            (plast - pfirst)).astype(self.dtype)
+                    subrefarr *= (1. - fade)
+                    subrefarr += fade * np.dot(weights.astype(self.dtype),
+                                               (refarr - refmean[:, None]).astype(self.dtype))
+
+                if not complementary_signal:
+                    raw._data[sigpick, first:last] -= subrefarr
+                else:
+                    raw._data[:, first:last] = 0.
+                    raw._data[sigpick, first:last] = subrefarr
+
+        if self.verbose:
+            tc1 = time.clock()
+            tw1 = time.time()
+            print ">>> compensation loop took %.1f ms (%.2f s walltime)" % (1000. * (tc1 - tct), (tw1 - twt))
+
+    ##################################################
+    # step 3: checkresults
+    ##################################################
+    def calc_signal_variance(self, raw, sigpick, itmin, itmax):
+        """Return the variance of the signal channels in [itmin, itmax)."""
+        reject, idx_by_typesig, checkable = self._setup_artifact_screening(raw, sigpick)
+        itstep, nblock = self._segment_lengths(raw.info['sfreq'])
+        n_samples, sigmean, sscovdata = \
+            _calc_sigref_sums(raw._data, sigpick, itmin, itmax, itstep,
+                              reject=reject, idx_by_type=idx_by_typesig,
+                              checkable=checkable, nblock=nblock,
+                              dtype=self.dtype)[:3]
+        if n_samples <= 1:
+            raise ValueError('Too few samples to calculate signal channel covariance')
+        sigmean /= n_samples
+        sscovdata -= n_samples * sigmean[:] * sigmean[:]
+        sscovdata /= (n_samples - 1)
+        return sscovdata
+
+    def check_results(self, raw, sigpick, itmin, itmax, sscovinit):
+        """Calculate the signal channel variance after compensation.
+
+        Returns
+        -------
+        sscovdata: variance of the signal channels in [itmin, itmax)
+        """
+        nsig = len(sigpick)
+        if self.verbose:
+            print "########## Calculating final signal channel covariance:"
+        # Calculate final signal channel covariance:
+        # (only used as quality measure)
+        tct = time.clock()
+        twt = time.time()
+        # Artifacts found here will probably differ from pre-noisered artifacts!
+        sscovdata = self.calc_signal_variance(raw, sigpick, itmin, itmax)
+        if self.verbose:
+            print ">>> no channel got worse: ", np.all(np.less_equal(sscovdata, sscovinit))
+            print ">>> final rt(avg sig pwr) = %12.5e" % np.sqrt(np.mean(sscovdata))
+            for i in xrange(min(5,nsig)):
+                print ">>> final signal-rms[%3d] = %12.5e" % (i, np.sqrt(sscovdata.flatten()[i]))
+            tc1 = time.clock()
+            tw1 = time.time()
+            print ">>> signal covar-calc took %.1f ms (%.2f s walltime)" % (1000. * (tc1 - tct), (tw1 - twt))
+            print ">>>"
+        return sscovdata
+
+
+def _suppression_stats(sscovinit, sscovfinal):
+    """Summary of the checkresults pass: rt(avg sig pwr) before and after
+    compensation and the suppression of the average signal power in dB."""
+    pwrinit = np.mean(sscovinit)
+    pwrfinal = np.mean(sscovfinal)
+    return dict(sigrms_init=np.sqrt(pwrinit), sigrms_final=np.sqrt(pwrfinal),
+                suppression=10. * np.log10(pwrinit / max(pwrfinal, TINY)))
+
+
 ##################################################
 #
 # Apply noise reduction to signal channels
@@ -326,7 +1293,12 @@ def channel_indices_from_list(fulllist, findlist, excllist=None):
 def noise_reducer(fname_raw, raw=None, signals=[], noiseref=[], detrending=None,
                   tmin=None, tmax=None, reflp=None, refhp=None, refnotch=None,
                   exclude_artifacts=True, checkresults=True, return_raw=False,
-                  complementary_signal=False, fnout=None, verbose=False):
+                  complementary_signal=False, fnout=None, refstages=None,
+                  weights_cache=None, fnweights=None, weights_from=None,
+                  streaming=False, chunk_duration=10., tmpdir=None,
+                  refflt_method='fft', refflt_params=None,
+                  adaptive_window=None, adaptive_overlap=0.5, stats=None,
+                  precision='float64', verbose=False):
 
     """Apply noise reduction to signal channels using reference channels.
 
@@ -355,6 +1327,29 @@ def noise_reducer(fname_raw, raw=None, signals=[], noiseref=[], detrending=None,
             reflp is None, refhp is not None: high-pass filter
     refnotch : (list of) notch frequencies for reference signal filter [None]
                use raw(ref)-notched(ref) as reference signal
+    refstages : ordered list of reference-filter stages [None]
+                Each stage is a dict with (some of) the keys 'reflp',
+                'refhp' and 'refnotch' (see above) and compensates the
+                output of the previous stage, e.g.
+                [dict(refnotch=[50., 100.]), dict(reflp=5.), dict(refhp=0.1)]
+                This replaces chained calls with return_raw=True: the data
+                are read and the channels picked once and all stages work
+                in place on the same raw object.
+                Cannot be combined with reflp, refhp or refnotch.
+    weights_cache : directory for an on-disk cache of regression weights
+                    [None: no caching]
+                    Weights are stored with the channel picks and the
+                    reference-filter settings, keyed by file identity
+                    (path, size, mtime), time window, precision and
+                    parameters.
+                    A re-run with the same settings skips the covariance
+                    pass. Only used if the data are read from file.
+    fnweights : file name (.npz) to store the calculated weights [None]
+    weights_from : file name (.npz) of weights stored by fnweights or in
+                   weights_cache to apply instead of calculating them,
+                   e.g. weights from an empty-room recording. [None]
+                   The stored reference-filter settings are used. The
+                   reference means are recalculated for other recordings.
     exclude_artifacts: filter signal-channels thru _is_good() [True]
                        (parameters are at present hard-coded!)
     return_raw : bool
@@ -371,6 +1366,53 @@ def noise_reducer(fname_raw, raw=None, signals=[], noiseref=[], detrending=None,
                 magn. chans [False]
     checkresults : boolean to control internal checks and overall success
                    [True]
+    streaming : bool
+        Out-of-core mode for recordings larger than the available memory.
+        The raw data are read into a memory-mapped buffer (see the
+        preload-argument of mne.io.Raw) instead of RAM, the reference
+        channels are filtered one at a time, and the covariance and
+        compensation passes only touch chunks of the data. The output
+        file is written buffer by buffer by mne. [False]
+    chunk_duration : length (s) of the chunks used to apply the weights [10.]
+    tmpdir : directory for the memory-mapped buffers in streaming mode.
+             They need about twice the size of the raw file. The files
+             are unlinked immediately. [None: system default]
+    refflt_method : method of the reference signal filter, passed to mne's
+                    filter()/notch_filter() ['fft']
+    refflt_params : dict of further arguments for the reference signal
+                    filter, e.g. dict(fir_design='firwin') [None]
+    adaptive_window : length (s) of sliding windows for time-varying
+                      weights [None: one set of weights for (tmin,tmax)]
+                      Weights are calc'd for each window within (tmin,tmax)
+                      to follow drifting environmental noise. The sig/ref
+                      sums are updated incrementally from window to window.
+                      Cannot be combined with weights_from, weights_cache
+                      or fnweights.
+    adaptive_overlap : overlap of the sliding windows as fraction of
+                       adaptive_window, 0 <= adaptive_overlap <= 0.5.
+                       The compensation signals of neighbouring windows
+                       are cross-faded linearly within the overlap. [0.5]
+    stats : dict to collect run statistics [None]
+            For every file stats[fname] is set to a dict with 'walltime' (s),
+            'fnout' and, if checkresults is True, the rt(avg sig pwr) before
+            and after compensation ('sigrms_init', 'sigrms_final') and the
+            'suppression' in dB (see noise_reducer_batch()).
+    precision : 'float64' or 'float32' ['float64']
+                'float32' holds the data in single precision (as written by
+                raw.save() by default) and computes the segment products
+                and the compensation in float32, with half the memory
+                (traffic) and faster BLAS. The covariance sums are
+                accumulated and the weights solved in float64, the
+                reference filters run in float64. A preloaded float64 raw
+                object passed in is compensated on a float32 copy and the
+                result is written back into its float64 data; with
+                return_raw the returned data are float64.
+                Error bound: the compensated signal channels differ from
+                the float64 result by less than 1e-5 times the rms of the
+                uncompensated signal, and the suppression (checkresults)
+                by less than 0.01 dB (asserted by test_noise_reducer_precision()).
+                The weights are least-squares solutions, their error grows
+                with the condition of the ref-ref covariance.
 
     Outputfile
     ----------
@@ -422,6 +1464,21 @@ def noise_reducer(fname_raw, raw=None, signals=[], noiseref=[], detrending=None,
     else:
         raise ValueError('Refusing Creatio ex nihilo')
 
+    if adaptive_window is not None:
+        if weights_from is not None or weights_cache is not None or \
+           fnweights is not None:
+            raise ValueError('Sliding-window weights cannot be stored or read')
+        if not 0. <= adaptive_overlap <= 0.5:
+            raise ValueError('adaptive_overlap must be within [0, 0.5]')
+
+    engine = JuMEG_NoiseReducer_Engine(refflt_method=refflt_method,
+                                       refflt_params=refflt_params,
+                                       exclude_artifacts=exclude_artifacts,
+                                       checkresults=checkresults,
+                                       chunk_duration=chunk_duration,
+                                       streaming=streaming, tmpdir=tmpdir,
+                                       precision=precision, verbose=verbose)
+
     # loop across all filenames
     for fname in fnraw:
 
@@ -431,8 +1488,21 @@ def noise_reducer(fname_raw, raw=None, signals=[], noiseref=[], detrending=None,
         tc0 = time.clock()
         tw0 = time.time()
 
+        raw_from_file = raw is None
+        data_caller = None  # float64 data of the caller's raw while a float32 copy is compensated
+        upcast = False      # raw loaded in float32 here => float64 for return_raw
         if raw is None:
-            if detrending:
+            if precision != 'float64':
+                raw = _load_raw_dtype(fname, dtype=engine.dtype, streaming=streaming,
+                                      tmpdir=tmpdir)
+                upcast = True
+                if detrending:
+                    _detrend_channels(raw)
+            elif streaming:
+                raw = _load_raw_streaming(fname, tmpdir=tmpdir)
+                if detrending:
+                    _detrend_channels(raw)
+            elif detrending:
                 raw = perform_detrending(fname, save=False)
             else:
                 raw = mne.io.Raw(fname, preload=True)
@@ -445,6 +1515,18 @@ def noise_reducer(fname_raw, raw=None, signals=[], noiseref=[], detrending=None,
             if os.path.basename(fname) != os.path.basename(fnintern):
                 warnings.warn('The file name within the Raw object and provided\n   '
                               'fname are not the same. Please check again.')
+            if not raw.preload:
+                if precision != 'float64':
+                    raw = _load_raw_dtype(raw=raw, dtype=engine.dtype, streaming=streaming,
+                                          tmpdir=tmpdir)
+                    upcast = True
+                elif streaming:
+                    raw = _load_raw_streaming(raw=raw, tmpdir=tmpdir)
+                else:
+                    raw.load_data()
+            elif raw._data.dtype != engine.dtype and precision != 'float64':
+                data_caller = raw._data
+                raw._data = raw._data.astype(engine.dtype)
 
         tc1 = time.clock()
         tw1 = time.time()
@@ -504,269 +1586,112 @@ def noise_reducer(fname_raw, raw=None, signals=[], noiseref=[], detrending=None,
         if len(badpick) > 0:
             raise Warning, "Intersection of signal and reference channels not empty"
 
-        if reflp is None and refhp is None and refnotch is None:
-            use_reffilter = False
-            use_refantinotch = False
-        else:
-            use_reffilter = True
-            if verbose:
-                print "########## Filter reference channels:"
-
-            use_refantinotch = False
-            if refnotch is not None:
-                if reflp is not None or reflp is not None:
-                    raise ValueError("Cannot specify notch- and high-/low-pass"
-                                     "reference filter together")
-                nyquist = (0.5 * raw.info['sfreq'])
-                if isinstance(refnotch, list):
-                  notchfrqs = refnotch
-                else:
-                  notchfrqs = [ refnotch ]
-                notchfrqscln = []
-                for nfrq in notchfrqs:
-                    if not isinstance(nfrq,float) and not isinstance(nfrq,int):
-                        raise ValueError("Illegal entry for notch-frequency (",nfrq,")")
-                    if nfrq >= nyquist:
-                        warnings.warn('Ignoring notch frequency > 0.5*sample_rate=%.1fHz' % nyquist)
-                    else:
-                        notchfrqscln.append(nfrq)
-                if len(notchfrqscln) == 0:
-                    raise ValueError("Notch frequency list is (now) empty")
-                use_refantinotch = True
-                if verbose:
-                    print ">>> notches at freq ", notchfrqscln
-            else:
-                if verbose:
-                    if reflp is not None:
-                        print ">>>  low-pass with cutoff-freq %.1f" % reflp
-                    if refhp is not None:
-                        print ">>> high-pass with cutoff-freq %.1f" % refhp
-
-            # Adapt followg drop-chans cmd to use 'all-but-refpick'
-            droplist = [raw.info['ch_names'][k] for k in xrange(raw.info['nchan']) if not k in refpick]
-            tct = time.clock()
-            twt = time.time()
-            fltref = raw.copy().drop_channels(droplist)
-            if use_refantinotch:
-                rawref = raw.copy().drop_channels(droplist)
-                fltref.notch_filter(notchfrqscln,
-                                    picks=np.array(xrange(nref)), method='fft')
-                fltref._data = (rawref._data - fltref._data)
-            else:
-                fltref.filter(refhp, reflp, picks=np.array(xrange(nref)), method='fft')
-            tc1 = time.clock()
-            tw1 = time.time()
+        stages = _check_refstages(refstages, reflp, refhp, refnotch)
+        refflt = _refflt_settings(engine.refflt_method, engine.refflt_params)
+        if len(stages) > 1 and complementary_signal:
+            raise ValueError("complementary_signal cannot be combined with "
+                             "several reference-filter stages")
+
+        # Look for stored weights:
+        identity = _file_identity(fname) if raw_from_file else None
+        stored = None
+        fncache = None
+        if weights_from is not None:
+            stored = _read_weights(weights_from)
+            if stages != [(None, None, None)] and stages != stored['stages']:
+                raise ValueError("Reference-filter settings differ from those "
+                                 "stored in '%s'" % weights_from)
+            if refflt != stored['refflt']:
+                raise ValueError("Reference-filter method or parameters differ "
+                                 "from those stored in '%s'" % weights_from)
+            stages = stored['stages']
+            sigpick, sigrows, refpick = _picks_from_stored(raw.info['ch_names'], stored, sigpick)
             if verbose:
-                print ">>> filtering ref-chans  took %.1f ms (%.2f s walltime)" % (1000. * (tc1 - tct), (tw1 - twt))
-
-        if verbose:
-            print "########## Calculating sig-ref/ref-ref-channel covariances:"
-        # Calculate sig-ref/ref-ref-channel covariance:
-        # (there is no need to calc inter-signal-chan cov,
-        #  but there seems to be no appropriat fct available)
-        # Here we copy the idea from compute_raw_data_covariance()
-        # and truncate it as appropriate.
-        tct = time.clock()
-        twt = time.time()
-        # The following reject and infosig entries are only
-        # used in _is_good-calls.
-        # _is_good() from mne-0.9.git-py2.7.egg/mne/epochs.py seems to
-        # ignore ref-channels (not covered by dict) and checks individual
-        # data segments - artifacts across a buffer boundary are not found.
-        reject = dict(grad=4000e-13, # T / m (gradiometers)
-                      mag=4e-12,     # T (magnetometers)
-                      eeg=40e-6,     # uV (EEG channels)
-                      eog=250e-6)    # uV (EOG channels)
-
-        infosig = copy.copy(raw.info)
-        infosig['chs'] = [raw.info['chs'][k] for k in sigpick]
-        # the below fields are updated automatically when 'chs' is updated
-        # infosig['ch_names'] = [raw.info['ch_names'][k] for k in sigpick]
-        # infosig['nchan'] = len(sigpick)
-        idx_by_typesig = channel_indices_by_type(infosig)
-
-        # Read data in chunks:
-        tstep = 0.2
-        itstep = int(ceil(tstep * raw.info['sfreq']))
-        sigmean = 0
-        refmean = 0
-        sscovdata = 0
-        srcovdata = 0
-        rrcovdata = 0
-        n_samples = 0
-
-        for first in range(itmin, itmax, itstep):
-            last = first + itstep
-            if last >= itmax:
-                last = itmax
-            raw_segmentsig, times = raw[sigpick, first:last]
-            if use_reffilter:
-                raw_segmentref, times = fltref[:, first:last]
+                print ">>> Using weights from '%s'" % weights_from
+        elif weights_cache is not None:
+            if raw_from_file:
+                fncache = _weights_cache_name(weights_cache, identity, itmin, itmax,
+                                              [raw.info['ch_names'][k] for k in sigpick],
+                                              [raw.info['ch_names'][k] for k in refpick],
+                                              stages, refflt, precision, exclude_artifacts,
+                                              detrending)
+                if os.path.isfile(fncache):
+                    stored = _read_weights(fncache)
+                    sigrows = np.arange(len(sigpick))
+                    if verbose:
+                        print ">>> Using cached weights from '%s'" % fncache
             else:
-                raw_segmentref, times = raw[refpick, first:last]
-
-            if not exclude_artifacts or \
-               _is_good(raw_segmentsig, infosig['ch_names'], idx_by_typesig, reject, flat=None,
-                        ignore_chs=raw.info['bads']):
-                sigmean += raw_segmentsig.sum(axis=1)
-                refmean += raw_segmentref.sum(axis=1)
-                sscovdata += (raw_segmentsig * raw_segmentsig).sum(axis=1)
-                srcovdata += np.dot(raw_segmentsig, raw_segmentref.T)
-                rrcovdata += np.dot(raw_segmentref, raw_segmentref.T)
-                n_samples += raw_segmentsig.shape[1]
-            else:
-                logger.info("Artefact detected in [%d, %d]" % (first, last))
-        if n_samples <= 1:
-            raise ValueError('Too few samples to calculate weights')
-        sigmean /= n_samples
-        refmean /= n_samples
-        sscovdata -= n_samples * sigmean[:] * sigmean[:]
-        sscovdata /= (n_samples - 1)
-        srcovdata -= n_samples * sigmean[:, None] * refmean[None, :]
-        srcovdata /= (n_samples - 1)
-        rrcovdata -= n_samples * refmean[:, None] * refmean[None, :]
-        rrcovdata /= (n_samples - 1)
-        sscovinit = np.copy(sscovdata)
-        if verbose:
-            print ">>> Normalize srcov..."
-
-        rrslope = copy.copy(rrcovdata)
-        for iref in xrange(nref):
-            dtmp = rrcovdata[iref, iref]
-            if dtmp > TINY:
-                srcovdata[:, iref] /= dtmp
-                rrslope[:, iref] /= dtmp
+                warnings.warn('weights_cache is only used if data are read from file')
+
+        if stored is not None:
+            # reference means and initial signal variance are only valid
+            # for the recording and time window the weights stem from
+            same_data = identity is not None and stored['identity'] == identity and \
+                        stored['itmin'] == itmin and stored['itmax'] == itmax
+            if same_data:
+                sscovinit = stored['sscovinit'][sigrows]
+            elif checkresults:
+                sscovinit = engine.calc_signal_variance(raw, sigpick, itmin, itmax)
+        elif adaptive_window is not None and checkresults:
+            sscovinit = engine.calc_signal_variance(raw, sigpick, itmin, itmax)
+        stageweights = []
+
+        # All stages work in place on the same raw object; the signal
+        # channels of each stage are the output of the previous one.
+        for istage, (stglp, stghp, stgnotch) in enumerate(stages):
+            if verbose and len(stages) > 1:
+                print "########## Reference-filter stage %d of %d:" % (istage + 1, len(stages))
+
+            refdata = engine.filter_references(raw, refpick, reflp=stglp, refhp=stghp,
+                                               refnotch=stgnotch)
+
+            if adaptive_window is not None:
+                windows = engine.calc_adaptive_weights(raw, sigpick, refpick, itmin, itmax,
+                                                       adaptive_window, overlap=adaptive_overlap,
+                                                       refdata=refdata)
+                engine.apply_adaptive_weights(raw, windows, sigpick, refpick, refdata=refdata,
+                                              complementary_signal=complementary_signal)
+                del refdata
+                continue
+
+            if stored is not None:
+                weights = np.zeros((raw._data.shape[0], len(refpick)))
+                weights[sigpick] = stored['stageweights'][istage][0][sigrows]
+                if same_data:
+                    refmean = stored['stageweights'][istage][1]
+                else:
+                    refmean = engine.calc_ref_mean(raw, refpick, itmin, itmax, refdata=refdata)
             else:
-                srcovdata[:, iref] = 0.
-                rrslope[:, iref] = 0.
-
-        if verbose:
-            print ">>> Number of samples used : %d" % n_samples
-            tc1 = time.clock()
-            tw1 = time.time()
-            print ">>> sigrefchn covar-calc took %.1f ms (%.2f s walltime)" % (1000. * (tc1 - tct), (tw1 - twt))
-
-        if checkresults:
-            if verbose:
-                print "########## Calculated initial signal channel covariance:"
-                # Calculate initial signal channel covariance:
-                # (only used as quality measure)
-                print ">>> initl rt(avg sig pwr) = %12.5e" % np.sqrt(np.mean(sscovdata))
-                for i in xrange(min(5,nsig)):
-                    print ">>> initl signal-rms[%3d] = %12.5e" % (i, np.sqrt(sscovdata.flatten()[i]))
-                print ">>>"
-
-        U, s, V = np.linalg.svd(rrslope, full_matrices=True)
-        if verbose:
-            print ">>> singular values:"
-            print s
-            print ">>> Applying cutoff for smallest SVs:"
-
-        dtmp = s.max() * SVD_RELCUTOFF
-        s *= (abs(s) >= dtmp)
-        sinv = [1. / s[k] if s[k] != 0. else 0. for k in xrange(nref)]
-        if verbose:
-            print ">>> singular values (after cutoff):"
-            print s
-
-        stat = np.allclose(rrslope, np.dot(U, np.dot(np.diag(s), V)))
-        if verbose:
-            print ">>> Testing svd-result: %s" % stat
-            if not stat:
-                print "    (Maybe due to SV-cutoff?)"
+                weights, refmean, sscovstage = \
+                    engine.calc_weights(raw, sigpick, refpick, itmin, itmax, refdata=refdata)
+                if istage == 0:
+                    sscovinit = sscovstage
+                stageweights.append((weights[sigpick], refmean))
+
+            engine.apply_weights(raw, weights, refmean, refpick, refdata=refdata,
+                                 complementary_signal=complementary_signal)
+            del refdata
+
+        if stored is None and (fncache is not None or fnweights is not None):
+            sig_names = [raw.info['ch_names'][k] for k in sigpick]
+            ref_names = [raw.info['ch_names'][k] for k in refpick]
+            for fnw in [fncache, fnweights]:
+                if fnw is not None:
+                    if verbose:
+                        print ">>> Storing weights in '%s'" % fnw
+                    _write_weights(fnw, identity, itmin, itmax, sig_names, ref_names,
+                                   stages, refflt, precision, stageweights, sscovinit)
 
-        # Solve for inverse coefficients:
-        # Set RRinv.tr=U diag(sinv) V
-        RRinv = np.transpose(np.dot(U, np.dot(np.diag(sinv), V)))
         if checkresults:
-            stat = np.allclose(np.identity(nref), np.dot(RRinv, rrslope))
-            if stat:
-                if verbose:
-                    print ">>> Testing RRinv-result (should be unit-matrix): ok"
-            else:
-                print ">>> Testing RRinv-result (should be unit-matrix): failed"
-                print np.transpose(np.dot(RRinv, rrslope))
-                print ">>>"
-
-        if verbose:
-            print "########## Calc weight matrix..."
-
-        # weights-matrix will be somewhat larger than necessary,
-        # (to simplify indexing in compensation loop):
-        weights = np.zeros((raw._data.shape[0], nref))
-        for isig in xrange(nsig):
-            for iref in xrange(nref):
-                weights[sigpick[isig],iref] = np.dot(srcovdata[isig,:], RRinv[:,iref])
-
-        if verbose:
-            print "########## Compensating signal channels:"
-            if complementary_signal:
-                print ">>> Caveat: REPLACING signal by compensation signal"
-
-        tct = time.clock()
-        twt = time.time()
-
-        # Work on entire data stream:
-        for isl in xrange(raw._data.shape[1]):
-            slice = np.take(raw._data, [isl], axis=1)
-            if use_reffilter:
-                refslice = np.take(fltref._data, [isl], axis=1)
-                refarr = refslice[:].flatten() - refmean
-                # refarr = fltres[:,isl]-refmean
-            else:
-                refarr = slice[refpick].flatten() - refmean
-            subrefarr = np.dot(weights[:], refarr)
-
-            if not complementary_signal:
-                raw._data[:, isl] -= subrefarr
-            else:
-                raw._data[:, isl] = subrefarr
-
-            if (isl % 10000 == 0) and verbose:
-                print "\rProcessed slice %6d" % isl
+            sscovfinal = engine.check_results(raw, sigpick, itmin, itmax, sscovinit)
 
-        if verbose:
-            print "\nDone."
-            tc1 = time.clock()
-            tw1 = time.time()
-            print ">>> compensation loop took %.1f ms (%.2f s walltime)" % (1000. * (tc1 - tct), (tw1 - twt))
-
-        if checkresults:
-            if verbose:
-                print "########## Calculating final signal channel covariance:"
-            # Calculate final signal channel covariance:
-            # (only used as quality measure)
-            tct = time.clock()
-            twt = time.time()
-            sigmean = 0
-            sscovdata = 0
-            n_samples = 0
-            for first in range(itmin, itmax, itstep):
-                last = first + itstep
-                if last >= itmax:
-                    last = itmax
-                raw_segmentsig, times = raw[sigpick, first:last]
-                # Artifacts found here will probably differ from pre-noisered artifacts!
-                if not exclude_artifacts or \
-                   _is_good(raw_segmentsig, infosig['ch_names'], idx_by_typesig, reject,
-                            flat=None, ignore_chs=raw.info['bads']):
-                    sigmean += raw_segmentsig.sum(axis=1)
-                    sscovdata += (raw_segmentsig * raw_segmentsig).sum(axis=1)
-                    n_samples += raw_segmentsig.shape[1]
-            if n_samples <= 1:
-                raise ValueError('Too few samples to calculate final signal channel covariance')
-            sigmean /= n_samples
-            sscovdata -= n_samples * sigmean[:] * sigmean[:]
-            sscovdata /= (n_samples - 1)
-            if verbose:
-                print ">>> no channel got worse: ", np.all(np.less_equal(sscovdata, sscovinit))
-                print ">>> final rt(avg sig pwr) = %12.5e" % np.sqrt(np.mean(sscovdata))
-                for i in xrange(min(5,nsig)):
-                    print ">>> final signal-rms[%3d] = %12.5e" % (i, np.sqrt(sscovdata.flatten()[i]))
-                tc1 = time.clock()
-                tw1 = time.time()
-                print ">>> signal covar-calc took %.1f ms (%.2f s walltime)" % (1000. * (tc1 - tct), (tw1 - twt))
-                print ">>>"
+        if data_caller is not None:
+            # the caller's raw keeps its data array and dtype
+            data_caller[...] = raw._data
+            raw._data = data_caller
+            data_caller = None
+        elif upcast and return_raw:
+            raw._data = raw._data.astype(np.float64)
 
         if fnout is not None:
             fnoutloc = fnout
@@ -787,11 +1712,142 @@ def noise_reducer(fname_raw, raw=None, signals=[], noiseref=[], detrending=None,
         if verbose:
             print ">>> Total run took %.1f ms (%.2f s walltime)" % (1000. * (tc1 - tc0), (tw1 - tw0))
 
+        if stats is not None:
+            stats[fname] = dict(walltime=tw1 - tw0, fnout=fnoutloc)
+            if checkresults:
+                stats[fname].update(_suppression_stats(sscovinit, sscovfinal))
+
         if return_raw:
             if verbose:
                 print ">>> Returning raw object..."
             return raw
 
+        if raw_from_file:
+            # read the next file in the list
+            raw = None
+
+##################################################
+#
+# Batch processing of file lists in a process pool
+#
+##################################################
+def _set_memory_limit(max_memory):
+    """Limit the data segment (heap) of the calling process to max_memory bytes.
+
+    Memory-mapped files (streaming mode) do not count against the limit.
+    """
+    import resource
+    soft, hard = resource.getrlimit(resource.RLIMIT_DATA)
+    if hard != resource.RLIM_INFINITY:
+        max_memory = min(max_memory, hard)
+    resource.setrlimit(resource.RLIMIT_DATA, (int(max_memory), hard))
+
+
+def _noise_reducer_worker(args):
+    """Run noise_reducer() on one file of noise_reducer_batch().
+
+    Runs in a pool process of its own; any exception is caught and
+    reported in the result instead of aborting the batch.
+    """
+    fname, fnout, max_memory, kwargs = args
+    result = dict(fname=fname, fnout=fnout, error=None)
+    tw0 = time.time()
+    try:
+        if max_memory is not None:
+            _set_memory_limit(max_memory)
+        stats = dict()
+        noise_reducer(fname, fnout=fnout, stats=stats, **kwargs)
+        result.update(stats[fname])
+    except Exception as err:
+        result['error'] = '%s: %s' % (type(err).__name__, err)
+        result['traceback'] = traceback.format_exc()
+        result['walltime'] = time.time() - tw0
+    return result
+
+
+def noise_reducer_batch(fname_raw, n_jobs=1, max_memory=None, fnout=None,
+                        verbose=False, **kwargs):
+    """Apply noise_reducer() to a list of files in a pool of processes.
+
+    Parameters
+    ----------
+    fname_raw : (list of) rawfile name(s), see get_files_from_list()
+    n_jobs : number of worker processes, -1 for all cores [1]
+             Each file is processed in a fresh process. Set
+             OMP_NUM_THREADS=1 (or similar for your BLAS) if n_jobs
+             is close to the number of cores.
+    max_memory : memory limit (bytes) for each file/process [None]
+                 Processing of a file exceeding it fails with a
+                 MemoryError, the other files are not affected.
+                 Memory-mapped buffers of streaming=True are not counted.
+    fnout : list of output file names, one per input file
+            [None: automatic names, '-raw.fif' -> ',nr-raw.fif']
+    verbose : [False]
+    kwargs : further arguments of noise_reducer(); raw, return_raw and
+             stats cannot be used here.
+
+    Returns
+    -------
+    results : list of dicts, one per file in the order of fname_raw,
+              with 'fname', 'fnout', 'walltime' (s) and 'error' (None on
+              success, else the error message plus a 'traceback').
+              With checkresults (default) also 'sigrms_init',
+              'sigrms_final' and the 'suppression' (dB) of the average
+              signal power.
+    A summary of all files is printed.
+    """
+    for key in ('raw', 'return_raw', 'stats'):
+        if kwargs.get(key) is not None and kwargs.get(key) is not False:
+            raise ValueError("Argument '%s' cannot be used in batch mode" % key)
+        kwargs.pop(key, None)
+
+    fnraw = get_files_from_list(fname_raw)
+    if fnout is None:
+        fnouts = [None] * len(fnraw)
+    else:
+        fnouts = get_files_from_list(fnout)
+        if len(fnouts) != len(fnraw):
+            raise ValueError('Need one output file name per input file')
+    if len(fnraw) == 0:
+        return []
+
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = multiprocessing.cpu_count()
+    n_jobs = min(n_jobs, len(fnraw))
+
+    tasks = [(fname, fno, max_memory, dict(kwargs, verbose=verbose))
+             for fname, fno in zip(fnraw, fnouts)]
+    tw0 = time.time()
+    results = []
+    pool = multiprocessing.Pool(n_jobs, maxtasksperchild=1)
+    try:
+        # imap keeps the order of the files (and Ctrl-C working in py2)
+        for result in pool.imap(_noise_reducer_worker, tasks, chunksize=1):
+            results.append(result)
+            if verbose:
+                print ">>> noise_reducer_batch: done with '%s'" % result['fname']
+    finally:
+        pool.close()
+        pool.join()
+    tw1 = time.time()
+
+    nfailed = len([res for res in results if res['error'] is not None])
+    print "########## noise_reducer_batch: %d files, %d failed, %d processes" % \
+          (len(results), nfailed, n_jobs)
+    for res in results:
+        if res['error'] is not None:
+            print ">>> %-60s FAILED after %7.1f s: %s" % (res['fname'], res['walltime'], res['error'])
+        elif 'suppression' in res:
+            print ">>> %-60s %7.1f s  rt(avg sig pwr) %12.5e -> %12.5e  (%5.1f dB)" % \
+                  (res['fname'], res['walltime'], res['sigrms_init'],
+                   res['sigrms_final'], res['suppression'])
+        else:
+            print ">>> %-60s %7.1f s" % (res['fname'], res['walltime'])
+    print ">>> total %.1f s walltime (%.1f s summed over files)" % \
+          (tw1 - tw0, sum([res['walltime'] for res in results]))
+    return results
+
+
 ##################################################
 #
 # routine to test if the noise reducer is
@@ -1218,3 +2274,66 @@ def test_noise_reducer():
     tc1 = time.clock()
     tw1 = time.time()
     print "Total run         took %.1f ms (%.2f s walltime)" % (1000. * (tc1 - tc0), (tw1 - tw0))
+
+
+##################################################
+#
+# regression test of the float32 mode against float64
+#
+##################################################
+def test_noise_reducer_precision(tmpdir=None, seed=42):
+    """Compare noise_reducer(precision='float32') with the float64 result.
+
+    Synthetic data (create_dummy_raw()): 248 magnetometers with a mixture
+    of 23 reference channels (white noise, 50 Hz, low-frequency drift) plus
+    white sensor noise. Asserts the error bound documented in noise_reducer(),
+    also for a preloaded float64 raw object passed in, which must keep its
+    float64 data array.
+    """
+    import shutil
+    from .jumeg_utils import create_dummy_raw
+
+    nsig, nref = 248, 23
+    sfreq, duration = 1017.25, 60.
+    rng = np.random.RandomState(seed)
+    times = np.arange(int(duration * sfreq)) / sfreq
+    refs = 1e-12 * (rng.randn(nref, times.size) +
+                    rng.randn(nref, 1) * np.sin(2. * np.pi * 50. * times) +
+                    rng.randn(nref, 1) * np.sin(2. * np.pi * 0.1 * times))
+    sigs = np.dot(rng.randn(nsig, nref), refs) + 1e-14 * rng.randn(nsig, times.size)
+    sigs += 1e-11 * rng.randn(nsig, 1)
+    ch_names = ['MEG %03d' % (k + 1) for k in xrange(nsig)] + \
+               ['RFM %03d' % (k + 1) for k in xrange(nref)]
+    ch_types = ['mag'] * nsig + ['ref_meg'] * nref
+
+    tmpdir = tempfile.mkdtemp(dir=tmpdir)
+    try:
+        fname = os.path.join(tmpdir, 'nr_precision-raw.fif')
+        create_dummy_raw(np.concatenate((sigs, refs)), ch_types, sfreq, ch_names,
+                         save=True, raw_fname=fname)
+        results = {}
+        for precision in ('float64', 'float32'):
+            stats = dict()
+            raw = noise_reducer(fname, reflp=60., exclude_artifacts=False,
+                                return_raw=True, stats=stats, precision=precision)
+            assert raw._data.dtype == np.float64, "%s: returned data are %s" % (precision, raw._data.dtype)
+            results[precision] = (raw._data[:nsig].copy(), stats[fname])
+            print ">>> %s: %.2f s, suppression %.3f dB" % \
+                  (precision, stats[fname]['walltime'], stats[fname]['suppression'])
+        rawin = mne.io.Raw(fname, preload=True)
+        sigrms = np.sqrt(np.mean(rawin._data[:nsig] ** 2))
+        data_in = rawin._data
+        raw = noise_reducer(fname, raw=rawin, reflp=60., exclude_artifacts=False,
+                            return_raw=True, precision='float32')
+        assert raw._data is data_in and data_in.dtype == np.float64, \
+            "float32: raw passed in lost its float64 data array"
+        devraw = np.sqrt(np.mean((data_in[:nsig] - results['float64'][0]) ** 2)) / sigrms
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    dev = np.sqrt(np.mean((results['float32'][0] - results['float64'][0]) ** 2)) / sigrms
+    ddb = abs(results['float32'][1]['suppression'] - results['float64'][1]['suppression'])
+    print ">>> float32 vs float64: rel. rms deviation %.3e, suppression %.4f dB" % (dev, ddb)
+    assert dev < 1e-5, "float32 result deviates from float64 (%.3e)" % dev
+    assert devraw < 1e-5, "float32 result for raw passed in deviates from float64 (%.3e)" % devraw
+    assert ddb < 0.01, "float32 suppression deviates from float64 (%.4f dB)" % ddb
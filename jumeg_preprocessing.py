@@ -489,12 +489,10 @@ def apply_ctps(fname_ica, freqs=[(1, 4), (4, 8), (8, 12), (12, 16), (16, 20)],
 
     ''' Applies CTPS to a list of ICA files. '''
 
-    from jumeg.filter import jumeg_filter
+    from jumeg.filter.jumeg_filter_bank import JuMEG_Filter_Bank
 
-    fiws = jumeg_filter(filter_method="bw")
-    fiws.filter_type = 'bp'   # bp, lp, hp
-    fiws.dcoffset = True
-    fiws.filter_attenuation_factor = 1
+    # butterworth bp filter bank: one fft of the ICA sources for all bands
+    fibank = JuMEG_Filter_Bank(bands=freqs, remove_dcoffset=True)
 
     nfreq = len(freqs)
     print '>>> CTPS calculation on: ', freqs
@@ -553,27 +551,11 @@ def apply_ctps(fname_ica, freqs=[(1, 4), (4, 8), (8, 12), (12, 16), (16, 20)],
             pkarr = []
             ptarr = []
             pkmax_arr = []
-            for ifreq in range(nfreq):
-                ica_raw = ica.get_sources(raw)
-                flow, fhigh = freqs[ifreq][0], freqs[ifreq][1]
-                bp = str(flow) + '_' + str(fhigh)
-                # filter ICA data and create epochs
-                #tw=0.1
-                # ica_raw.filter(l_freq=flow, h_freq=fhigh, picks=ica_picks,
-                #     method='fft',l_trans_bandwidth=tw, h_trans_bandwidth=tw)
-                # ica_raw.filter(l_freq=flow, h_freq=fhigh, picks=ica_picks,
-                #                                                 method='fft')
-
-                # filter ws settings
-                # later we will make this as a one line call
-                data_length = raw._data[0, :].size
-                fiws.sampling_frequency = raw.info['sfreq']
-                fiws.fcut1 = flow
-                fiws.fcut2 = fhigh
-                #fiws.init_filter_kernel(data_length)
-                #fiws.init_filter(data_length)
-                for ichan in ica_picks:
-                    fiws.apply_filter(ica_raw._data[ichan, :])
+            ica_raw = ica.get_sources(raw)
+            fibank.sampling_frequency = raw.info['sfreq']
+            # filter ICA data in all bands and create epochs
+            for ifreq, band, data_band in fibank.iter_filter_bank(ica_raw._data, picks=ica_picks):
+                ica_raw._data[ica_picks, :] = data_band
 
                 ica_epochs = mne.Epochs(ica_raw, events=stim_events,
                                         event_id=event_id, tmin=tmin,
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+"""
+Benchmark and accuracy test of the jumeg_filter methods on synthetic data
+
+jumeg_filter_benchmark.py --methods bw ws iir mne --types bp hp --lengths 60 300 --nchans 1 32 248 --notches 0 4
+jumeg_filter_benchmark.py --methods bw --paths loop batched parallel --n_jobs 4 --out fi_bench.json
+
+based on jumeg_filter_test.py, no data files needed: the data are
+generated per case (white noise + drifts + line noise harmonics + DC offset)
+
+sweep over filter method, filter type, number of notches (harmonics of the
+line frequency), data length and number of channels; each filter method
+runs on the code paths
+   loop     => channel by channel (multichannel=False)
+   batched  => blocks of channels in one 2D data plane (multichannel=True, n_jobs=1)
+   parallel => batched with n_jobs worker threads (mne: n_jobs of the mne filter)
+
+Each case runs in a process of its own.
+Reported per case: wall time, cpu time, throughput (samples x channels / s),
+peak RSS of the process, RSS of the synthetic data and the max deviation of
+the batched/parallel output from the loop output (relative to its std).
+
+Frequency response per method, type and number of notches: the impulse
+response of the filter is compared with the ideal response (1 in the pass
+band, 0 in the stop band and at the notches), bins within trans_bw of a
+cutoff or notch are excluded:
+   passband_err_db => max |gain| in the pass band (dB)
+   stopband_db     => max gain in the stop band (dB)
+   notch_db        => max gain at the notch frequencies (dB)
+   rms_err         => rms deviation from the ideal magnitude response
+The results are written as JSON (one document per benchmark run).
+"""
+
+import sys, os, os.path
+import time
+import json
+import platform
+import resource
+import traceback
+import multiprocessing
+import numpy as np
+
+import argparse
+
+METHODS = ('bw','ws','iir','mne')
+TYPES   = ('lp','hp','bp','br')
+
+#--- code paths: name -> filter object settings
+PATHS = {
+    'loop'     : dict(multichannel=False,parallel=False),
+    'batched'  : dict(multichannel=True, parallel=False),
+    'parallel' : dict(multichannel=True, parallel=True),
+}
+
+
+def get_args():
+    info="""
+    JuMEG filter benchmark
+    jumeg_filter_benchmark.py --methods bw ws iir mne --types bp --lengths 60 300 --nchans 1 32 248 --notches 0 4 --out fi_bench.json
+    """
+    parser = argparse.ArgumentParser(info)
+#--- sweep
+    parser.add_argument("--methods",nargs='*',help="filter methods",choices=METHODS,default=METHODS)
+    parser.add_argument("--paths",  nargs='*',help="code paths",choices=sorted(PATHS.keys()),default=('loop','batched','parallel'))
+    parser.add_argument("-t","--types",nargs='*',help="filter types lp | hp | bp | br",choices=TYPES,default=('bp',))
+    parser.add_argument("--lengths",nargs='*',type=float,help="data length (s)",default=(60.0,300.0))
+    parser.add_argument("--nchans", nargs='*',type=int,  help="number of channels",default=(1,32,248))
+    parser.add_argument("--notches",nargs='*',type=int,  help="number of notches: harmonics of the line frequency",default=(0,4))
+#--- filter opt
+    parser.add_argument("-fcut1","--fcut1",   type=float,help="fcut1: lp,hp cutoff, lower edge for bp|br",default=1.0)
+    parser.add_argument("-fcut2","--fcut2",   type=float,help="fcut2: upper edge for bp|br, lp cutoff",default=45.0)
+    parser.add_argument("-nw","--notch_width",type=float,help="notch width",default=1.0)
+    parser.add_argument("-or","--order",      type=int,  help="order for butterworth",default=4)
+    parser.add_argument("-nj","--n_jobs",     type=int,  help="number of worker threads/jobs for the parallel path",default=4)
+#--- synthetic data
+    parser.add_argument("-sf","--sfreq",    type=float,help="sampling frequency: 4D 1017.25, HCP 2034.51",default=1017.25)
+    parser.add_argument("-lf","--line_freq",type=float,help="line frequency (Hz)",default=50.0)
+    parser.add_argument("-seed","--seed",   type=int,  help="random seed",default=42)
+#--- frequency response
+    parser.add_argument("-rd","--response_duration",type=float,help="length of the impulse response (s)",default=60.0)
+    parser.add_argument("-tb","--trans_bw",type=float,help="excluded transition band around cutoffs and notches (Hz)",default=2.0)
+#--- benchmark
+    parser.add_argument("-r","--repeat",help="number of runs per case",type=int,default=1)
+    parser.add_argument("-o","--out",   help="JSON output file",default="jumeg_filter_benchmark.json")
+    parser.add_argument("-v","--verbose",action="store_true",help="verbose mode")
+
+    return parser.parse_args(),parser
+
+
+def calc_notches(n,line_freq=50.0,sfreq=1017.25):
+    """return n harmonics of the line frequency below nyquist"""
+    notch = line_freq * np.arange(1,n+1)
+    return notch[ notch < sfreq / 2.0 ]
+
+
+def calc_fcuts(ftype,fcut1,fcut2):
+    """return fcut1,fcut2 for filter type: lp => fcut2 as cutoff, hp => fcut1"""
+    if ftype == 'lp':
+       return fcut2,None
+    if ftype == 'hp':
+       return fcut1,None
+    return fcut1,fcut2
+
+
+def make_filter(method,ftype,fcut1,fcut2,sfreq,notch,notch_width=1.0,order=4,remove_dcoffset=True,n_jobs=1):
+    """
+    return filter object of method
+    ws: not in the jumeg_filter factory, JuMEG_Filter_Ws without notches
+    """
+    if method == 'ws':
+       from jumeg.filter.jumeg_filter_ws import JuMEG_Filter_Ws
+       return JuMEG_Filter_Ws(filter_type=ftype,fcut1=fcut1,fcut2=fcut2,remove_dcoffset=remove_dcoffset,
+                              sampling_frequency=sfreq,n_jobs=n_jobs)
+    from jumeg.filter import jumeg_filter
+    return jumeg_filter(filter_method=method,filter_type=ftype,fcut1=fcut1,fcut2=fcut2,remove_dcoffset=remove_dcoffset,
+                        sampling_frequency=sfreq,notch=notch,notch_width=notch_width,order=order,n_jobs=n_jobs)
+
+
+def make_data(nchans,nsamples,sfreq=1017.25,line_freq=50.0,seed=42):
+    """synthetic data [nchans,nsamples]: white noise, drifts, line noise + harmonics, DC offset"""
+    rng   = np.random.RandomState(seed)
+    times = np.arange(nsamples) / sfreq
+    data  = rng.randn(nchans,nsamples)
+    for flow in (0.05,0.2,0.7):
+        data += 5.0 * rng.rand(nchans,1) * np.sin(2.0 * np.pi * flow * times + 2.0 * np.pi * rng.rand(nchans,1))
+    for harmonic in (1,2,3,4):
+        data += 2.0 / harmonic * rng.rand(nchans,1) * np.sin(2.0 * np.pi * harmonic * line_freq * times + 2.0 * np.pi * rng.rand(nchans,1))
+    data += 100.0 * rng.randn(nchans,1)
+    return data
+
+
+def calc_ideal_response(freqs,ftype,fcut1,fcut2,notch,notch_width=1.0,trans_bw=2.0):
+    """
+    return ideal magnitude response, mask of evaluated bins, mask of notch bins
+    transition bands: trans_bw around cutoffs and notches are excluded,
+    notch bins: within notch_width/10 of a notch
+    """
+    if ftype == 'lp':
+       ideal = freqs < fcut1
+       edges = [fcut1]
+    elif ftype == 'hp':
+       ideal = freqs > fcut1
+       edges = [fcut1]
+    elif ftype == 'bp':
+       ideal = ( freqs > fcut1 ) & ( freqs < fcut2 )
+       edges = [fcut1,fcut2]
+    else:
+       ideal = ( freqs < fcut1 ) | ( freqs > fcut2 )
+       edges = [fcut1,fcut2]
+
+    valid   = freqs > 0.0
+    inotch  = np.zeros(freqs.size,dtype=bool)
+    for f in edges:
+        valid &= np.abs(freqs - f) >= trans_bw
+    for f in notch:
+        ideal  &= np.abs(freqs - f) >= trans_bw
+        valid  &= ( np.abs(freqs - f) >= trans_bw ) | ( np.abs(freqs - f) <= notch_width / 10.0 )
+        inotch |= np.abs(freqs - f) <= notch_width / 10.0
+    return ideal.astype(np.float64),valid,inotch
+
+
+def calc_response_error(method,ftype,fcut1,fcut2,notch,opt):
+    """
+    frequency response error of the filter: impulse response vs ideal response
+    return dict passband_err_db,stopband_db,notch_db,rms_err
+    """
+    n  = int(opt.response_duration * opt.sfreq)
+    fi = make_filter(method,ftype,fcut1,fcut2,opt.sfreq,notch,notch_width=opt.notch_width,order=opt.order,remove_dcoffset=False)
+    data = np.zeros((1,n))
+    data[0,n//2] = 1.0
+    fi.apply_filter(data,np.array([0]))
+
+    gain  = np.abs( np.fft.rfft(data[0]) )
+    freqs = np.fft.rfftfreq(n,1.0 / opt.sfreq)
+    ideal,valid,inotch = calc_ideal_response(freqs,ftype,fcut1,fcut2,notch if method != 'ws' else [],
+                                             notch_width=opt.notch_width,trans_bw=opt.trans_bw)
+    db   = 20.0 * np.log10( np.maximum(gain,1e-20) )
+    ipass = valid & ( ideal > 0.5 )
+    istop = valid & ( ideal < 0.5 ) & ~inotch
+
+    res = dict(rms_err=float( np.sqrt( np.mean( (gain[valid] - ideal[valid])**2 ) ) ))
+    res['passband_err_db'] = float( np.abs(db[ipass]).max() ) if ipass.any() else None
+    res['stopband_db']     = float( db[istop].max() ) if istop.any() else None
+    res['notch_db']        = float( db[valid & inotch].max() ) if ( valid & inotch ).any() else None
+    return res
+
+
+def _peak_rss_mb():
+    """peak resident set size of this process (MB)"""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+       return maxrss / 1024.0**2   # bytes
+    return maxrss / 1024.0         # kB
+
+
+def _run_case(case,opt,queue):
+    """run one case in a fresh process, put the result in queue"""
+    result = dict(error=None)
+    try:
+       rss0 = _peak_rss_mb()
+       data = make_data(case['nchans'],case['nsamples'],sfreq=opt.sfreq,line_freq=opt.line_freq,seed=opt.seed)
+       result['data_rss_mb'] = _peak_rss_mb() - rss0
+       n_jobs = opt.n_jobs if PATHS[case['path']]['parallel'] else 1
+
+       fi = make_filter(case['method'],case['type'],case['fcut1'],case['fcut2'],opt.sfreq,np.array(case['notch']),
+                        notch_width=opt.notch_width,order=opt.order,n_jobs=n_jobs)
+       fi.verbose = opt.verbose
+       if case['method'] != 'mne':
+          fi.multichannel = PATHS[case['path']]['multichannel']
+       tc0 = time.clock()
+       tw0 = time.time()
+       fi.apply_filter(data,np.arange(case['nchans']),n_jobs=n_jobs)
+       result['walltime']    = time.time() - tw0
+       result['cputime']     = time.clock() - tc0
+       result['peak_rss_mb'] = _peak_rss_mb()
+       result['throughput']  = case['nchans'] * case['nsamples'] / max(result['walltime'],1e-9)
+       result['data_out']    = data[ [0,-1] ]
+    except Exception as err:
+       result['error']     = '%s: %s' % (type(err).__name__,err)
+       result['traceback'] = traceback.format_exc()
+    queue.put(result)
+
+
+def run_case(case,opt):
+    """run one case in a child process, return the result dict"""
+    queue = multiprocessing.Queue()
+    proc  = multiprocessing.Process(target=_run_case,args=(case,opt,queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def versions():
+    """versions of the software stack"""
+    import scipy
+    v = dict(python=platform.python_version(),numpy=np.__version__,scipy=scipy.__version__)
+    try:
+       import mne
+       v['mne'] = mne.__version__
+    except ImportError:
+       v['mne'] = None
+    try:
+       import subprocess
+       jumeg_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+       v['jumeg'] = subprocess.check_output(['git','-C',jumeg_path,'describe','--always','--dirty']).strip()
+    except Exception:
+       v['jumeg'] = None
+    return v
+
+
+#---- main
+def main():
+    opt,parser = get_args()
+
+    results   = []
+    responses = []
+    for method in opt.methods:
+        for ftype in opt.types:
+            fcut1,fcut2 = calc_fcuts(ftype,opt.fcut1,opt.fcut2)
+            for nnotch in opt.notches:
+                notch = calc_notches(nnotch,line_freq=opt.line_freq,sfreq=opt.sfreq)
+                if method == 'ws' and nnotch:
+                   print "---> %s: no notches, skipping %d notches" % (method,nnotch)
+                   continue
+#--- frequency response
+                try:
+                   res = calc_response_error(method,ftype,fcut1,fcut2,notch,opt)
+                   res['error'] = None
+                   print "---> %-4s %s %d notches response: passband %s dB stopband %s dB notch %s dB rms %0.3e" % \
+                         (method,ftype,nnotch,res['passband_err_db'],res['stopband_db'],res['notch_db'],res['rms_err'])
+                except Exception as err:
+                   res = dict(error='%s: %s' % (type(err).__name__,err))
+                   print "---> %-4s %s %d notches response: FAILED %s" % (method,ftype,nnotch,res['error'])
+                res.update(method=method,type=ftype,fcut1=fcut1,fcut2=fcut2,notch=notch.tolist())
+                responses.append(res)
+#--- throughput
+                for length in opt.lengths:
+                    for nchans in opt.nchans:
+                        data_loop = None
+                        for path in opt.paths:
+                            if method == 'mne' and path == 'loop':
+                               continue
+                            case = dict(method=method,type=ftype,fcut1=fcut1,fcut2=fcut2,notch=notch.tolist(),path=path,
+                                        length=length,nchans=nchans,nsamples=int(length * opt.sfreq))
+                            for irun in range(opt.repeat):
+                                res = run_case(case,opt)
+                                res.update(case,run=irun)
+                                if res['error'] is None:
+                                   data_out = res.pop('data_out')
+                                   if path == 'loop':
+                                      data_loop = data_out
+                                   if data_loop is not None:
+                                      res['deviation_vs_loop'] = float( np.abs(data_out - data_loop).max() / max(data_loop.std(),1e-20) )
+                                   print "---> %-4s %s n%d %6.1f s %4d ch %-8s run %d: %8.3f s wall %8.3f s cpu %10.3e samples*ch/s %8.1f MB peak RSS" % \
+                                         (method,ftype,len(notch),length,nchans,path,irun,res['walltime'],res['cputime'],
+                                          res['throughput'],res['peak_rss_mb'])
+                                else:
+                                   print "---> %-4s %s n%d %6.1f s %4d ch %-8s run %d: FAILED %s" % \
+                                         (method,ftype,len(notch),length,nchans,path,irun,res['error'])
+                                results.append(res)
+
+    doc = dict(date=time.strftime('%Y-%m-%dT%H:%M:%S'),host=platform.node(),versions=versions(),
+               cpu_count=multiprocessing.cpu_count(),
+               params=dict(sfreq=opt.sfreq,line_freq=opt.line_freq,seed=opt.seed,fcut1=opt.fcut1,fcut2=opt.fcut2,
+                           order=opt.order,notch_width=opt.notch_width,n_jobs=opt.n_jobs,
+                           response_duration=opt.response_duration,trans_bw=opt.trans_bw),
+               responses=responses,results=results)
+    with open(opt.out,'w') as fout:
+       json.dump(doc,fout,indent=1,sort_keys=True)
+    print "---> results written to %s" % (opt.out)
+
+
+if __name__ == "__main__":
+   main()
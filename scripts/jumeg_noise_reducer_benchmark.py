@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the noise_reducer family on synthetic 4D/HCP-sized data
+
+jumeg_noise_reducer_benchmark.py --duration 300 --sfreq 1017.25 --out nr_bench.json
+jumeg_noise_reducer_benchmark.py --cases nr nr_float32 hcp 4raw --repeat 3
+
+A recording with 248 magnetometers and 23 reference channels is generated
+with create_dummy_raw() from jumeg_utils. The references carry white noise,
+line noise (50 Hz and harmonics) and low-frequency drifts; the signal
+channels see a random mixture of them plus sensor noise and a DC offset.
+
+Each case (code path and parameter set) runs in a process of its own.
+Reported per case: wall time, cpu time, peak RSS of the process and the
+suppression of the average signal power, i.e.
+10*log10(<var(signal in)> / <var(signal out)>) over all signal channels.
+The results are written as JSON (one document per benchmark run) together
+with the parameters of the synthetic data and the package versions.
+"""
+
+import sys, os, os.path
+import time
+import json
+import shutil
+import tempfile
+import platform
+import resource
+import traceback
+import multiprocessing
+import numpy as np
+import mne
+
+import argparse
+
+#--- code paths and parameter sets: name -> (variant, kwargs)
+CASES = {
+    'nr'            : ('nr',   dict()),
+    'nr_refnotch'   : ('nr',   dict(refnotch=[50., 100., 150.])),
+    'nr_reflp'      : ('nr',   dict(reflp=5.)),
+    'nr_refstages'  : ('nr',   dict(refstages=[dict(refnotch=[50., 100., 150.]), dict(reflp=5.)])),
+    'nr_streaming'  : ('nr',   dict(refnotch=[50., 100., 150.], streaming=True)),
+    'nr_float32'    : ('nr',   dict(refnotch=[50., 100., 150.], precision='float32')),
+    'nr_adaptive'   : ('nr',   dict(adaptive_window=30., adaptive_overlap=0.5)),
+    'hcp'           : ('hcp',  dict()),
+    'hcp_refnotch'  : ('hcp',  dict(refnotch=[50., 100., 150.])),
+    '4raw'          : ('4raw', dict()),
+    '4raw_refnotch' : ('4raw', dict(refnotch=50.)),
+}
+
+
+def get_args():
+    info="""
+    JuMEG noise_reducer benchmark
+    jumeg_noise_reducer_benchmark.py --duration 300 --sfreq 1017.25 --cases nr hcp 4raw --out nr_bench.json
+    """
+    parser = argparse.ArgumentParser(info)
+#--- synthetic data
+    parser.add_argument("-d","--duration",type=float,help="length of the synthetic recording (s)",default=300.0)
+    parser.add_argument("-sf","--sfreq",  type=float,help="sampling frequency: 4D 1017.25, HCP 2034.51",default=1017.25)
+    parser.add_argument("-ns","--nsig",   type=int,  help="number of signal channels",default=248)
+    parser.add_argument("-nr","--nref",   type=int,  help="number of reference channels",default=23)
+    parser.add_argument("-lf","--line_freq",type=float,help="line frequency (Hz)",default=50.0)
+    parser.add_argument("-seed","--seed", type=int,  help="random seed",default=42)
+#--- benchmark
+    parser.add_argument("--cases",nargs='*',help="cases to run",choices=sorted(CASES.keys()),default=sorted(CASES.keys()))
+    parser.add_argument("-r","--repeat",  type=int,  help="number of runs per case",default=1)
+    parser.add_argument("-o","--out",     help="JSON output file",default="jumeg_noise_reducer_benchmark.json")
+    parser.add_argument("-tmp","--tmpdir",help="directory for the synthetic recording",default=None)
+    parser.add_argument("-v","--verbose", action="store_true",help="verbose mode")
+
+    return parser.parse_args(),parser
+
+
+def make_recording(fname,duration=300.0,sfreq=1017.25,nsig=248,nref=23,line_freq=50.0,seed=42):
+    """
+    write a synthetic recording with create_dummy_raw()
+
+    return per-channel variance of the signal channels
+    """
+    from jumeg.jumeg_utils import create_dummy_raw
+
+    rng   = np.random.RandomState(seed)
+    times = np.arange(int(duration * sfreq)) / sfreq
+
+#--- reference noise: white, line noise + harmonics, low-frequency drifts
+    refs  = 2e-14 * rng.randn(nref,times.size)
+    for harmonic in (1,2,3):
+        amp   = 1e-13 / harmonic * rng.rand(nref,1)
+        phase = 2.0 * np.pi * rng.rand(nref,1)
+        refs += amp * np.sin(2.0 * np.pi * harmonic * line_freq * times + phase)
+    for flow in (0.05,0.2,0.7):
+        amp   = 2e-13 * rng.rand(nref,1)
+        phase = 2.0 * np.pi * rng.rand(nref,1)
+        refs += amp * np.sin(2.0 * np.pi * flow * times + phase)
+
+#--- signals: mixture of references + sensor noise + DC offset
+    sigs  = np.dot(0.3 * rng.randn(nsig,nref),refs)
+    sigs += 1e-14 * rng.randn(nsig,times.size)
+    sigs += 1e-12 * rng.randn(nsig,1)
+
+    ch_names = ['MEG %03d' % (k+1) for k in range(nsig)] + ['RFM %03d' % (k+1) for k in range(nref)]
+    ch_types = ['mag'] * nsig + ['ref_meg'] * nref
+    raw = create_dummy_raw(np.concatenate((sigs,refs)),ch_types,sfreq,ch_names,save=True,raw_fname=fname)
+
+    return np.var(raw._data[:nsig],axis=1)
+
+
+def _peak_rss_mb():
+    """peak resident set size of this process (MB)"""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+       return maxrss / 1024.0**2   # bytes
+    return maxrss / 1024.0         # kB
+
+
+def _run_case(variant,kwargs,fname,nsig,queue):
+    """run one case in a fresh process, put the result in queue"""
+    result = dict(error=None,baseline_rss_mb=_peak_rss_mb())
+    try:
+       tc0 = time.clock()
+       tw0 = time.time()
+       if variant == 'nr':
+          from jumeg.jumeg_noise_reducer import noise_reducer
+          raw = noise_reducer(fname,return_raw=True,**kwargs)
+       elif variant == 'hcp':
+          from jumeg.jumeg_noise_reducer_hcp import noise_reducer
+          raw = noise_reducer(fname,return_raw=True,**kwargs)
+       else:
+          from jumeg.jumeg_4raw_data_noise_reducer import noise_reducer_4raw_data
+          raw,fname_out = noise_reducer_4raw_data(fname,save=False,**kwargs)
+       result['walltime'] = time.time() - tw0
+       result['cputime']  = time.clock() - tc0
+       result['peak_rss_mb'] = _peak_rss_mb()
+       result['sigvar_out']  = np.var(raw._data[:nsig],axis=1).tolist()
+    except Exception as err:
+       result['error']     = '%s: %s' % (type(err).__name__,err)
+       result['traceback'] = traceback.format_exc()
+    queue.put(result)
+
+
+def run_case(variant,kwargs,fname,nsig):
+    """run one case in a child process, return the result dict"""
+    queue = multiprocessing.Queue()
+    proc  = multiprocessing.Process(target=_run_case,args=(variant,kwargs,fname,nsig,queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def versions():
+    """versions of the software stack"""
+    import scipy
+    v = dict(python=platform.python_version(),numpy=np.__version__,scipy=scipy.__version__,mne=mne.__version__)
+    try:
+       import subprocess
+       jumeg_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+       v['jumeg'] = subprocess.check_output(['git','-C',jumeg_path,'describe','--always','--dirty']).strip()
+    except Exception:
+       v['jumeg'] = None
+    return v
+
+
+#---- main
+def main():
+    opt,parser = get_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='jumeg_nr_bench_',dir=opt.tmpdir)
+    fname  = os.path.join(tmpdir,'nr_bench-raw.fif')
+    results = []
+    try:
+       print "---> generating %.1f s synthetic recording: %d sig + %d ref channels, %.2f Hz" % (opt.duration,opt.nsig,opt.nref,opt.sfreq)
+       sigvar_in = make_recording(fname,duration=opt.duration,sfreq=opt.sfreq,nsig=opt.nsig,nref=opt.nref,
+                                  line_freq=opt.line_freq,seed=opt.seed)
+
+       for case in opt.cases:
+           variant,kwargs = CASES[case]
+           kwargs = dict(kwargs,verbose=opt.verbose)
+           for irun in range(opt.repeat):
+               res = run_case(variant,kwargs,fname,opt.nsig)
+               res.update(case=case,variant=variant,run=irun,
+                          params=dict((k,v) for k,v in kwargs.items() if k != 'verbose'))
+               if res['error'] is None:
+                  sigvar_out = np.array(res.pop('sigvar_out'))
+                  res['suppression_db'] = 10.0 * np.log10( np.mean(sigvar_in) / np.mean(sigvar_out) )
+                  print "---> %-14s run %d: %8.2f s wall %8.2f s cpu %8.1f MB peak RSS %6.1f dB" % \
+                        (case,irun,res['walltime'],res['cputime'],res['peak_rss_mb'],res['suppression_db'])
+               else:
+                  print "---> %-14s run %d: FAILED %s" % (case,irun,res['error'])
+               results.append(res)
+    finally:
+       shutil.rmtree(tmpdir,ignore_errors=True)
+
+    doc = dict(date=time.strftime('%Y-%m-%dT%H:%M:%S'),host=platform.node(),versions=versions(),
+               data=dict(duration=opt.duration,sfreq=opt.sfreq,nsig=opt.nsig,nref=opt.nref,
+                         line_freq=opt.line_freq,seed=opt.seed),
+               results=results)
+    with open(opt.out,'w') as fout:
+       json.dump(doc,fout,indent=1,sort_keys=True)
+    print "---> results written to %s" % (opt.out)
+
+
+if __name__ == "__main__":
+   main()